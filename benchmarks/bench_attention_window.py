@@ -0,0 +1,69 @@
+"""Dense against sliding-window (banded) self-attention as the sequence grows.
+
+Times forward + backward of MultiHeadSelfAttention with ``attention_type="dense"``
+and ``"sliding_window"`` for every sequence length, records the peak memory of
+the forward pass, and reports the first length where the banded layout is
+faster (the crossover) for every window size.
+
+    python benchmarks/bench_attention_window.py --seq-lens 64 128 256 512 1024 2048 4096 --windows 8 16 32
+"""
+
+import argparse
+
+import torch
+
+import common
+from conformer_rnnt.attention_mechanisms import MultiHeadSelfAttention
+
+
+def measure(module, x, repeats):
+    def step():
+        module(x).sum().backward()
+
+    median, _ = common.time_fn(step, warmup=1, repeats=repeats)
+    with torch.no_grad():
+        memory = common.peak_memory_bytes(lambda: module(x))
+    return median, memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seq-lens", type=int, nargs="+", default=[64, 128, 256, 512, 1024, 2048])
+    parser.add_argument("--windows", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--global-tokens", type=int, default=0)
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--heads", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    dim_head = args.dim // args.heads
+    dense = MultiHeadSelfAttention(args.dim, dim_head=dim_head, heads=args.heads)
+    banded = {w: MultiHeadSelfAttention(args.dim, dim_head=dim_head, heads=args.heads, attention_type="sliding_window",
+                                        attention_window=w, global_tokens=args.global_tokens) for w in args.windows}
+
+    header = f"{'T':>6} {'dense ms':>9} {'dense MB':>9}" + "".join(f" {f'w={w} ms':>9} {f'w={w} MB':>9}" for w in args.windows)
+    print(header)
+    crossover = {}
+    for seq_len in args.seq_lens:
+        x = torch.randn(args.batch, seq_len, args.dim, requires_grad=True)
+        dense_time, dense_memory = measure(dense, x, args.repeats)
+        row = f"{seq_len:>6} {1e3 * dense_time:>9.2f} {dense_memory / 2 ** 20:>9.1f}"
+        for w, module in banded.items():
+            banded_time, banded_memory = measure(module, x, args.repeats)
+            row += f" {1e3 * banded_time:>9.2f} {banded_memory / 2 ** 20:>9.1f}"
+            if banded_time < dense_time:
+                crossover.setdefault(w, seq_len)
+        print(row, flush=True)
+    print()
+    for w in args.windows:
+        where = f"T >= {crossover[w]}" if w in crossover else "not reached"
+        print(f"window {w:>3}: sliding window faster from {where}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Training stall of checkpoint saves and start-up time of inference loads.
+
+Compares a blocking ``torch.save`` of model + ScaledAdam state with
+``CheckpointManager.save`` (time until training can continue, and until the
+file is on disk), and a regular ``torch.load`` + ``load_state_dict`` with
+``load_for_inference`` which maps the weights.
+
+    python benchmarks/bench_checkpoint.py --num-enc-layers 16 --num-dec-layers 16
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import torch
+import torch.nn.functional as F
+
+from conformer_rnnt.adam_variant import ScaledAdam
+from conformer_rnnt.checkpoint import CheckpointManager, load_for_inference
+from conformer_rnnt.conformer_model import ConformerRNNT
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input-dim", type=int, default=128)
+    parser.add_argument("--seq-len", type=int, default=20)
+    parser.add_argument("--hidden-dim", type=int, default=512)
+    parser.add_argument("--output-dim", type=int, default=256)
+    parser.add_argument("--num-enc-layers", type=int, default=16)
+    parser.add_argument("--num-dec-layers", type=int, default=16)
+    parser.add_argument("--directory", default=None, help="default: a temporary directory")
+    args = parser.parse_args()
+
+    def build():
+        return ConformerRNNT(args.input_dim, args.seq_len, args.num_enc_layers, 8, args.hidden_dim, args.output_dim,
+                             args.num_dec_layers)
+
+    model = build()
+    optimizer = ScaledAdam(model.parameters(), lr=1e-5)
+    inputs = torch.randn(2, args.seq_len, args.input_dim)
+    targets = torch.randn(2, args.seq_len, args.output_dim)
+    F.mse_loss(model(inputs, targets), targets).backward()
+    optimizer.step()  # creates both moment estimates
+    num_params = sum(p.numel() for p in model.parameters())
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        path = os.path.join(directory, "blocking.pt")
+        start = time.perf_counter()
+        torch.save({"step": 1, "model": model.state_dict(), "optimizer": optimizer.state_dict()}, path)
+        blocking = time.perf_counter() - start
+        size_mb = os.path.getsize(path) / 2 ** 20
+
+        manager = CheckpointManager(directory, keep_last=1)
+        start = time.perf_counter()
+        async_path = manager.save(1, model, optimizer)
+        stall = time.perf_counter() - start
+        manager.wait()
+        written = time.perf_counter() - start
+        manager.close()
+
+        start = time.perf_counter()
+        state = torch.load(async_path, map_location="cpu", weights_only=True)
+        build().load_state_dict(state["model"])
+        full_load = time.perf_counter() - start
+
+        start = time.perf_counter()
+        load_for_inference(async_path, build())
+        mmap_load = time.perf_counter() - start
+
+    print(f"{num_params:,} parameters, checkpoint {size_mb:.1f} MB")
+    print(f"blocking torch.save          {1e3 * blocking:9.1f} ms training stall")
+    print(f"CheckpointManager.save       {1e3 * stall:9.1f} ms training stall  ({1e3 * written:.1f} ms until on disk)")
+    print(f"torch.load + load_state_dict {1e3 * full_load:9.1f} ms (includes building the model)")
+    print(f"load_for_inference (mmap)    {1e3 * mmap_load:9.1f} ms (includes building the model)")
+
+
+if __name__ == "__main__":
+    main()
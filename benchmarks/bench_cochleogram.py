@@ -0,0 +1,104 @@
+"""Throughput and accuracy of the torch cochleogram frontend.
+
+Accuracy: the FFT implementation against the same filters run as exact
+sample-by-sample recurrences (float64), and against brian2hears when it is
+installed (Gammatone -> clip(x, 0, inf) ** (1/3) -> LowPass(10 Hz), as in
+input_conversion). Errors are relative to the largest reference value.
+
+Throughput: audio-seconds processed per CPU-second (process time summed over
+all threads) and per wall-clock second, by batch size and thread count.
+
+    python benchmarks/bench_cochleogram.py --seconds 10 --batch-sizes 1 8 --threads 1 4
+"""
+
+import argparse
+import time
+
+import torch
+
+from conformer_rnnt.cochleogram import Cochleogram, gammatone_sections, lowpass_section
+
+
+def _lfilter(x, numerator, denominator):
+    # Direct form II transposed, one sample at a time, x (..., channels, samples), coefficients (channels, order + 1)
+    order = numerator.size(-1) - 1
+    numerator, denominator = numerator / denominator[..., :1], denominator / denominator[..., :1]
+    state = x.new_zeros(*x.shape[:-1], order)
+    output = torch.empty_like(x)
+    for n in range(x.size(-1)):
+        sample = x[..., n]
+        y = numerator[..., 0] * sample + state[..., 0]
+        for i in range(order):
+            following = state[..., i + 1] if i + 1 < order else 0.
+            state[..., i] = numerator[..., i + 1] * sample - denominator[..., i + 1] * y + following
+        output[..., n] = y
+    return output
+
+
+def reference_cochleogram(waveform, module):
+    x = waveform.double().unsqueeze(-2).expand(*waveform.shape[:-1], module.cf.numel(), -1).clone()
+    numerator, denominator = gammatone_sections(module.cf, module.sample_rate)
+    for section in range(numerator.size(1)):
+        x = _lfilter(x, numerator[:, section], denominator[:, section])
+    x = x.clamp(min=0) ** module.compression
+    numerator, denominator = lowpass_section(module.lowpass_cutoff, module.sample_rate)
+    return _lfilter(x, numerator[:, 0], denominator[:, 0])
+
+
+def brian2hears_cochleogram(waveform, sample_rate, num_filters, low_freq, high_freq):
+    import numpy as np
+    from brian2 import Hz
+    from brian2hears import FunctionFilterbank, Gammatone, LowPass, Sound, erbspace
+
+    sound = Sound(waveform.double().numpy(), samplerate=sample_rate * Hz)
+    cf = erbspace(low_freq * Hz, high_freq * Hz, num_filters)
+    cochlea = FunctionFilterbank(Gammatone(sound, cf), lambda x: np.clip(x, 0, np.inf) ** (1.0 / 3.0))
+    return torch.from_numpy(LowPass(cochlea, 10 * Hz).process().T)
+
+
+def relative_error(output, reference):
+    return ((output.double() - reference).abs().max() / reference.abs().max()).item()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sample-rate", type=int, default=22050)
+    parser.add_argument("--num-filters", type=int, default=40)
+    parser.add_argument("--low-freq", type=float, default=50.)
+    parser.add_argument("--high-freq", type=float, default=10000.)
+    parser.add_argument("--seconds", type=float, default=10., help="audio per waveform in the throughput runs")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, torch.get_num_threads()])
+    parser.add_argument("--reference-seconds", type=float, default=0.25, help="audio in the accuracy check")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    module = Cochleogram(args.sample_rate, args.num_filters, args.low_freq, args.high_freq)
+
+    # Noise plus a few partials, the onset transient included
+    t = torch.arange(int(args.reference_seconds * args.sample_rate)) / args.sample_rate
+    waveform = 0.1 * torch.randn(t.numel()) + sum(torch.sin(2 * torch.pi * f * t) for f in (220., 880., 3520.))
+    output = module(waveform)
+    print(f"max error vs exact recurrences: {relative_error(output, reference_cochleogram(waveform, module)):.2e}")
+    try:
+        reference = brian2hears_cochleogram(waveform, args.sample_rate, args.num_filters, args.low_freq, args.high_freq)
+        print(f"max error vs brian2hears:       {relative_error(output, reference):.2e}")
+    except ImportError:
+        print("brian2hears not installed, skipped the comparison with it")
+
+    print()
+    print(f"{'batch':>5} {'threads':>7} {'audio s / CPU s':>16} {'audio s / wall s':>17}")
+    for threads in sorted(set(args.threads)):
+        torch.set_num_threads(threads)
+        for batch_size in args.batch_sizes:
+            waveforms = torch.randn(batch_size, int(args.seconds * args.sample_rate))
+            module(waveforms[:, :args.sample_rate])  # warm-up
+            cpu, wall = time.process_time(), time.perf_counter()
+            module(waveforms)
+            cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+            audio = batch_size * args.seconds
+            print(f"{batch_size:>5} {threads:>7} {audio / cpu:>16.1f} {audio / wall:>17.1f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
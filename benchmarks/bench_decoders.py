@@ -0,0 +1,79 @@
+"""Decoding speed of the DecoderRNNT prediction networks.
+
+Emits ``--num-tokens`` symbols one at a time, the way greedy transducer decoding
+feeds the prediction network. The bidirectional decoder has to re-run the whole
+prefix for every symbol, the causal variants advance with ``DecoderRNNT.step``.
+
+    python benchmarks/bench_decoders.py --batch 4 --num-tokens 64 128
+"""
+
+import argparse
+
+import torch
+
+from common import time_fn
+from conformer_rnnt.decoders import DecoderRNNT
+
+
+def decode_prefix(decoder, tokens):
+    # Without a step API every new symbol re-runs the full prefix
+    for u in range(1, tokens.size(1) + 1):
+        outputs, _ = decoder(tokens[:, :u])
+        last = outputs[:, -1]
+    return last
+
+
+def decode_step(decoder, tokens):
+    state = None
+    for u in range(tokens.size(1)):
+        last, state = decoder.step(tokens[:, u], state)
+    return last
+
+
+def time_decode(decoder, tokens, repeats):
+    fn = decode_step if decoder.supports_step else decode_prefix
+    with torch.inference_mode():
+        median, _ = time_fn(lambda: fn(decoder, tokens), warmup=1, repeats=repeats)
+    return median
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--vocab", type=int, default=256)
+    parser.add_argument("--hidden-dim", type=int, default=512)
+    parser.add_argument("--output-dim", type=int, default=256)
+    parser.add_argument("--num-layers", type=int, default=4)
+    parser.add_argument("--context-size", type=int, default=2)
+    parser.add_argument("--num-tokens", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+
+    variants = [
+        ("bidirectional lstm", dict(decoder_type="bidirectional", rnn_type="lstm")),
+        ("unidirectional lstm", dict(decoder_type="unidirectional", rnn_type="lstm")),
+        ("unidirectional gru", dict(decoder_type="unidirectional", rnn_type="gru")),
+        ("stateless conv", dict(decoder_type="stateless", context_size=args.context_size)),
+    ]
+
+    print(f"batch={args.batch} vocab={args.vocab} hidden={args.hidden_dim} layers={args.num_layers} threads={torch.get_num_threads()}")
+    print(f"{'decoder':<22}{'params':>10}" + "".join(f"{f'U={u} ms/tok':>16}" for u in args.num_tokens))
+    for name, kwargs in variants:
+        decoder = DecoderRNNT(args.vocab, args.hidden_dim, args.output_dim, num_layers=args.num_layers,
+                              enc_has_cont_val=False, **kwargs).eval()
+        num_params = sum(p.numel() for p in decoder.parameters())
+        row = f"{name:<22}{num_params:>10,}"
+        for num_tokens in args.num_tokens:
+            tokens = torch.randint(1, args.vocab, (args.batch, num_tokens))
+            seconds = time_decode(decoder, tokens, args.repeats)
+            row += f"{1e3 * seconds / num_tokens:>16.3f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Linear (kernelized) against dense softmax self-attention: speed and quality on synthetic data.
+
+Speed: forward + backward of MultiHeadSelfAttention for every sequence length
+with dense attention, linear attention with the elu + 1 and the random-feature
+maps, and the causal (prefix-sum) linear form.
+
+Quality, on the same synthetic task for every variant: a frozen dense
+attention layer (the teacher) maps random sequences to targets, and a fresh
+layer of each variant is trained for ``--train-steps`` Adam steps to reproduce
+them. Reported is the held-out MSE relative to the target variance (0 is
+perfect, 1 is predicting the mean). Also reported is how closely the random
+features approximate the softmax kernel without training, by number of
+features.
+
+    python benchmarks/bench_linear_attention.py --seq-lens 128 512 2048 8192
+"""
+
+import argparse
+
+import torch
+import torch.nn.functional as F
+
+import common
+from conformer_rnnt.attention_mechanisms import DotProductAttention, LinearAttention, MultiHeadSelfAttention
+
+VARIANTS = {
+    "dense": dict(attention_type="dense"),
+    "linear_elu": dict(attention_type="linear", feature_map="elu"),
+    "linear_random": dict(attention_type="linear", feature_map="random"),
+    "linear_elu_causal": dict(attention_type="linear", feature_map="elu", causal=True),
+}
+
+
+def build(variant, args):
+    return MultiHeadSelfAttention(args.dim, dim_head=args.dim // args.heads, heads=args.heads, **VARIANTS[variant])
+
+
+def speed(args):
+    print(f"{'T':>6}" + "".join(f" {name + ' ms':>20}" for name in VARIANTS))
+    modules = {name: build(name, args) for name in VARIANTS}
+    for seq_len in args.seq_lens:
+        x = torch.randn(args.batch, seq_len, args.dim, requires_grad=True)
+        row = f"{seq_len:>6}"
+        for name, module in modules.items():
+            if name == "dense" and seq_len > args.max_dense_len:
+                row += f" {'-':>20}"
+                continue
+            median, _ = common.time_fn(lambda: module(x).sum().backward(), warmup=1, repeats=args.repeats)
+            row += f" {1e3 * median:>20.2f}"
+        print(row, flush=True)
+
+
+def quality(args):
+    torch.manual_seed(0)
+    teacher = build("dense", args).eval()
+    for p in teacher.parameters():
+        p.requires_grad_(False)
+    seq_len = args.quality_seq_len
+    test = torch.randn(64, seq_len, args.dim)
+    with torch.no_grad():
+        test_targets = teacher(test)
+    variance = test_targets.var().item()
+    print(f"{'variant':>20} {'relative MSE':>13}")
+    for name in ("dense", "linear_elu", "linear_random"):
+        torch.manual_seed(1)
+        student = build(name, args)
+        optimizer = torch.optim.Adam(student.parameters(), lr=args.lr)
+        for _ in range(args.train_steps):
+            x = torch.randn(args.batch, seq_len, args.dim)
+            with torch.no_grad():
+                y = teacher(x)
+            loss = F.mse_loss(student(x), y)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+        with torch.no_grad():
+            error = F.mse_loss(student.eval()(test), test_targets).item()
+        print(f"{name:>20} {error / variance:>13.4f}", flush=True)
+
+    print()
+    print(f"random-feature approximation of softmax attention (T={seq_len}, dim_head={args.dim // args.heads})")
+    print(f"{'features':>9} {'relative error':>15}")
+    q, k, v = (0.5 * torch.randn(4, args.heads, seq_len, args.dim // args.heads) for _ in range(3))
+    exact = DotProductAttention()(q, k, v)
+    for num_features in (16, 64, 256, 1024):
+        approx = LinearAttention(args.dim // args.heads, "random", num_features=num_features)(q, k, v)
+        print(f"{num_features:>9} {((approx - exact).norm() / exact.norm()).item():>15.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seq-lens", type=int, nargs="+", default=[128, 512, 2048, 8192])
+    parser.add_argument("--max-dense-len", type=int, default=4096, help="longer sequences skip dense attention")
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--heads", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--quality-seq-len", type=int, default=128)
+    parser.add_argument("--train-steps", type=int, default=300)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--skip-quality", action="store_true")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    speed(args)
+    if not args.skip_quality:
+        print()
+        quality(args)
+
+
+if __name__ == "__main__":
+    main()
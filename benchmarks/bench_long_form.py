@@ -0,0 +1,83 @@
+"""Long-recording transcription: real-time factor by core count, and stitching accuracy.
+
+Real-time factor (processing seconds per second of audio, lower is better) of
+LongFormTranscriber on a synthetic recording, with all windows batched in one
+process using N torch threads, and with N single-threaded worker processes.
+
+Stitching accuracy compares, on clips of exactly ``seq_len`` frames, the
+single-pass decoding with the stitched decoding of shorter overlapping windows
+of the same clip: token accuracy (1 - edit distance / reference length) and F1
+of (token, frame) events within one frame.
+
+    python benchmarks/bench_long_form.py --minutes 10 --cores 1 2 4 8
+"""
+
+import argparse
+import time
+
+import torch
+
+from conformer_rnnt.conformer_model import ConformerRNNT
+from conformer_rnnt.long_form import DEFAULT_FRAME_RATE, LongFormTranscriber, edit_distance, event_f1
+
+
+def real_time_factor(model, features, seconds, **kwargs):
+    with LongFormTranscriber(model, **kwargs) as transcriber:
+        transcriber.transcribe(features[:4 * transcriber.window])  # warm-up, starts the workers
+        start = time.perf_counter()
+        transcriber.transcribe(features)
+        return (time.perf_counter() - start) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, default=2.)
+    parser.add_argument("--cores", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--input-dim", type=int, default=128)
+    parser.add_argument("--seq-len", type=int, default=64)
+    parser.add_argument("--overlap", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--num-enc-layers", type=int, default=4)
+    parser.add_argument("--num-dec-layers", type=int, default=2)
+    parser.add_argument("--hidden-dim", type=int, default=256)
+    parser.add_argument("--output-dim", type=int, default=64)
+    parser.add_argument("--decoder-type", default="unidirectional")
+    parser.add_argument("--frame-rate", type=float, default=DEFAULT_FRAME_RATE, help="feature frames per second")
+    parser.add_argument("--clips", type=int, default=20, help="clips for the stitching accuracy")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    model = ConformerRNNT(args.input_dim, args.seq_len, args.num_enc_layers, 8, args.hidden_dim, args.output_dim,
+                          args.num_dec_layers, decoder_type=args.decoder_type).eval()
+    num_frames = int(args.minutes * 60 * args.frame_rate)
+    features = torch.randn(num_frames, args.input_dim)
+    seconds = num_frames / args.frame_rate
+
+    print(f"{args.minutes:g} min recording, {num_frames} frames, window {args.seq_len}, overlap {args.overlap}")
+    print(f"{'cores':>5} {'batched RTF':>12} {'processes RTF':>14}")
+    for cores in args.cores:
+        torch.set_num_threads(cores)
+        batched = real_time_factor(model, features, seconds, overlap=args.overlap, batch_size=args.batch_size)
+        pooled = real_time_factor(model, features, seconds, overlap=args.overlap, batch_size=args.batch_size,
+                                  processes=cores, threads_per_process=1)
+        print(f"{cores:>5} {batched:>12.4f} {pooled:>14.4f}")
+    torch.set_num_threads(max(args.cores))
+
+    print()
+    print(f"stitching vs single pass on {args.clips} clips of {args.seq_len} frames")
+    print(f"{'window':>6} {'overlap':>7} {'token acc':>10} {'event F1':>9}")
+    clips = torch.randn(args.clips, args.seq_len, args.input_dim)
+    references = model.recognize(clips, return_timestamps=True)
+    for window in (args.seq_len // 2, 3 * args.seq_len // 4):
+        for overlap in (0, window // 4, window // 2):
+            transcriber = LongFormTranscriber(model, window=window, overlap=overlap, batch_size=args.batch_size)
+            accuracy, f1 = 0., 0.
+            for clip, ref_tokens, ref_frames in zip(clips, *references):
+                tokens, frames = transcriber.transcribe(clip)
+                accuracy += 1 - edit_distance(ref_tokens, tokens) / max(1, len(ref_tokens))
+                f1 += event_f1((ref_tokens, ref_frames), (tokens, frames))
+            print(f"{window:>6} {overlap:>7} {accuracy / args.clips:>10.3f} {f1 / args.clips:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
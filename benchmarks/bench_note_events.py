@@ -0,0 +1,184 @@
+"""Note-event post-processing throughput on dense polyphonic token streams.
+
+Builds ``--sequences`` synthetic transcriptions of ``--minutes`` each with
+``--notes-per-second`` notes (random pitches, durations and velocities, many
+overlapping), encodes them into onset / offset / velocity tokens, and times in
+events (tokens) per second:
+
+    loop        per-token Python pairing over the same arrays, with a precomputed token table
+    vectorized  events_to_notes on the flat arrays of the whole batch
+    streaming   NoteStreamer fed chunks of ``--chunk-seconds`` across all sequences
+    midi        notes_to_midi for the whole batch (notes in, bytes out)
+
+The vectorized and streaming notes are checked against the loop, on the clean
+streams and on random token streams (orphan offsets, ties, re-strikes), and the
+MIDI bytes are parsed back into notes.
+
+    python benchmarks/bench_note_events.py --sequences 16 --minutes 5 --notes-per-second 40
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from conformer_rnnt.long_form import DEFAULT_FRAME_RATE
+from conformer_rnnt.note_events import (OFFSET, ONSET, TIE, VELOCITY, NoteStreamer, NoteVocabulary, Notes,
+                                        concat_notes, events_to_notes, max_symbols_per_frame, notes_to_midi)
+
+
+def synthetic_notes(vocab, sequences, frames, notes_per_second, rng):
+    count = int(notes_per_second * frames / DEFAULT_FRAME_RATE)
+    sequence = np.repeat(np.arange(sequences), count)
+    pitch = rng.integers(vocab.lowest_pitch, vocab.lowest_pitch + vocab.num_pitches, sequences * count)
+    onset = rng.integers(0, frames - 1, sequences * count)
+    offset = np.minimum(onset + rng.integers(1, int(2 * DEFAULT_FRAME_RATE), sequences * count), frames)
+    velocity = vocab.velocities[vocab.velocity_bin(rng.integers(1, 128, sequences * count))]
+    notes = Notes(sequence, pitch, onset, offset, velocity)
+    # Overlapping notes of one pitch become a re-strike, keep the encoding unambiguous by ending the earlier one there
+    order = np.lexsort((notes.onset, notes.pitch, notes.sequence))
+    notes = Notes(*(a[order] for a in notes))
+    same = (notes.sequence[1:] == notes.sequence[:-1]) & (notes.pitch[1:] == notes.pitch[:-1])
+    offset = notes.offset.copy()
+    offset[:-1] = np.where(same, np.minimum(offset[:-1], notes.onset[1:]), offset[:-1])
+    keep = offset > notes.onset
+    return Notes(*(a[keep] for a in notes._replace(offset=offset)))
+
+
+def loop_notes(vocab, sequence, frame, token, end_frames, initial_velocity=64):
+    """Reference pairing, one token at a time."""
+    kinds, values = (a.tolist() for a in vocab.classify(np.arange(len(vocab))))
+    rows = []
+    starts = np.flatnonzero(np.r_[True, sequence[1:] != sequence[:-1]]) if len(sequence) else []
+    bounds = list(starts) + [len(sequence)]
+    for begin, stop in zip(bounds[:-1], bounds[1:]):
+        seq = int(sequence[begin])
+        velocity, sounding = initial_velocity, {}
+        for f, t in zip(frame[begin:stop].tolist(), token[begin:stop].tolist()):
+            kind, value = kinds[t], values[t]
+            if kind == VELOCITY:
+                velocity = value
+            elif kind == ONSET:
+                if value in sounding and f > sounding[value][0]:
+                    rows.append((seq, value, sounding[value][0], f, sounding[value][1]))
+                sounding[value] = (f, velocity)
+            elif kind == OFFSET and value in sounding:
+                onset, v = sounding.pop(value)
+                rows.append((seq, value, onset, max(f, onset + 1), v))
+            elif kind == TIE and value not in sounding:
+                sounding[value] = (f, velocity)
+        for pitch, (onset, v) in sounding.items():
+            rows.append((seq, pitch, onset, max(int(end_frames[seq]), onset + 1), v))
+    return rows
+
+
+def as_rows(notes):
+    return sorted(zip(*(a.tolist() for a in notes)))
+
+
+def read_midi(data, ticks_per_frame):
+    """Notes of a type 0 file written by notes_to_midi, as (pitch, onset, offset, velocity) in frames."""
+    position, tick, sounding, rows = 22, 0, {}, []
+    end = len(data)
+    while position < end:
+        delta = 0
+        while True:
+            byte = data[position]
+            position += 1
+            delta = (delta << 7) | (byte & 0x7f)
+            if byte < 0x80:
+                break
+        tick += delta
+        status = data[position]
+        if status == 0xff:
+            position += 3 + data[position + 2]
+        elif status & 0xf0 == 0xc0:
+            position += 2
+        else:
+            pitch, velocity = data[position + 1], data[position + 2]
+            position += 3
+            if status & 0xf0 == 0x90:
+                sounding[pitch] = (tick, velocity)
+            else:
+                onset, velocity = sounding.pop(pitch)
+                rows.append((pitch, round(onset / ticks_per_frame), round(tick / ticks_per_frame), velocity))
+    return sorted(rows)
+
+
+def rate(events, seconds):
+    return f"{events / seconds:>14,.0f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sequences", type=int, default=8)
+    parser.add_argument("--minutes", type=float, default=2.)
+    parser.add_argument("--notes-per-second", type=float, default=40.)
+    parser.add_argument("--chunk-seconds", type=float, default=2.)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vocab = NoteVocabulary()
+    frames = int(args.minutes * 60 * DEFAULT_FRAME_RATE)
+    notes = synthetic_notes(vocab, args.sequences, frames, args.notes_per_second, rng)
+    sequence, frame, token = vocab.encode(notes)
+    end_frames = np.full(args.sequences, frames)
+    events = len(token)
+    print(f"{args.sequences} sequences x {args.minutes:g} min, {len(notes.pitch):,} notes, {events:,} events, "
+          f"up to {max_symbols_per_frame(sequence, frame)} per frame")
+    print(f"{'stage':>10} {'seconds':>9} {'events/s':>14}")
+
+    start = time.perf_counter()
+    reference = loop_notes(vocab, sequence, frame, token, end_frames)
+    loop_seconds = time.perf_counter() - start
+    print(f"{'loop':>10} {loop_seconds:>9.3f} {rate(events, loop_seconds)}")
+
+    start = time.perf_counter()
+    decoded = events_to_notes(vocab, sequence, frame, token, end_frames)
+    seconds = time.perf_counter() - start
+    print(f"{'vectorized':>10} {seconds:>9.3f} {rate(events, seconds)}   x{loop_seconds / seconds:.1f} vs loop")
+    assert as_rows(decoded) == sorted(reference) == as_rows(notes), "vectorized notes differ"
+
+    # Chunks of the time axis across all sequences, as windows of a long recording arrive
+    chunk = int(args.chunk_seconds * DEFAULT_FRAME_RATE)
+    bounds = np.searchsorted(frame[np.lexsort((frame,))], np.arange(0, frames + chunk, chunk))
+    by_time = np.lexsort((np.arange(events), frame))
+    streamer = NoteStreamer(vocab)
+    start = time.perf_counter()
+    emitted = []
+    for begin, stop in zip(bounds[:-1], bounds[1:]):
+        index = np.sort(by_time[begin:stop], kind="stable")
+        emitted.append(streamer.push(sequence[index], frame[index], token[index]))
+    emitted.append(streamer.flush(end_frames))
+    seconds = time.perf_counter() - start
+    print(f"{'streaming':>10} {seconds:>9.3f} {rate(events, seconds)}   {len(bounds) - 1} chunks")
+    assert as_rows(concat_notes(*emitted)) == sorted(reference), "streamed notes differ"
+
+    start = time.perf_counter()
+    files = notes_to_midi(decoded)
+    seconds = time.perf_counter() - start
+    print(f"{'midi':>10} {seconds:>9.3f} {rate(2 * len(decoded.pitch), seconds)}   "
+          f"{sum(map(len, files.values())) / 2 ** 20:.2f} MB")
+    ticks_per_frame = 480 * 1e6 / 500000 / DEFAULT_FRAME_RATE
+    for seq in range(min(2, args.sequences)):
+        midi_rows = read_midi(files[seq], ticks_per_frame)
+        rows = sorted((p, on, off, v) for s, p, on, off, v in as_rows(decoded) if s == seq)
+        assert midi_rows == rows, "MIDI round trip differs"
+
+    # Noisy streams: any token, including orphan offsets, ties and re-strikes
+    noisy_sequence = np.sort(rng.integers(0, args.sequences, 20000))
+    noisy_frame = np.sort(rng.integers(0, 2000, 20000))
+    noisy_token = rng.integers(0, len(vocab), 20000)
+    noisy_end = np.full(args.sequences, 2000)
+    expected = sorted(loop_notes(vocab, noisy_sequence, noisy_frame, noisy_token, noisy_end))
+    assert as_rows(events_to_notes(vocab, noisy_sequence, noisy_frame, noisy_token, noisy_end)) == expected
+    streamer = NoteStreamer(vocab)
+    parts = [streamer.push(noisy_sequence[i:i + 997], noisy_frame[i:i + 997], noisy_token[i:i + 997])
+             for i in range(0, 20000, 997)]
+    assert as_rows(concat_notes(*parts, streamer.flush(noisy_end))) == expected
+    print("checks passed: vectorized and streaming match the loop, MIDI round trip")
+
+
+if __name__ == "__main__":
+    main()
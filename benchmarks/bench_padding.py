@@ -0,0 +1,83 @@
+"""Padding-aware encoder execution on realistic length distributions.
+
+Batches of ``seq_len`` frames hold utterances of random length (log-normal
+around ``--median`` of the window, or uniform), zero padded. For every
+distribution the encoder runs three ways:
+
+    none    lengths not given, padding is processed like audio (the old behaviour)
+    mask    key padding masks in attention, padded frames zeroed before the depthwise convs, masked BatchNorm
+    packed  mask, and the feed-forward, norm and pointwise conv layers run on the valid frames only
+
+and the table reports the share of padded (wasted) frames, forward and
+forward + backward time, valid frames per second, and how much the outputs on
+valid frames move when the padding is filled with noise instead of zeros
+(0 means padding no longer leaks into the result).
+
+    python benchmarks/bench_padding.py --seq-len 256 --batch 16 --median 0.4
+"""
+
+import argparse
+
+import torch
+
+import common
+from conformer_rnnt.conformer_model import Conformer, lengths_to_padding_mask
+
+
+def sample_lengths(distribution, batch, seq_len, median, generator):
+    if distribution == "lognormal":
+        lengths = torch.exp(torch.randn(batch, generator=generator) * 0.5) * median * seq_len
+    else:
+        lengths = torch.rand(batch, generator=generator) * seq_len
+    return lengths.round().long().clamp(1, seq_len)
+
+
+def run(encoder, x, lengths, mode):
+    encoder.pack_padded = mode == "packed"
+    return encoder(x, None if mode == "none" else lengths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--distributions", nargs="+", default=["lognormal", "uniform"], choices=["lognormal", "uniform"])
+    parser.add_argument("--median", type=float, default=0.4, help="median length of the log-normal, share of seq_len")
+    parser.add_argument("--seq-len", type=int, default=128)
+    parser.add_argument("--batch", type=int, default=16)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--kernel-size", type=int, default=8)
+    parser.add_argument("--attention", default="dense", choices=["dense", "sliding_window", "linear"])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    torch.manual_seed(args.seed)
+    generator = torch.Generator().manual_seed(args.seed)
+    encoder = Conformer(args.dim, seq_length=args.seq_len, depth=args.depth, output_dim=args.dim,
+                        conv_kernel_size=args.kernel_size, vertical_attention=args.attention)
+    print(common.environment())
+    print(f"{'lengths':>9} {'mode':>6} {'padded':>7} {'fwd ms':>8} {'fwd+bwd ms':>11} {'valid frames/s':>15} "
+          f"{'leak':>9}")
+    for distribution in args.distributions:
+        lengths = sample_lengths(distribution, args.batch, args.seq_len, args.median, generator)
+        mask = lengths_to_padding_mask(lengths, args.seq_len)
+        x = torch.randn(args.batch, args.seq_len, args.dim, generator=generator).masked_fill(mask.unsqueeze(-1), 0.)
+        noisy = x.masked_fill(mask.unsqueeze(-1), 1.) + torch.randn_like(x) * mask.unsqueeze(-1)
+        padded = mask.float().mean().item()
+        for mode in ("none", "mask", "packed"):
+            encoder.eval()
+            with torch.no_grad():
+                forward, _ = common.time_fn(lambda: run(encoder, x, lengths, mode), repeats=args.repeats)
+                leak = (run(encoder, x, lengths, mode) - run(encoder, noisy, lengths, mode))[~mask].abs().max().item()
+            encoder.train()
+            backward, _ = common.time_fn(lambda: run(encoder, x, lengths, mode).sum().backward(), repeats=args.repeats)
+            valid_rate = lengths.sum().item() / forward
+            print(f"{distribution:>9} {mode:>6} {padded:>7.1%} {1e3 * forward:>8.1f} {1e3 * backward:>11.1f} "
+                  f"{valid_rate:>15,.0f} {leak:>9.2e}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
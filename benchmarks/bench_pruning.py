@@ -0,0 +1,124 @@
+"""Structured pruning: accuracy / latency / size trade-off curve.
+
+Starting from one model (random weights, or ``--checkpoint``), every operating
+point removes the same share of attention heads, FFN hidden channels and
+conv-module channels in every block (``--levels``) plus a number of whole
+blocks per branch (``--blocks``), ranked by Taylor importance on calibration
+batches, then fine-tunes for ``--fine-tune-steps`` by distillation from the
+unpruned model. Reported per point:
+
+    params, MB      parameters and the size of parameters + buffers
+    ms/batch        CPU latency of greedy ``recognize`` on one batch
+    rel. MSE        encoder output error relative to the unpruned encoder, held-out batches
+    token acc       1 - edit distance / length of the greedy transcription against the unpruned model's
+
+``--save-dir`` writes every operating point as a checkpoint holding its
+pruning plan, which ``transcription_server --checkpoint`` serves as is.
+
+    python benchmarks/bench_pruning.py --levels 0 0.25 0.5 0.75 --blocks 0 1 2 --fine-tune-steps 50
+"""
+
+import argparse
+import copy
+import json
+import os
+
+import torch
+import torch.nn.functional as F
+
+import common
+from conformer_rnnt.checkpoint import load_for_inference
+from conformer_rnnt.long_form import edit_distance
+from conformer_rnnt.model_config import MODEL_ARGS, add_model_arguments, build_model, with_checkpoint_config
+from conformer_rnnt.pruning import apply_plan, fine_tune, importance, model_size, plan_pruning, save_pruned
+
+
+def make_batches(count, batch, seq_len, input_dim, generator):
+    batches = []
+    for _ in range(count):
+        features = torch.randn(batch, seq_len, input_dim, generator=generator)
+        lengths = torch.randint(seq_len // 2, seq_len + 1, (batch,), generator=generator)
+        batches.append((features, lengths))
+    return batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", type=float, nargs="+", default=[0., 0.25, 0.5, 0.75],
+                        help="share of heads / FFN / conv channels removed")
+    parser.add_argument("--blocks", type=int, nargs="+", default=[0, 1], help="blocks removed per branch")
+    parser.add_argument("--round-to", type=int, default=8)
+    parser.add_argument("--fine-tune-steps", type=int, default=30)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--calibration-batches", type=int, default=4)
+    parser.add_argument("--eval-batches", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=8)
+    add_model_arguments(parser)
+    parser.set_defaults(seq_len=32, num_enc_layers=8, hidden_dim=256, output_dim=64, num_dec_layers=2,
+                        conv_dropout=0., decoder_type="unidirectional")
+    parser.add_argument("--checkpoint", default=None,
+                        help="start from this model, built from its stored config (the model flags are only used for "
+                             "checkpoints without one)")
+    parser.add_argument("--save-dir", default=None, help="write every operating point here as a pruned checkpoint")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="write the curve to this path")
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    torch.manual_seed(args.seed)
+    generator = torch.Generator().manual_seed(args.seed)
+    if args.checkpoint:
+        args = with_checkpoint_config(args, args.checkpoint)
+    teacher = build_model(args)
+    if args.checkpoint:
+        load_for_inference(args.checkpoint, teacher)
+    teacher.eval()
+    calibration = make_batches(args.calibration_batches, args.batch, args.seq_len, args.input_dim, generator)
+    held_out = make_batches(args.eval_batches, args.batch, args.seq_len, args.input_dim, generator)
+    with torch.no_grad():
+        targets = {id(batch): teacher.encoder(*batch) for batch in calibration + held_out}
+    references = [teacher.recognize(*batch) for batch in held_out]
+
+    def loss_fn(model, batch):
+        return F.mse_loss(model.encoder(*batch), targets[id(batch)])
+
+    scores = importance(teacher, loss_fn, calibration)
+    print(common.environment())
+    print(f"{'level':>5} {'blocks':>6} {'params':>10} {'MB':>7} {'ms/batch':>9} {'rel. MSE':>9} {'token acc':>9}")
+    curve = []
+    for blocks in args.blocks:
+        for level in args.levels:
+            plan = plan_pruning(teacher, scores, heads=level, ffn=level, conv=level, vertical_blocks=blocks,
+                                horizontal_blocks=blocks, round_to=args.round_to)
+            model = apply_plan(copy.deepcopy(teacher), plan)
+            if plan and args.fine_tune_steps:
+                fine_tune(model, loss_fn, calibration, args.fine_tune_steps, lr=args.lr)
+            model.eval()
+            with torch.no_grad():
+                error = sum(loss_fn(model, batch).item() / targets[id(batch)].pow(2).mean().item()
+                            for batch in held_out) / len(held_out)
+            accuracy = []
+            for batch, reference in zip(held_out, references):
+                for ref, hyp in zip(reference, model.recognize(*batch)):
+                    accuracy.append(1 - edit_distance(ref, hyp) / max(1, len(ref)))
+            latency, _ = common.time_fn(lambda: model.recognize(*held_out[0]), repeats=args.repeats)
+            parameters, size = model_size(model)
+            point = {"level": level, "blocks": blocks, "params": parameters, "bytes": size, "latency_ms": 1e3 * latency,
+                     "relative_mse": error, "token_accuracy": sum(accuracy) / len(accuracy)}
+            curve.append(point)
+            if args.save_dir:
+                os.makedirs(args.save_dir, exist_ok=True)
+                config = {key: getattr(args, key) for key in MODEL_ARGS if hasattr(args, key)}
+                save_pruned(os.path.join(args.save_dir, f"pruned-{level:.2f}-{blocks}.pt"), model, plan, config)
+            print(f"{level:>5.2f} {blocks:>6} {parameters:>10,} {size / 2 ** 20:>7.2f} {point['latency_ms']:>9.1f} "
+                  f"{error:>9.4f} {point['token_accuracy']:>9.3f}", flush=True)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"environment": common.environment(), "curve": curve}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
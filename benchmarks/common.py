@@ -0,0 +1,53 @@
+"""Timing and memory helpers shared by the benchmark scripts (CPU only)."""
+
+import os
+import platform
+import statistics
+import time
+
+import torch
+from torch.profiler import ProfilerActivity, profile
+
+
+def time_fn(fn, warmup=1, repeats=5, setup=None):
+    """Median and minimum wall time of ``fn()`` in seconds; ``setup()`` runs untimed before every call."""
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        fn()
+    timings = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), min(timings)
+
+
+def peak_memory_bytes(fn):
+    """Peak CPU memory allocated by torch while ``fn()`` runs, above what was allocated before it.
+
+    Replays the allocator events recorded by ``torch.profiler`` in order, so the
+    resolution is one top-level operator: memory allocated and released inside
+    a single op is not seen.
+    """
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        fn()
+    events = sorted((e for e in prof.events() if e.cpu_parent is None), key=lambda e: e.time_range.start)
+    current = peak = 0
+    for event in events:
+        current += event.cpu_memory_usage
+        peak = max(peak, current)
+    return peak
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "num_threads": torch.get_num_threads(),
+    }
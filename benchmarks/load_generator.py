@@ -0,0 +1,204 @@
+"""Load generator for conformer-rnnt/transcription_server.py.
+
+Sends ``/transcribe`` requests of random length at a fixed rate (open loop,
+Poisson arrivals) and reports achieved throughput against p50/p99 latency,
+one row per rate, followed by the server's own /metrics. ``--spawn`` starts a
+server in a subprocess with the given batching settings (and any arguments
+after ``--``), otherwise it connects to a running one.
+
+    python benchmarks/load_generator.py --spawn --rates 10 20 50 100 --duration 10 -- --num-enc-layers 4
+    python benchmarks/load_generator.py --port 8000 --rates 50 --duration 30
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+
+
+class Connection:
+    """Keep-alive HTTP/1.1 client connection over TCP or a Unix socket."""
+
+    def __init__(self, args):
+        self.args = args
+        self.reader = self.writer = None
+
+    async def open(self):
+        if self.args.unix_socket:
+            self.reader, self.writer = await asyncio.open_unix_connection(self.args.unix_socket)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+
+    async def request(self, method, path, payload = None):
+        if self.writer is None:
+            await self.open()
+        body = b"" if payload is None else json.dumps(payload).encode()
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                          f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            if key.strip().lower() == "content-length":
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class ConnectionPool:
+    def __init__(self, args):
+        self.args = args
+        self.idle = []
+
+    async def request(self, method, path, payload = None):
+        connection = self.idle.pop() if self.idle else Connection(self.args)
+        try:
+            result = await connection.request(method, path, payload)
+        except Exception:
+            connection.close()
+            raise
+        self.idle.append(connection)
+        return result
+
+    def close(self):
+        for connection in self.idle:
+            connection.close()
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def make_requests(args, count):
+    rng = random.Random(args.seed)
+    requests = []
+    for _ in range(min(count, 64)):
+        frames = rng.randint(args.min_frames, args.seq_len)
+        requests.append({"features": [[rng.gauss(0., 1.) for _ in range(args.input_dim)] for _ in range(frames)]})
+    return requests
+
+
+async def run_rate(args, pool, rate, requests):
+    """Open-loop load: requests start at Poisson arrival times whether or not earlier ones have finished."""
+    rng = random.Random(args.seed + int(rate))
+    latencies, errors = [], 0
+
+    async def one(request):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            status, _ = await pool.request("POST", "/transcribe", request)
+        except (OSError, asyncio.IncompleteReadError):
+            status = None
+        if status == 200:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors += 1
+
+    tasks = []
+    start = time.perf_counter()
+    next_arrival = start
+    i = 0
+    while next_arrival - start < args.duration:
+        delay = next_arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(one(requests[i % len(requests)])))
+        i += 1
+        next_arrival += rng.expovariate(rate)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    return {
+        "offered_rps": rate,
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": 1e3 * percentile(latencies, 50) if latencies else None,
+        "p99_ms": 1e3 * percentile(latencies, 99) if latencies else None,
+        "completed": len(latencies),
+        "errors": errors,
+    }
+
+
+async def wait_for_server(pool, timeout):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            await pool.request("GET", "/health")
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def run(args):
+    pool = ConnectionPool(args)
+    try:
+        await wait_for_server(pool, args.startup_timeout)
+        requests = make_requests(args, int(max(args.rates) * args.duration))
+        await run_rate(args, pool, max(1., min(args.rates)), requests[:4])  # warm-up, not reported
+        results = []
+        print(f"{'offered/s':>10} {'done/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for rate in args.rates:
+            result = await run_rate(args, pool, rate, requests)
+            results.append(result)
+            fmt = lambda v: f"{v:9.1f}" if v is not None else f"{'-':>9}"
+            print(f"{rate:>10.1f} {result['throughput_rps']:>8.1f} {fmt(result['p50_ms'])} {fmt(result['p99_ms'])} "
+                  f"{result['errors']:>7}", flush=True)
+        _, metrics = await pool.request("GET", "/metrics")
+        print("server metrics:", json.dumps(metrics))
+        return {"rates": results, "server": metrics}
+    finally:
+        pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix-socket", default=None)
+    parser.add_argument("--rates", type=float, nargs="+", default=[5., 10., 20., 40.], help="offered requests/s")
+    parser.add_argument("--duration", type=float, default=10., help="seconds per rate")
+    parser.add_argument("--input-dim", type=int, default=128)
+    parser.add_argument("--seq-len", type=int, default=20)
+    parser.add_argument("--min-frames", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="write the results to this path")
+    parser.add_argument("--spawn", action="store_true", help="start a server subprocess for the run")
+    parser.add_argument("--max-batch", type=int, default=16, help="with --spawn")
+    parser.add_argument("--max-wait-ms", type=float, default=10., help="with --spawn")
+    parser.add_argument("--workers", type=int, default=1, help="with --spawn")
+    parser.add_argument("--startup-timeout", type=float, default=60.)
+    args, server_args = parser.parse_known_args()
+    server_args = [a for a in server_args if a != "--"]
+
+    server = None
+    if args.spawn:
+        listen = ["--unix-socket", args.unix_socket] if args.unix_socket else ["--host", args.host, "--port", str(args.port)]
+        server = subprocess.Popen([sys.executable, "-m", "conformer_rnnt.transcription_server", *listen,
+                                   "--max-batch", str(args.max_batch), "--max-wait-ms", str(args.max_wait_ms),
+                                   "--workers", str(args.workers), "--input-dim", str(args.input_dim),
+                                   "--seq-len", str(args.seq_len), *server_args])
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
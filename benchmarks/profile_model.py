@@ -0,0 +1,74 @@
+"""Per-layer profile of ConformerRNNT training steps.
+
+Runs a few ScaledAdam train steps with LayerProfiler attached and prints the
+per-layer and per-kind tables (vertical/horizontal attention, conv, FFN,
+decoder, joint, optimizer). ``--trace`` also exports a Chrome trace of one step
+(open it in chrome://tracing or https://ui.perfetto.dev).
+
+    python benchmarks/profile_model.py --seq-len 64 --enc-layers 4 --trace step.json
+"""
+
+import argparse
+import json
+
+import torch
+import torch.nn.functional as F
+
+from conformer_rnnt.adam_variant import ScaledAdam
+from conformer_rnnt.conformer_model import ConformerRNNT
+from conformer_rnnt.profiling import LayerProfiler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--seq-len", type=int, default=64)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--vocab", type=int, default=64)
+    parser.add_argument("--hidden-dim", type=int, default=256)
+    parser.add_argument("--target-len", type=int, default=16)
+    parser.add_argument("--enc-layers", type=int, default=4)
+    parser.add_argument("--dec-layers", type=int, default=2)
+    parser.add_argument("--decoder-type", default="bidirectional")
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--trace", default=None, help="write a Chrome trace of one extra step to this path")
+    parser.add_argument("--json", default=None, help="write the per-layer rows to this path")
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    model = ConformerRNNT(args.dim, args.seq_len, args.enc_layers, 8, args.hidden_dim, args.vocab, args.dec_layers,
+                          decoder_type=args.decoder_type).train()
+    optimizer = ScaledAdam(model.parameters(), lr=1e-5)
+    inputs = torch.randn(args.batch, args.seq_len, args.dim)
+    dec_inputs = torch.randn(args.batch, args.target_len, args.vocab)
+    targets = torch.randn(args.batch, args.seq_len, args.vocab)
+
+    def train_step():
+        optimizer.zero_grad()
+        loss = F.mse_loss(model(inputs, dec_inputs), targets)
+        loss.backward()
+        optimizer.step()
+
+    train_step()  # warm-up, not recorded
+    profiler = LayerProfiler(model, optimizer)
+    with profiler:
+        for _ in range(args.steps):
+            train_step()
+    print(profiler.table(group_by="kind"))
+    print()
+    print(profiler.table(group_by="layer"))
+
+    if args.trace:
+        with profiler.trace(args.trace):
+            train_step()
+        print(f"wrote Chrome trace to {args.trace}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"kind": profiler.summary("kind"), "layer": profiler.summary("layer")}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,450 @@
+"""Benchmark suite for the Conformer-RNNT building blocks (CPU only).
+
+Every case is run over the cartesian product of the shape options and reports
+forward latency (no grad), backward latency, throughput and peak allocator
+memory. Results are written as JSON; ``--compare`` checks them against a stored
+baseline and exits non-zero when a case got slower or bigger than
+``--threshold``.
+
+    python benchmarks/suite.py --output baseline.json
+    python benchmarks/suite.py --compare baseline.json --output current.json
+    python benchmarks/suite.py --list
+    python benchmarks/suite.py --filter attention --seq-len 128 512 --heads 4 8
+"""
+
+import argparse
+import fnmatch
+import itertools
+import json
+import sys
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from common import environment, peak_memory_bytes, time_fn
+
+from conformer_rnnt.adam_variant import ScaledAdam
+from conformer_rnnt.attention_mechanisms import (DotProductAttention, LinearAttention, MultiHeadAttention, MultiHeadSelfAttention,
+                                                 SlidingWindowAttention)
+from conformer_rnnt.bias_norm import BiasNorm
+from conformer_rnnt.conformer_model import ConformerBlock_Vertical, ConformerRNNT, JointNet
+from conformer_rnnt.decoders import DecoderRNNT
+from conformer_rnnt.note_events import NoteVocabulary, events_to_notes, from_frame_predictions
+from conformer_rnnt.positional_embedding import (absolutepositionalembedding, relativeembedding, rotarypositionalembedding,
+                                                 t5relativeembedding)
+from conformer_rnnt.registry import ACTIVATIONS, resolve
+
+CASES = {}
+
+
+class Bench:
+    """One runnable case: ``run()`` returns the output to backpropagate, or performs a whole step when
+    ``backward`` is False. ``items`` is the unit of work used for throughput."""
+
+    def __init__(self, run, items, parameters=(), inputs=(), backward=True):
+        self.run = run
+        self.items = items
+        self.parameters = list(parameters)
+        self.inputs = list(inputs)
+        self.backward = backward
+
+    def zero_grad(self):
+        for tensor in self.parameters + self.inputs:
+            tensor.grad = None
+
+
+def case(name):
+    def register(builder):
+        CASES[name] = builder
+        return builder
+    return register
+
+
+def module_bench(module, *inputs, items):
+    return Bench(lambda: module(*inputs), items, parameters=module.parameters(),
+                 inputs=[x for x in inputs if x.requires_grad])
+
+
+def features(shape, dim=None):
+    return torch.randn(shape["batch"], shape["seq_len"], dim or shape["dim"], requires_grad=True)
+
+
+def frames(shape):
+    return shape["batch"] * shape["seq_len"]
+
+
+# attention
+
+def _qkv(shape):
+    dim_head = shape["dim"] // shape["heads"]
+    return [torch.randn(shape["batch"], shape["heads"], shape["seq_len"], dim_head, requires_grad=True) for _ in range(3)]
+
+
+@case("attention.dot_product")
+def _(shape):
+    q, k, v = _qkv(shape)
+    return Bench(lambda: DotProductAttention()(q, k, v), frames(shape), inputs=[q, k, v])
+
+
+@case("attention.dot_product_local")
+def _(shape):
+    q, k, v = _qkv(shape)
+    attention = DotProductAttention()
+    run = lambda: attention(q, k, v, include_local_attention=True, local_attention_window=9, local_attention_dim_vertical=True)
+    return Bench(run, frames(shape), inputs=[q, k, v])
+
+
+@case("attention.sliding_window")
+def _(shape):
+    q, k, v = _qkv(shape)
+    return Bench(lambda: SlidingWindowAttention(window=16)(q, k, v), frames(shape), inputs=[q, k, v])
+
+
+@case("attention.linear")
+def _(shape):
+    q, k, v = _qkv(shape)
+    attention = LinearAttention(q.size(-1))
+    return Bench(lambda: attention(q, k, v), frames(shape), inputs=[q, k, v])
+
+
+@case("attention.linear_causal")
+def _(shape):
+    q, k, v = _qkv(shape)
+    attention = LinearAttention(q.size(-1), causal=True)
+    return Bench(lambda: attention(q, k, v), frames(shape), inputs=[q, k, v])
+
+
+@case("attention.multi_head")
+def _(shape):
+    module = MultiHeadAttention(shape["dim"], dim_head=shape["dim"] // shape["heads"], heads=shape["heads"])
+    return module_bench(module, features(shape), items=frames(shape))
+
+
+@case("attention.multi_head_self")
+def _(shape):
+    module = MultiHeadSelfAttention(shape["dim"], dim_head=shape["dim"] // shape["heads"], heads=shape["heads"])
+    return module_bench(module, features(shape), items=frames(shape))
+
+
+@case("attention.multi_head_self.sliding_window")
+def _(shape):
+    module = MultiHeadSelfAttention(shape["dim"], dim_head=shape["dim"] // shape["heads"], heads=shape["heads"],
+                                    attention_type="sliding_window", attention_window=16)
+    return module_bench(module, features(shape), items=frames(shape))
+
+
+# positional embeddings
+
+@case("positional.absolute")
+def _(shape):
+    module = absolutepositionalembedding(shape["dim"], max_sequence_length=max(512, shape["seq_len"]))
+    return module_bench(module, features(shape), items=frames(shape))
+
+
+@case("positional.rotary")
+def _(shape):
+    return module_bench(rotarypositionalembedding(shape["dim"]), features(shape), items=frames(shape))
+
+
+@case("positional.relative")
+def _(shape):
+    module = relativeembedding(shape["dim"], max_position=shape["seq_len"])
+    return module_bench(module, features(shape), items=frames(shape))
+
+
+@case("positional.t5relative")
+def _(shape):
+    module = t5relativeembedding(shape["dim"], max_position=shape["seq_len"])
+    return module_bench(module, features(shape), items=frames(shape))
+
+
+# activations
+
+def _activation_case(name):
+    def build(shape):
+        cls = resolve(ACTIVATIONS, name)
+        if name in ("geglu", "swiglu", "swiglu_variant"):
+            module = cls(shape["dim"])
+        elif name == "celu":
+            module = cls(alpha=1.0)
+        else:
+            module = cls()
+        if name == "softmax2d":
+            x = torch.randn(shape["batch"], shape["heads"], shape["seq_len"], shape["dim"] // shape["heads"], requires_grad=True)
+        else:
+            x = features(shape)
+        return module_bench(module, x, items=frames(shape))
+    return build
+
+
+for _name in ACTIVATIONS:
+    case(f"activation.{_name}")(_activation_case(_name))
+
+
+# normalization
+
+@case("norm.bias_norm")
+def _(shape):
+    return module_bench(BiasNorm(shape["dim"]), features(shape), items=frames(shape))
+
+
+@case("norm.layer_norm")
+def _(shape):
+    return module_bench(nn.LayerNorm(shape["dim"]), features(shape), items=frames(shape))
+
+
+# prediction network, joint network
+
+DECODER_TYPES = DecoderRNNT.supported_decoders
+
+
+def _decoder(shape, decoder_type):
+    return DecoderRNNT(shape["vocab"], shape["dim"], shape["dim"], num_layers=shape["dec_layers"],
+                       enc_has_cont_val=False, decoder_type=decoder_type)
+
+
+def _decoder_case(decoder_type):
+    def build(shape):
+        decoder = _decoder(shape, decoder_type)
+        tokens = torch.randint(1, shape["vocab"], (shape["batch"], shape["target_len"]))
+        return Bench(lambda: decoder(tokens)[0], shape["batch"] * shape["target_len"], parameters=decoder.parameters())
+    return build
+
+
+def _decoder_step_case(decoder_type):
+    def build(shape):
+        decoder = _decoder(shape, decoder_type).eval()
+        tokens = torch.randint(1, shape["vocab"], (shape["batch"], shape["target_len"]))
+
+        @torch.no_grad()
+        def run():
+            state = None
+            for u in range(tokens.size(1)):
+                _, state = decoder.step(tokens[:, u], state)
+        return Bench(run, shape["batch"] * shape["target_len"], backward=False)
+    return build
+
+
+for _type in DECODER_TYPES:
+    case(f"decoder.{_type}")(_decoder_case(_type))
+    if _type != "bidirectional":
+        case(f"decoder.{_type}.step")(_decoder_step_case(_type))
+
+
+@case("joint.jointnet")
+def _(shape):
+    joint = JointNet(2 * shape["dim"], shape["dim"], shape["vocab"])
+    enc = features(shape)
+    dec = torch.randn(shape["batch"], shape["target_len"], shape["dim"], requires_grad=True)
+    return module_bench(joint, enc, dec, items=frames(shape))
+
+
+# optimizer
+
+def _optimizer_case(make_optimizer):
+    def build(shape):
+        block = ConformerBlock_Vertical(dim=shape["dim"], dim_head=shape["dim"] // shape["heads"], heads=shape["heads"])
+        params = list(block.parameters())
+        for param in params:
+            param.grad = torch.randn_like(param)
+        optimizer = make_optimizer(params)
+        return Bench(optimizer.step, sum(p.numel() for p in params), backward=False)
+    return build
+
+
+case("optim.scaled_adam.step")(_optimizer_case(lambda params: ScaledAdam(params, lr=1e-5)))
+case("optim.torch_adam.step")(_optimizer_case(lambda params: torch.optim.Adam(params, lr=1e-5)))
+
+
+# full model
+
+def _model(shape, decoder_type="bidirectional"):
+    return ConformerRNNT(shape["dim"], shape["seq_len"], shape["enc_layers"], 8, shape["dim"], shape["vocab"],
+                         shape["dec_layers"], decoder_type=decoder_type)
+
+
+@case("model.conformer_rnnt.train_step")
+def _(shape):
+    model = _model(shape).train()
+    optimizer = ScaledAdam(model.parameters(), lr=1e-5)
+    inputs = torch.randn(shape["batch"], shape["seq_len"], shape["dim"])
+    dec_inputs = torch.randn(shape["batch"], shape["target_len"], shape["vocab"])
+    targets = torch.randn(shape["batch"], shape["seq_len"], shape["vocab"])
+
+    def run():
+        optimizer.zero_grad()
+        loss = F.mse_loss(model(inputs, dec_inputs), targets)
+        loss.backward()
+        optimizer.step()
+    return Bench(run, frames(shape), backward=False)
+
+
+def _decode_case(decoder_type):
+    def build(shape):
+        model = _model(shape, decoder_type).eval()
+        inputs = torch.randn(shape["batch"], shape["seq_len"], shape["dim"])
+        lengths = torch.full((shape["batch"],), shape["seq_len"], dtype=torch.long)
+        return Bench(lambda: model.recognize(inputs, lengths), frames(shape), backward=False)
+    return build
+
+
+for _type in DECODER_TYPES:
+    case(f"model.conformer_rnnt.decode.{_type}")(_decode_case(_type))
+
+
+# post-processing
+
+@case("postprocess.note_events")
+def _(shape):
+    # Dense frame-level predictions, a note event on half of the frames
+    vocab = NoteVocabulary()
+    predictions = torch.randint(1, len(vocab), (shape["batch"], shape["seq_len"]))
+    predictions[torch.rand(predictions.shape) < 0.5] = 0
+    lengths = torch.full((shape["batch"],), shape["seq_len"])
+    events = from_frame_predictions(predictions.numpy(), lengths.numpy())
+    return Bench(lambda: events_to_notes(vocab, *events, end_frames=lengths.numpy()), len(events[0]), backward=False)
+
+
+# runner
+
+SHAPE_KEYS = ("batch", "seq_len", "dim", "heads", "vocab", "target_len", "enc_layers", "dec_layers")
+
+
+def shape_grid(args):
+    values = [getattr(args, key) for key in SHAPE_KEYS]
+    for combo in itertools.product(*values):
+        yield dict(zip(SHAPE_KEYS, combo))
+
+
+def result_key(result):
+    return result["case"] + "[" + ",".join(f"{k}={result['shape'][k]}" for k in SHAPE_KEYS) + "]"
+
+
+def _loss(output):
+    return output.float().square().mean()
+
+
+def run_case(name, shape, warmup, repeats):
+    result = {"case": name, "shape": shape}
+    try:
+        torch.manual_seed(0)
+        bench = CASES[name](shape)
+        if bench.backward:
+            with torch.no_grad():
+                fwd, fwd_min = time_fn(bench.run, warmup, repeats)
+            holder = {}
+
+            def setup():
+                bench.zero_grad()
+                holder["loss"] = _loss(bench.run())
+
+            bwd, bwd_min = time_fn(lambda: holder.pop("loss").backward(), warmup, repeats, setup=setup)
+            bench.zero_grad()
+            peak = peak_memory_bytes(lambda: _loss(bench.run()).backward())
+            result.update(fwd_ms=1e3 * fwd, fwd_min_ms=1e3 * fwd_min, bwd_ms=1e3 * bwd, bwd_min_ms=1e3 * bwd_min,
+                          items_per_s=bench.items / fwd, train_items_per_s=bench.items / (fwd + bwd))
+        else:
+            step, step_min = time_fn(bench.run, warmup, repeats)
+            peak = peak_memory_bytes(bench.run)
+            result.update(step_ms=1e3 * step, step_min_ms=1e3 * step_min, items_per_s=bench.items / step)
+        result["peak_mem_mb"] = peak / 2 ** 20
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def format_result(result):
+    if "error" in result:
+        return f"{result_key(result):<90} ERROR {result['error']}"
+    if "step_ms" in result:
+        timing = f"step {result['step_ms']:9.3f} ms {'':17}"
+    else:
+        timing = f"fwd {result['fwd_ms']:9.3f} ms  bwd {result['bwd_ms']:9.3f} ms"
+    return f"{result_key(result):<90} {timing}  {result['items_per_s']:12.1f} it/s  {result['peak_mem_mb']:9.2f} MB"
+
+
+COMPARED_METRICS = ("fwd_ms", "bwd_ms", "step_ms", "peak_mem_mb")
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Return the list of (key, metric, old, new) that got worse than the baseline by more than ``threshold``."""
+    previous = {result_key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None or "error" in old:
+            continue
+        if "error" in result:
+            regressions.append((result_key(result), "error", None, result["error"]))
+            continue
+        for metric in COMPARED_METRICS:
+            if metric not in result or metric not in old:
+                continue
+            delta = result[metric] - old[metric]
+            # Sub-threshold absolute changes on tiny kernels are timer noise
+            floor = min_delta_ms if metric.endswith("_ms") else 0.
+            if delta > threshold * old[metric] and delta > floor:
+                regressions.append((result_key(result), metric, old[metric], result[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", nargs="*", default=None, help="glob patterns of case names, e.g. 'attention.*'")
+    parser.add_argument("--list", action="store_true", help="list the case names and exit")
+    parser.add_argument("--batch", type=int, nargs="+", default=[4])
+    parser.add_argument("--seq-len", type=int, nargs="+", default=[64, 256])
+    parser.add_argument("--dim", type=int, nargs="+", default=[128])
+    parser.add_argument("--heads", type=int, nargs="+", default=[4])
+    parser.add_argument("--vocab", type=int, nargs="+", default=[64])
+    parser.add_argument("--target-len", type=int, nargs="+", default=[16])
+    parser.add_argument("--enc-layers", type=int, nargs="+", default=[2])
+    parser.add_argument("--dec-layers", type=int, nargs="+", default=[2])
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", default=None, help="baseline JSON written by a previous run")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slow-down flagged as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05)
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(CASES))
+        return 0
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    names = [name for name in CASES if not args.filter or any(fnmatch.fnmatch(name, p) or p in name for p in args.filter)]
+    results = []
+    start = time.perf_counter()
+    for shape in shape_grid(args):
+        for name in names:
+            result = run_case(name, shape, args.warmup, args.repeats)
+            print(format_result(result), flush=True)
+            results.append(result)
+
+    report = {"environment": environment(), "args": vars(args), "results": results,
+              "elapsed_s": time.perf_counter() - start}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {len(results)} results to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        for key, metric, old, new in regressions:
+            if metric == "error":
+                print(f"REGRESSION {key}: now fails with {new}")
+            else:
+                print(f"REGRESSION {key}: {metric} {old:.3f} -> {new:.3f} ({100 * (new / old - 1):+.1f}%)")
+        print(f"{len(regressions)} regression(s) against {args.compare} (threshold {100 * args.threshold:.0f}%)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
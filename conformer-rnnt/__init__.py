@@ -0,0 +1,49 @@
+"""Conformer - RNNT architecture for Automatic Music Transcription.
+
+Importing the package is cheap: the public names below are loaded from their
+modules on first access, and optional dependencies (librosa, matplotlib) are
+only imported by the functions that need them.
+"""
+
+import importlib
+
+_EXPORTS = {
+    "ConformerRNNT": "conformer_model",
+    "Conformer": "conformer_model",
+    "JointNet": "conformer_model",
+    "DecoderRNNT": "decoders",
+    "StatelessPredictor": "decoders",
+    "MultiHeadSelfAttention": "attention_mechanisms",
+    "MultiHeadAttention": "attention_mechanisms",
+    "ScaledAdam": "adam_variant",
+    "BiasNorm": "bias_norm",
+    "Cochleogram": "cochleogram",
+    "CheckpointManager": "checkpoint",
+    "load_for_inference": "checkpoint",
+    "LongFormTranscriber": "long_form",
+    "NoteVocabulary": "note_events",
+    "NoteStreamer": "note_events",
+    "events_to_notes": "note_events",
+    "notes_to_midi": "note_events",
+    "LayerProfiler": "profiling",
+    "plan_pruning": "pruning",
+    "apply_plan": "pruning",
+    "save_pruned": "pruning",
+    "get_activation": "registry",
+    "get_attention": "registry",
+    "get_positional_embedding": "registry",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module("." + _EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
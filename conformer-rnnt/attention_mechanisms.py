@@ -37,9 +37,10 @@ class DotProductAttention(nn.Module):
     def forward(self, queries, keys, values, mask=None, linear_bias = False, include_local_attention = False, local_attention_window = 3, local_attention_dim_vertical = False):
         # Scoring the queries against the keys after transposing the latter, and scaling
         scores = torch.matmul(queries, keys.transpose(-2, -1)) / (keys.size(-1) ** 0.5)
-        # Apply mask to the attention scores
+        # Apply mask to the attention scores, with local attention masked scores are zeroed first so that the
+        # smoothing below does not spread -1e9 onto the unmasked neighbours, and masked again afterwards
         if mask is not None:
-          scores = scores.masked_fill(mask, -1e9)
+          scores = scores.masked_fill(mask, 0. if include_local_attention else -1e9)
 
         # Set include_local_attention = True for computing local attention
         if include_local_attention:
@@ -72,6 +73,8 @@ class DotProductAttention(nn.Module):
                     head_output = scores_conv_output.squeeze()
                   output_array[b,c] = head_output
           scores = output_array
+          if mask is not None:
+            scores = scores.masked_fill(mask, -1e9)
 
         # Set bias = True for including ALiBi to the attention scores
         if linear_bias:
@@ -87,6 +90,175 @@ class DotProductAttention(nn.Module):
         # Computing the attention by a weighted sum of the value vectors
         return attention_output
 
+
+def _blocks(x, block, num_blocks):
+    # (..., T, D) -> (..., num_blocks, 3*block, D): the keys/values of the previous, the same and the next block
+    x = F.pad(x, (0, 0, block, (num_blocks + 1) * block - x.size(-2)))
+    return x.unfold(-2, 3 * block, block).transpose(-2, -1)
+
+
+def _band_mask(mask, block, num_blocks):
+    # Boolean mask (True = masked) laid out like the block scores, (..., num_blocks, block, 3*block)
+    padded_len = num_blocks * block
+    if mask.dim() == 2:
+        # Key padding mask (batch, T)
+        mask = F.pad(mask, (block, padded_len + block - mask.size(-1)), value = True)
+        return mask.unfold(-1, 3 * block, block)[:, None, :, None, :]
+    # Full (..., T, T) mask: rows grouped by block, then the 3*block columns of every row block
+    mask = F.pad(mask, (block, padded_len + block - mask.size(-1), 0, padded_len - mask.size(-2)), value = True)
+    mask = mask.reshape(*mask.shape[:-2], num_blocks, block, mask.size(-1)).unfold(-1, 3 * block, block)
+    return torch.diagonal(mask, dim1 = -4, dim2 = -2).permute(*range(mask.dim() - 4), -1, -3, -2)
+
+
+class SlidingWindowAttention(nn.Module):
+    """
+    Scaled dot product attention restricted to keys within +-window positions of every query.
+    Queries are split into blocks of ``window`` positions and every block is scored against the keys of its own and
+    the two neighbouring blocks (a strided view of the keys), so compute and memory grow as O(T*window) instead of
+    O(T^2) while the work stays in a few large matmuls.
+    The first ``global_tokens`` positions attend to, and are attended by, the whole sequence.
+    Masks are boolean with True marking positions to ignore: (batch, T) key padding or a broadcastable (..., T, T) mask.
+    """
+    def __init__(self, window = 16, global_tokens = 0):
+        super().__init__()
+        self.window = window
+        self.global_tokens = global_tokens
+
+    def forward(self, queries, keys, values, mask = None):
+        seq_len, scale = queries.size(-2), keys.size(-1) ** 0.5
+        window = max(1, min(self.window, seq_len))
+        glob = min(self.global_tokens, seq_len)
+        num_blocks = -(-seq_len // window)
+
+        # (b, h, blocks, window, 3*window) scores of every query block against the neighbouring key blocks
+        query_blocks = F.pad(queries, (0, 0, 0, num_blocks * window - seq_len))
+        query_blocks = query_blocks.reshape(*queries.shape[:-2], num_blocks, window, queries.size(-1))
+        scores = torch.matmul(query_blocks, _blocks(keys, window, num_blocks).transpose(-2, -1)) / scale
+
+        offsets = torch.arange(3 * window, device = queries.device) - window
+        rows = torch.arange(window, device = queries.device)
+        key_positions = (torch.arange(num_blocks, device = queries.device) * window)[:, None, None] + offsets
+        # Outside the band or the sequence, or a global key that is scored separately below
+        invalid = ((offsets - rows[:, None]).abs() > self.window) | (key_positions < glob) | (key_positions >= seq_len)
+        if mask is not None:
+            invalid = invalid | _band_mask(mask, window, num_blocks)
+        scores = scores.masked_fill(invalid, -1e9)
+        scores = scores.reshape(*scores.shape[:-3], num_blocks * window, 3 * window)[..., :seq_len, :]
+
+        if glob:
+            global_scores = torch.matmul(queries, keys[..., :glob, :].transpose(-2, -1)) / scale
+            if mask is not None:
+                global_mask = mask[:, None, None, :glob] if mask.dim() == 2 else mask[..., :glob]
+                global_scores = global_scores.masked_fill(global_mask, -1e9)
+            scores = torch.cat([global_scores, scores], dim = -1)
+
+        weights = F.softmax(scores, dim = -1)
+        band_weights = F.pad(weights[..., glob:], (0, 0, 0, num_blocks * window - seq_len))
+        band_weights = band_weights.reshape(*band_weights.shape[:-2], num_blocks, window, 3 * window)
+        output = torch.matmul(band_weights, _blocks(values, window, num_blocks))
+        output = output.reshape(*output.shape[:-3], num_blocks * window, values.size(-1))[..., :seq_len, :]
+        if glob:
+            output = output + torch.matmul(weights[..., :glob], values[..., :glob, :])
+            # Global queries attend densely to every position, O(global_tokens * T)
+            global_scores = torch.matmul(queries[..., :glob, :], keys.transpose(-2, -1)) / scale
+            if mask is not None:
+                global_mask = mask[:, None, None, :] if mask.dim() == 2 else mask[..., :glob, :]
+                global_scores = global_scores.masked_fill(global_mask, -1e9)
+            global_output = torch.matmul(F.softmax(global_scores, dim = -1), values)
+            output = torch.cat([global_output, output[..., glob:, :]], dim = -2)
+        return output
+
+
+class LinearAttention(nn.Module):
+    """
+    Kernelized attention: softmax(q k^T) v is replaced by phi(q) (phi(k)^T v), normalised by phi(q) sum(phi(k)),
+    which costs O(T * features * dim_head) instead of O(T^2 * dim_head).
+    Args:
+        dim_head: size of queries and keys
+        feature_map: "elu" for elu(x) + 1, "random" for positive random features of the softmax kernel
+        num_features: random features, default dim_head
+        causal: every position only attends to itself and earlier positions (prefix sums, usable with ``step``)
+        chunk_size: positions per chunk of the causal form, exact within a chunk and prefix sums across chunks
+    Masks are (batch, T) key padding masks with True marking padded positions.
+    """
+    supported_feature_maps = ("elu", "random")
+
+    def __init__(self, dim_head, feature_map = "elu", num_features = None, causal = False, chunk_size = 64):
+        super().__init__()
+        if feature_map not in self.supported_feature_maps:
+            raise ValueError("Unsupported feature_map [{}]. Choose one of {}".format(feature_map, self.supported_feature_maps))
+        self.feature_map = feature_map
+        self.causal = causal
+        self.chunk_size = chunk_size
+        if feature_map == "random":
+            num_features = num_features or dim_head
+            # Orthogonal gaussian projections, blocks of dim_head rows with chi-distributed norms
+            blocks = [torch.linalg.qr(torch.randn(dim_head, dim_head))[0].T for _ in range(-(-num_features // dim_head))]
+            norms = torch.randn(num_features, dim_head).norm(dim = -1, keepdim = True)
+            self.register_buffer("projection", torch.cat(blocks)[:num_features] * norms)
+
+    def features(self, x, is_query):
+        if self.feature_map == "elu":
+            return F.elu(x) + 1
+        # exp(w.x - |x|^2 / 2) / sqrt(m) with x scaled by dim_head^-1/4, so phi(q).phi(k) ~ exp(q.k / sqrt(dim_head))
+        x = x * x.size(-1) ** -0.25
+        projected = torch.matmul(x, self.projection.t()) - (x ** 2).sum(-1, keepdim = True) / 2
+        if is_query:
+            # A constant per query cancels in the normalisation
+            projected = projected - projected.amax(-1, keepdim = True).detach()
+        elif not self.causal:
+            # A constant shared by all keys cancels as well; not in the causal form, whose state outlives the call
+            projected = projected - projected.amax((-2, -1), keepdim = True).detach()
+        return torch.exp(projected) / self.projection.size(0) ** 0.5
+
+    def forward(self, queries, keys, values, mask = None):
+        if mask is not None and mask.dim() != 2:
+            raise ValueError("LinearAttention only supports (batch, T) key padding masks")
+        q, k = self.features(queries, True), self.features(keys, False)
+        if mask is not None:
+            k = k.masked_fill(mask[:, None, :, None], 0.)
+        if self.causal:
+            return self._causal(q, k, values)
+        kv = torch.matmul(k.transpose(-2, -1), values)
+        normaliser = torch.matmul(q, k.sum(-2).unsqueeze(-1))
+        return torch.matmul(q, kv) / normaliser.clamp_min(1e-6)
+
+    def _causal(self, q, k, v):
+        seq_len, chunk = q.size(-2), min(self.chunk_size, q.size(-2))
+        num_chunks = -(-seq_len // chunk)
+        pad = num_chunks * chunk - seq_len
+        q, k, v = (F.pad(x, (0, 0, 0, pad)).reshape(*x.shape[:-2], num_chunks, chunk, x.size(-1)) for x in (q, k, v))
+        # Inside a chunk: masked (chunk x chunk) scores
+        scores = torch.matmul(q, k.transpose(-2, -1)).tril()
+        numerator = torch.matmul(scores, v)
+        normaliser = scores.sum(-1, keepdim = True)
+        # Across chunks: exclusive prefix sums of phi(k)^T v and phi(k)
+        kv = torch.matmul(k.transpose(-2, -1), v)
+        kv = kv.cumsum(-3) - kv
+        k_sum = k.sum(-2)
+        k_sum = k_sum.cumsum(-2) - k_sum
+        numerator = numerator + torch.matmul(q, kv)
+        normaliser = normaliser + torch.matmul(q, k_sum.unsqueeze(-1))
+        output = numerator / normaliser.clamp_min(1e-6)
+        return output.reshape(*output.shape[:-3], num_chunks * chunk, output.size(-1))[..., :seq_len, :]
+
+    def step(self, query, key, value, state = None):
+        """
+        One causal position: query, key and value are (batch, heads, dim_head).
+        Returns the output and the (kv, k_sum) state to pass with the next position.
+        """
+        q, k = self.features(query, True), self.features(key, False)
+        if state is None:
+            kv = k.new_zeros(*k.shape, value.size(-1))
+            k_sum = torch.zeros_like(k)
+        else:
+            kv, k_sum = state
+        kv = kv + k.unsqueeze(-1) * value.unsqueeze(-2)
+        k_sum = k_sum + k
+        output = torch.matmul(q.unsqueeze(-2), kv).squeeze(-2) / (q * k_sum).sum(-1, keepdim = True).clamp_min(1e-6)
+        return output, (kv, k_sum)
+
+
 class MultiHeadAttention(nn.Module):
   def __init__(self, dim, dim_head = 64, heads = 8, dropout = 0., linear_bias = False, include_local_attention = False, local_attention_window = 3, local_attention_dim_vertical = False):
         super().__init__()
@@ -131,7 +303,9 @@ class MultiHeadAttention(nn.Module):
 
 
 class MultiHeadSelfAttention(nn.Module):
-    def __init__(self, dim, dim_head = 64, heads=8, dropout = 0., linear_bias = False, include_local_attention = False, local_attention_window = 3, local_attention_dim_vertical = False):
+    supported_attention = ("dense", "sliding_window", "linear")
+
+    def __init__(self, dim, dim_head = 64, heads=8, dropout = 0., linear_bias = False, include_local_attention = False, local_attention_window = 3, local_attention_dim_vertical = False, attention_type = "dense", attention_window = 16, global_tokens = 0, feature_map = "elu", causal = False):
         """
         Implementation of multi-head attention layer of the original transformer model.
         einsum and einops.rearrange is used whenever possible
@@ -140,8 +314,15 @@ class MultiHeadSelfAttention(nn.Module):
             heads: the number of distinct representations to learn
             dim_head: the dim of the head. In general dim_head<dim.
             However, it may not necessary be (dim/heads)
+            attention_type: "dense" scores every pair of tokens, "sliding_window" only tokens within
+            +-attention_window of each other (plus global_tokens leading tokens that see everything),
+            "linear" kernelized attention with the given feature_map ("elu" or "random"), causal or not.
+            linear_bias and the local attention options only apply to "dense"
         """
         super().__init__()
+        if attention_type not in self.supported_attention:
+            raise ValueError("Unsupported attention_type [{}]. Choose one of {}".format(attention_type, self.supported_attention))
+        self.attention_type = attention_type
         self.dim = dim
         self.heads = heads
         self.dim_head = dim_head
@@ -153,7 +334,12 @@ class MultiHeadSelfAttention(nn.Module):
         self.include_local_attention = include_local_attention #Boolean value to include/exclude local attention
         self.local_attention_window = local_attention_window #Numerical value for a window of local attention
         self.local_attention_dim_vertical = local_attention_dim_vertical #Boolean value to convolute basis the horizontal/vertical direction
-        self.attention = DotProductAttention()  # Scaled dot product attention
+        if attention_type == "sliding_window":
+            self.attention = SlidingWindowAttention(window = attention_window, global_tokens = global_tokens)
+        elif attention_type == "linear":
+            self.attention = LinearAttention(dim_head, feature_map = feature_map, causal = causal)
+        else:
+            self.attention = DotProductAttention()  # Scaled dot product attention
 
     def forward(self, x, mask=None):
         assert x.dim() == 3
@@ -167,7 +353,13 @@ class MultiHeadSelfAttention(nn.Module):
         q, k, v = tuple(rearrange(qkv, 'b t (d k h) -> k b h t d ', k=3, h=self.heads))
         # Step 3
         # Calc result per batch and per head h
-        output = self.attention(q, k, v, mask, self.linear_bias, self.include_local_attention, self.local_attention_window, self.local_attention_dim_vertical)
+        if self.attention_type in ("sliding_window", "linear"):
+            output = self.attention(q, k, v, mask)
+        else:
+            if mask is not None and mask.dim() == 2:
+                # Key padding mask (batch, tokens) -> (batch, 1, 1, tokens)
+                mask = mask[:, None, None, :]
+            output = self.attention(q, k, v, mask, self.linear_bias, self.include_local_attention, self.local_attention_window, self.local_attention_dim_vertical)
         # Step 4. Re-compose: merge heads with dim_head d
         output = rearrange(output, "b h t d -> b t (h d)")
         # Step 6. Apply final linear transformation layer
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""checkpoint.py
+
+Asynchronous model/optimizer checkpoints. ``CheckpointManager.save`` copies the
+state to CPU and hands the write to a background thread, so training only
+stalls for the copy. Files are written to a temporary name and renamed into
+place, and only the last ``keep_last`` are kept. The files use the zip layout
+of ``torch.save``, where every tensor is an uncompressed aligned record, so
+inference workers can map the weights with ``torch.load(mmap=True)`` instead of
+reading them into memory.
+"""
+
+import glob
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+import torch.nn as nn
+
+
+def snapshot(obj):
+    """Copy of a (nested) state dict with every tensor detached and copied to CPU; other values are kept."""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((key, snapshot(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(value) for value in obj)
+    return obj
+
+
+def _unwrap(model):
+    # DistributedDataParallel keeps the model in .module, the checkpoint stores the bare model
+    return model.module if isinstance(model, nn.parallel.DistributedDataParallel) else model
+
+
+def atomic_save(obj, path):
+    """torch.save to a temporary file in the same directory, fsync, then rename over ``path``."""
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = os.path.join(directory, ".{}.tmp".format(os.path.basename(path)))
+    try:
+        with open(tmp_path, "wb") as f:
+            torch.save(obj, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def load_checkpoint(path, mmap = True):
+    """Load a checkpoint on CPU, memory mapping the tensors unless ``mmap`` is False."""
+    return torch.load(path, map_location="cpu", mmap=mmap, weights_only=True)
+
+
+def load_for_inference(path, model):
+    """
+    Point the parameters and buffers of ``model`` at the memory-mapped tensors of a checkpoint.
+    Nothing is copied, pages are read from disk on first use and shared between processes mapping the same file.
+    """
+    state = load_checkpoint(path, mmap=True)
+    model.load_state_dict(state["model"], assign=True)
+    return model.eval()
+
+
+class CheckpointManager:
+    """
+    Args:
+        directory (str): where checkpoints are written, created if needed
+        keep_last (int): number of most recent checkpoints kept on disk, older ones are deleted
+        prefix (str): file name prefix, files are named ``{prefix}-{step:08d}.pt``
+
+    Usage::
+
+        manager = CheckpointManager("ckpt", keep_last=3)
+        state = manager.restore(model, optimizer)   # None when there is nothing to resume
+        ...
+        manager.save(step, model, optimizer)        # returns once the state is copied to CPU
+        ...
+        manager.close()                             # waits for the last write
+    """
+
+    def __init__(self, directory, keep_last = 3, prefix = "checkpoint"):
+        if keep_last < 1:
+            raise ValueError("Invalid keep_last [{}]. Keep at least one checkpoint".format(keep_last))
+        self.directory = directory
+        self.keep_last = keep_last
+        self.prefix = prefix
+        self._pattern = re.compile(r"^{}-(\d+)\.pt$".format(re.escape(prefix)))
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint-writer")
+        self._pending = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, step):
+        return os.path.join(self.directory, "{}-{:08d}.pt".format(self.prefix, step))
+
+    def checkpoints(self):
+        """Paths of the checkpoints on disk, oldest first."""
+        found = []
+        for path in glob.glob(os.path.join(self.directory, "{}-*.pt".format(self.prefix))):
+            match = self._pattern.match(os.path.basename(path))
+            if match:
+                found.append((int(match.group(1)), path))
+        return [path for _, path in sorted(found)]
+
+    def latest(self):
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def save(self, step, model, optimizer = None, **extra):
+        """
+        Snapshot ``model`` (and ``optimizer``) to CPU and write them in the background.
+        Waits for the previous write first, so at most one snapshot is held in memory.
+        """
+        self.wait()
+        state = {"step": step, "model": snapshot(_unwrap(model).state_dict())}
+        if optimizer is not None:
+            state["optimizer"] = snapshot(optimizer.state_dict())
+        state.update(snapshot(extra))
+        path = self.path(step)
+        with self._lock:
+            self._pending = self._executor.submit(self._write, state, path)
+        return path
+
+    def _write(self, state, path):
+        atomic_save(state, path)
+        for old in self.checkpoints()[:-self.keep_last]:
+            os.remove(old)
+        return path
+
+    def wait(self):
+        """Block until the pending write (if any) is on disk, re-raising its error."""
+        with self._lock:
+            pending, self._pending = self._pending, None
+        if pending is not None:
+            return pending.result()
+        return None
+
+    def restore(self, model, optimizer = None, path = None):
+        """
+        Load ``path`` (the latest checkpoint by default) into ``model`` and ``optimizer``.
+        Returns the checkpoint dict, with its ``step`` and extra values, or None when there is no checkpoint.
+        """
+        self.wait()
+        path = path or self.latest()
+        if path is None:
+            return None
+        state = load_checkpoint(path, mmap=True)
+        _unwrap(model).load_state_dict(state["model"])
+        if optimizer is not None and "optimizer" in state:
+            optimizer.load_state_dict(state["optimizer"])
+        return state
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
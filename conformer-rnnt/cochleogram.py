@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""cochleogram.py
+
+Batched torch implementation of the cochleogram of input_conversion:
+
+    ERB-spaced gammatone filterbank -> half-wave rectification -> x ** (1/3) -> 10 Hz low-pass
+
+The filters are the ones brian2hears builds (``Gammatone``: Slaney's cascade of
+four second-order sections per channel, ``LowPass``: first-order low-pass), but
+they are applied as FFT convolutions with their impulse responses, truncated
+once the remaining energy is negligible. Every channel of every waveform in a
+batch is filtered by the same few FFTs, which run on all intra-op threads.
+
+    cochleogram = Cochleogram(sample_rate=22050, num_filters=40, hop_length=512)
+    features = cochleogram(waveforms)      # (batch, samples) -> (batch, num_filters, frames)
+"""
+
+import math
+
+import torch
+import torch.nn as nn
+
+
+def erbspace(low_freq, high_freq, num_filters, ear_q = 9.26449, min_bw = 24.7):
+    """Centre frequencies equally spaced on the ERB scale (Glasberg & Moore), in increasing order, as brian2hears."""
+    low, high = low_freq + ear_q * min_bw, high_freq + ear_q * min_bw
+    steps = torch.arange(num_filters, dtype=torch.float64) / max(1, num_filters - 1)
+    cf = -ear_q * min_bw + torch.exp(steps * (math.log(low) - math.log(high))) * high
+    return cf.flip(0)
+
+
+def gammatone_sections(cf, sample_rate, b = 1.019, erb_order = 1, ear_q = 9.26449, min_bw = 24.7):
+    """
+    Numerator and denominator coefficients of the gammatone cascade, each (channels, 4, 3), following
+    brian2hears.Gammatone (Slaney, "An Efficient Implementation of the Patterson-Holdsworth Auditory Filter Bank").
+    """
+    cf = cf.to(torch.float64)
+    T = 1. / sample_rate
+    erb = ((cf / ear_q) ** erb_order + min_bw ** erb_order) ** (1. / erb_order)
+    B = b * 2 * math.pi * erb
+    arg = 2 * cf * math.pi * T
+    decay = torch.exp(B * T)
+    s_plus, s_minus = math.sqrt(3 + 2 ** 1.5), math.sqrt(3 - 2 ** 1.5)
+    A11 = -(2 * T * torch.cos(arg) / decay + 2 * s_plus * T * torch.sin(arg) / decay) / 2
+    A12 = -(2 * T * torch.cos(arg) / decay - 2 * s_plus * T * torch.sin(arg) / decay) / 2
+    A13 = -(2 * T * torch.cos(arg) / decay + 2 * s_minus * T * torch.sin(arg) / decay) / 2
+    A14 = -(2 * T * torch.cos(arg) / decay - 2 * s_minus * T * torch.sin(arg) / decay) / 2
+    B1 = -2 * torch.cos(arg) / decay
+    B2 = torch.exp(-2 * B * T)
+
+    # Gain at the centre frequency, the first section is normalised by it
+    z = torch.exp(2j * arg)
+    pole = 2 * torch.exp(-(B * T) + 1j * arg) * T
+    gain = torch.ones_like(cf, dtype=torch.complex128)
+    for sign, root in ((-1, s_minus), (1, s_minus), (-1, s_plus), (1, s_plus)):
+        gain = gain * (-2 * z * T + pole * (torch.cos(arg) + sign * root * torch.sin(arg)))
+    gain = (gain / (-2 / torch.exp(2 * B * T) - 2 * z + 2 * (1 + z) / decay) ** 4).abs()
+
+    ones, zeros = torch.ones_like(cf), torch.zeros_like(cf)
+    numerator = torch.stack([
+        torch.stack([T * ones / gain, A11 / gain, zeros], dim=-1),
+        torch.stack([T * ones, A12, zeros], dim=-1),
+        torch.stack([T * ones, A13, zeros], dim=-1),
+        torch.stack([T * ones, A14, zeros], dim=-1),
+    ], dim=1)
+    denominator = torch.stack([ones, B1, B2], dim=-1).unsqueeze(1).expand(-1, 4, -1)
+    return numerator, denominator
+
+
+def lowpass_section(cutoff, sample_rate):
+    """First-order low-pass of brian2hears.LowPass, y[n] = (dt/tau) x[n] - (dt/tau - 1) y[n-1]."""
+    alpha = 2 * math.pi * cutoff / sample_rate
+    return torch.tensor([[[alpha, 0.]]], dtype=torch.float64), torch.tensor([[[1., alpha - 1.]]], dtype=torch.float64)
+
+
+def impulse_response(numerator, denominator, tolerance = 1e-10, max_length = 2 ** 18):
+    """
+    Impulse responses (channels, length) of cascades of sections (channels, sections, order + 1), evaluated
+    through their frequency response and cut where the remaining energy falls below ``tolerance`` of the total.
+    """
+    n_fft = 4096
+    while True:
+        response = torch.fft.rfft(numerator, n_fft) / torch.fft.rfft(denominator, n_fft)
+        ir = torch.fft.irfft(response.prod(dim=-2), n_fft)
+        energy = ir.pow(2).cumsum(-1)
+        remaining = 1 - energy / energy[..., -1:]
+        # The tail wraps around, a long enough FFT leaves the last quarter empty
+        if remaining[..., 3 * n_fft // 4].max() < tolerance or n_fft >= max_length:
+            break
+        n_fft *= 2
+    length = int((remaining >= tolerance).sum(-1).max()) + 1
+    return ir[..., :length]
+
+
+def fft_filter(x, ir, block_size = 2 ** 16):
+    """
+    Convolve x (..., samples) with every impulse response of ir (channels, length), overlap-add over blocks of
+    ``block_size`` samples. Returns (..., channels, samples).
+    """
+    num_samples, length = x.size(-1), ir.size(-1)
+    block = max(block_size, length)
+    n_fft = 1 << (block + length - 1).bit_length()
+    spectrum = torch.fft.rfft(ir.to(x.dtype), n_fft)
+    output = x.new_zeros(*x.shape[:-1], ir.size(0), num_samples + n_fft)
+    for start in range(0, num_samples, block):
+        chunk = torch.fft.rfft(x[..., start:start + block], n_fft).unsqueeze(-2)
+        output[..., start:start + n_fft] += torch.fft.irfft(chunk * spectrum, n_fft)
+    return output[..., :num_samples]
+
+
+class Cochleogram(nn.Module):
+    """
+    Args:
+        sample_rate (int): of the waveforms
+        num_filters (int): gammatone channels
+        low_freq, high_freq (float): centre frequencies of the lowest and highest channel, in Hz
+        lowpass_freq (float): cut-off of the smoothing low-pass, in Hz
+        compression (float): exponent applied after half-wave rectification
+        hop_length (int): keep every hop_length-th sample of the smoothed output, None keeps all (as brian2hears)
+        block_size (int): samples per FFT block, bounds the memory for long recordings
+        tolerance (float): energy left out when truncating the impulse responses
+    """
+
+    def __init__(self, sample_rate = 22050, num_filters = 40, low_freq = 50, high_freq = 20000, lowpass_freq = 10,
+                 compression = 1. / 3., hop_length = None, block_size = 2 ** 16, tolerance = 1e-10):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.lowpass_cutoff = lowpass_freq
+        self.compression = compression
+        self.hop_length = hop_length
+        self.block_size = block_size
+        self.register_buffer("cf", erbspace(low_freq, high_freq, num_filters), persistent=False)
+        self.register_buffer("gammatone_ir", impulse_response(*gammatone_sections(self.cf, sample_rate),
+                                                              tolerance=tolerance).float(), persistent=False)
+        self.register_buffer("lowpass_ir", impulse_response(*lowpass_section(lowpass_freq, sample_rate),
+                                                            tolerance=tolerance).float(), persistent=False)
+
+    def forward(self, waveform):
+        """(..., samples) -> (..., num_filters, frames)"""
+        bands = fft_filter(waveform, self.gammatone_ir, self.block_size)
+        bands = bands.clamp(min=0) ** self.compression
+        smoothed = fft_filter(bands, self.lowpass_ir, self.block_size).squeeze(-2)
+        if self.hop_length:
+            smoothed = smoothed[..., ::self.hop_length]
+        return smoothed
@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+"""conformer_model.py
+
+Conformer-RNNT model from custom_architecture_with_conformer_rnnt_model_1.ipynb,
+a vertical (time as sequence) and horizontal (features as sequence) Conformer
+encoder with an RNN-T prediction network and joint network.
+"""
+
+import torch
+from torch import nn
+import torch.nn.functional as F
+
+from einops.layers.torch import Rearrange
+
+from .activation_functions import aptx, sigmaptx, gelu, glu
+from .attention_mechanisms import MultiHeadSelfAttention
+from .positional_embedding import absolutepositionalembedding, rotarypositionalembedding
+from .decoders import DecoderRNNT
+
+# helper functions
+def exists(val):
+    return val is not None
+
+def default(val, d):
+    return val if exists(val) else d
+
+def calc_same_padding(kernel_size):
+    pad = kernel_size // 2
+    return (pad, pad - (kernel_size + 1) % 2)
+
+def lengths_to_padding_mask(lengths, max_len):
+    # (batch,) lengths -> (batch, max_len) boolean mask, True at padded positions
+    return torch.arange(max_len, device = lengths.device) >= lengths[:, None]
+
+def pack(x, mask):
+    # (batch, T, ...) -> (valid frames, ...), the frames where mask is False
+    return x[~mask]
+
+def unpack(rows, mask):
+    # Inverse of pack, padded positions are zero
+    out = rows.new_zeros(*mask.shape, *rows.shape[1:])
+    out[~mask] = rows
+    return out
+
+def position_wise(fn, x, mask = None, packed = False):
+    # Runs a per-frame module on the valid frames only when packed, padded outputs are zero
+    if mask is None or not packed:
+        return fn(x)
+    return unpack(fn(pack(x, mask)), mask)
+
+# helper classes
+class DepthWiseConv1d(nn.Module):
+    def __init__(self, chan_in, chan_out, kernel_size, padding):
+        super().__init__()
+        self.padding = padding
+        self.conv = nn.Conv1d(chan_in, chan_out, kernel_size, groups = chan_in)
+
+    def forward(self, x):
+        x = F.pad(x, self.padding)
+        return self.conv(x)
+
+class MaskedBatchNorm1d(nn.BatchNorm1d):
+    # BatchNorm1d over (batch, channels, T) whose statistics only count the frames where mask (batch, T) is False
+    def forward(self, x, mask = None):
+        if mask is None:
+            return super().forward(x)
+        rows = super().forward(pack(x.transpose(1, 2), mask))
+        return unpack(rows, mask).transpose(1, 2)
+
+# attention, feedforward, and conv module
+
+class Scale(nn.Module):
+    def __init__(self, scale, fn):
+        super().__init__()
+        self.fn = fn
+        self.scale = scale
+
+    def forward(self, x, **kwargs):
+        return self.fn(x, **kwargs) * self.scale
+
+class PreNorm(nn.Module):
+    def __init__(self, dim, fn):
+        super().__init__()
+        self.fn = fn
+        self.norm = nn.LayerNorm(dim)
+
+    def forward(self, x, **kwargs):
+        x = self.norm(x)
+        return self.fn(x, **kwargs)
+
+
+class FeedForward_Horizontal(nn.Module):
+    def __init__(
+        self,
+        dim,
+        mult = 4,
+        dropout = 0.
+    ):
+        super().__init__()
+        self.net = nn.Sequential(
+            nn.Linear(dim, dim * mult),
+            sigmaptx(),
+            nn.Dropout(dropout),
+            nn.Linear(dim * mult, dim),
+            nn.Dropout(dropout)
+        )
+
+    def forward(self, x):
+        return self.net(x)
+
+
+class FeedForward_Vertical(nn.Module):
+    def __init__(
+        self,
+        dim,
+        mult = 4,
+        dropout = 0.
+    ):
+        super().__init__()
+        self.net = nn.Sequential(
+            nn.Linear(dim, dim * mult),
+            aptx(),
+            nn.Dropout(dropout),
+            nn.Linear(dim * mult, dim),
+            nn.Dropout(dropout)
+        )
+
+    def forward(self, x):
+        return self.net(x)
+
+
+class ConformerConvModule_Horizontal(nn.Module):
+    def __init__(
+        self,
+        dim,
+        causal = False,
+        expansion_factor = 2,
+        kernel_size = 31,
+        dropout = 0.
+    ):
+        super().__init__()
+
+        inner_dim = dim * expansion_factor
+        padding = calc_same_padding(kernel_size) if not causal else (kernel_size - 1, 0)
+
+        self.net = nn.Sequential(
+            nn.LayerNorm(dim),
+            Rearrange('b n c -> b c n'),
+            nn.Conv1d(dim, inner_dim, 1),
+            gelu(),
+            DepthWiseConv1d(inner_dim, inner_dim, kernel_size = kernel_size, padding = padding),
+            nn.BatchNorm1d(inner_dim) if not causal else nn.Identity(),
+            sigmaptx(),
+            nn.Conv1d(inner_dim, dim, 1),
+            Rearrange('b c n -> b n c'),
+            nn.Dropout(dropout)
+        )
+
+    def forward(self, x):
+        return self.net(x)
+
+class ConformerConvModule_Vertical(nn.Module):
+    def __init__(
+        self,
+        dim,
+        causal = False,
+        expansion_factor = 2,
+        kernel_size = 31,
+        dropout = 0.
+    ):
+        super().__init__()
+
+        inner_dim = dim * expansion_factor
+        padding = calc_same_padding(kernel_size) if not causal else (kernel_size - 1, 0)
+
+        self.net = nn.Sequential(
+            nn.LayerNorm(dim),
+            Rearrange('b n c -> b c n'),
+            nn.Conv1d(dim, inner_dim * 2, 1),
+            glu(dim = 1),
+            DepthWiseConv1d(inner_dim, inner_dim, kernel_size = kernel_size, padding = padding),
+            MaskedBatchNorm1d(inner_dim) if not causal else nn.Identity(),
+            aptx(),
+            nn.Conv1d(inner_dim, dim, 1),
+            Rearrange('b c n -> b n c'),
+            nn.Dropout(dropout)
+        )
+
+    def forward(self, x, mask = None, packed = False):
+        if mask is None:
+            return self.net(x)
+        norm, _, pointwise_in, act_in, depthwise, batch_norm, act_out, pointwise_out, _, dropout = self.net
+        if packed:
+            # Everything but the depthwise conv sees only the valid frames, as (frames, channels) rows
+            rows = act_in(F.linear(norm(pack(x, mask)), pointwise_in.weight.squeeze(-1), pointwise_in.bias))
+            x = depthwise(unpack(rows, mask).transpose(1, 2))
+            rows = act_out(batch_norm(pack(x.transpose(1, 2), mask)))
+            rows = F.linear(rows, pointwise_out.weight.squeeze(-1), pointwise_out.bias)
+            return dropout(unpack(rows, mask))
+        x = act_in(pointwise_in(norm(x).transpose(1, 2)))
+        # Padded frames must not leak into the valid ones through the depthwise kernel
+        x = depthwise(x.masked_fill(mask[:, None, :], 0.))
+        x = batch_norm(x, mask) if isinstance(batch_norm, MaskedBatchNorm1d) else batch_norm(x)
+        x = pointwise_out(act_out(x)).transpose(1, 2)
+        return dropout(x)
+
+# Conformer Block
+
+class ConformerBlock_Vertical(nn.Module):
+    def __init__(
+        self,
+        *,
+        dim,
+        dim_head = 64,
+        heads = 8,
+        ff_mult = 4,
+        conv_expansion_factor = 2,
+        conv_kernel_size = 8,
+        attn_dropout = 0.,
+        ff_dropout = 0.,
+        conv_dropout = 0.,
+        conv_causal = False,
+        attention_type = "dense",
+        attention_window = 16
+    ):
+        super().__init__()
+        self.ff1 = FeedForward_Vertical(dim = dim, mult = ff_mult, dropout = ff_dropout)
+        self.position = rotarypositionalembedding(d_model = dim)
+        self.attn = MultiHeadSelfAttention(dim = dim, dim_head = dim_head, heads = heads, dropout = attn_dropout, linear_bias = False, include_local_attention = True, local_attention_window = 9, local_attention_dim_vertical = True, attention_type = attention_type, attention_window = attention_window)
+        self.conv = ConformerConvModule_Vertical(dim = dim, causal = conv_causal, expansion_factor = conv_expansion_factor, kernel_size = conv_kernel_size, dropout = conv_dropout)
+        self.ff2 = FeedForward_Vertical(dim = dim, mult = ff_mult, dropout = ff_dropout)
+
+        self.attn = PreNorm(dim, self.attn)
+        self.ff1 = Scale(0.5, PreNorm(dim, self.ff1))
+        self.ff2 = Scale(0.5, PreNorm(dim, self.ff2))
+
+        self.post_norm = nn.LayerNorm(dim)
+
+    def forward(self, x, mask = None, packed = False):
+        # mask (batch, T) marks padded frames, packed runs the position-wise layers on the valid frames only
+        x = position_wise(self.ff1, x, mask, packed) + x
+        x = self.position(x)
+        x = self.attn(x, mask = mask) + x
+        x = self.conv(x, mask = mask, packed = packed) + x
+        x = position_wise(self.ff2, x, mask, packed) + x
+        x = position_wise(self.post_norm, x, mask, packed)
+        return x
+
+class ConformerBlock_Horizontal(nn.Module):
+    def __init__(
+        self,
+        *,
+        dim,
+        dim_head = 64,
+        heads = 8,
+        ff_mult = 4,
+        conv_expansion_factor = 2,
+        conv_kernel_size = 31,
+        attn_dropout = 0.,
+        ff_dropout = 0.,
+        conv_dropout = 0.,
+        conv_causal = False,
+        attention_type = "dense",
+        attention_window = 16
+    ):
+        super().__init__()
+        self.ff1 = FeedForward_Horizontal(dim = dim, mult = ff_mult, dropout = ff_dropout)
+        self.position = absolutepositionalembedding(d_model = dim)
+        self.attn = MultiHeadSelfAttention(dim = dim, dim_head = dim_head, heads = heads, dropout = attn_dropout, linear_bias = True, include_local_attention = True, local_attention_window = 9, local_attention_dim_vertical = True, attention_type = attention_type, attention_window = attention_window)
+        self.conv = ConformerConvModule_Horizontal(dim = dim, causal = conv_causal, expansion_factor = conv_expansion_factor, kernel_size = conv_kernel_size, dropout = conv_dropout)
+        self.ff2 = FeedForward_Horizontal(dim = dim, mult = ff_mult, dropout = ff_dropout)
+
+        self.attn = PreNorm(dim, self.attn)
+        self.ff1 = Scale(0.5, PreNorm(dim, self.ff1))
+        self.ff2 = Scale(0.5, PreNorm(dim, self.ff2))
+
+        self.post_norm = nn.LayerNorm(dim)
+
+    def forward(self, x, mask = None):
+        x = self.ff1(x) + x
+        x = self.position(x)
+        x = self.attn(x, mask = mask) + x
+        x = self.conv(x) + x
+        x = self.ff2(x) + x
+        x = self.post_norm(x)
+        return x
+
+# Conformer
+
+class Conformer(nn.Module):
+    def __init__(
+        self,
+        dim,
+        *,
+        seq_length,
+        depth,
+        output_dim,
+        dim_head = 64,
+        heads = 8,
+        ff_mult = 4,
+        conv_expansion_factor = 2,
+        conv_kernel_size = 31,
+        attn_dropout = 0.,
+        ff_dropout = 0.,
+        conv_dropout = 0.,
+        conv_causal = False,
+        vertical_attention = "dense",
+        horizontal_attention = "dense",
+        attention_window = 16,
+        pack_padded = False
+    ):
+        super().__init__()
+        self.dim = dim
+        self.seq_length = seq_length
+        self.pack_padded = pack_padded
+        self.output_dim = output_dim
+        self.output_linear = nn.Linear(dim, output_dim, bias = True)
+        self.layers_vertical = nn.ModuleList([])
+        self.layers_horizontal = nn.ModuleList([])
+
+        for _ in range(int(depth/2)):
+            self.layers_vertical.append(ConformerBlock_Vertical(
+                dim = dim,
+                dim_head = dim_head,
+                heads = heads,
+                ff_mult = ff_mult,
+                conv_expansion_factor = conv_expansion_factor,
+                conv_kernel_size = conv_kernel_size,
+                conv_causal = conv_causal,
+                attention_type = vertical_attention,
+                attention_window = attention_window
+            ))
+            self.layers_horizontal.append(ConformerBlock_Horizontal(
+                dim = seq_length,
+                dim_head = dim_head,
+                heads = heads,
+                ff_mult = ff_mult,
+                conv_expansion_factor = conv_expansion_factor,
+                conv_kernel_size = conv_kernel_size,
+                conv_causal = conv_causal,
+                attention_type = horizontal_attention,
+                attention_window = attention_window
+            ))
+
+        # Dynamic weights for mixing the two branches, learnable and registered with the module
+        self.weight_vertical = nn.Parameter(torch.randn(seq_length, dim))
+        self.weight_horizontal = nn.Parameter(torch.randn(seq_length, dim))
+
+    def forward(self, x, lengths = None):
+        # lengths (batch,) of valid frames, the padding mask is built once and shared by all vertical blocks
+        mask = None
+        if lengths is not None:
+            mask = lengths_to_padding_mask(lengths.to(x.device), x.size(1))
+            if not mask.any():
+                mask = None
+        x_vertical = x
+        # Time is the channel axis of the horizontal branch, padded frames are zero channels there
+        x_horizontal = (x if mask is None else x.masked_fill(mask.unsqueeze(-1), 0.)).transpose(-2, -1)
+        for block in self.layers_vertical:
+            x_vertical = block(x_vertical, mask = mask, packed = self.pack_padded)
+        for block in self.layers_horizontal:
+            x_horizontal = block(x_horizontal)
+            if mask is not None:
+                x_horizontal = x_horizontal.masked_fill(mask.unsqueeze(1), 0.)
+        x_horizontal = x_horizontal.transpose(-2, -1)
+        assert x_vertical.shape == x_horizontal.shape, "Input tensors must have the same shape"
+
+        # Compute the weighted sum
+        weighted_sum = self.weight_vertical * x_vertical + self.weight_horizontal * x_horizontal
+        # Linear layer to get it in the output dim
+        output = self.output_linear(weighted_sum)
+        if mask is not None:
+            output = output.masked_fill(mask.unsqueeze(-1), 0.)
+        return output
+
+
+# JointNet to use the the decoding and transducer part of RNNT
+#Imporved upon the code in https://github.com/ZhengkunTian/rnn-transducer/blob/master/rnnt/ for the Base Encoders, Decoders and the overall transducer
+class JointNet(nn.Module):
+    def __init__(self, input_size, hidden_size, vocab_size):
+        super(JointNet, self).__init__()
+        self.forward_layer = nn.Linear(input_size, hidden_size, bias=True)
+        self.tanh = nn.Tanh()
+        self.project_layer = nn.Linear(hidden_size, vocab_size, bias=True)
+
+    def forward(self, enc_state, dec_state):
+        if enc_state.dim() == 3 and dec_state.dim() == 3:
+            dec_state = dec_state.unsqueeze(1)
+            enc_state = enc_state.unsqueeze(2)
+            t = enc_state.size(1)
+            u = dec_state.size(2)
+            enc_state = enc_state.repeat([1, 1, u, 1])
+            dec_state = dec_state.repeat([1, t, 1, 1])
+        else:
+            assert enc_state.dim() == dec_state.dim()
+
+        concat_state = torch.cat((enc_state, dec_state), dim=-1)
+        outputs = self.forward_layer(concat_state)
+        outputs = self.tanh(outputs)
+        outputs = self.project_layer(outputs)
+        # Average over the target axis of the (batch, T, U, vocab) lattice, single frames are left as they are
+        if outputs.dim() == 4:
+            outputs = outputs.mean(dim=2)
+        # outputs = F.log_softmax(outputs, dim=-1)
+        return outputs
+
+
+def _where_state(emit, new, old, batch_dim):
+    # Keep the new decoder state only for the utterances that emitted a symbol
+    if isinstance(new, tuple):
+        return tuple(_where_state(emit, n, o, batch_dim) for n, o in zip(new, old))
+    shape = [1] * new.dim()
+    shape[batch_dim] = -1
+    return torch.where(emit.view(shape), new, old)
+
+
+# Conformer-RNNT Model
+class ConformerRNNT(nn.Module):
+    def __init__(self, input_dim, seq_len, num_enc_layers, conv_kernel_size, hidden_dim, output_dim, num_dec_layers, conv_dropout=0.1, enc_has_cont_val = True, share_embedding = True, decoder_type = "bidirectional", vertical_attention = "dense", horizontal_attention = "dense", attention_window = 16, pack_padded = False):
+        super(ConformerRNNT, self).__init__()
+        self.output_dim = output_dim
+        self.encoder = Conformer(dim = input_dim, seq_length = seq_len, depth = num_enc_layers, output_dim = output_dim, conv_kernel_size = conv_kernel_size, conv_dropout = conv_dropout, vertical_attention = vertical_attention, horizontal_attention = horizontal_attention, attention_window = attention_window, pack_padded = pack_padded)
+        self.decoder = DecoderRNNT(input_dim = output_dim, hidden_dim = hidden_dim, output_dim = output_dim, num_layers = num_dec_layers, enc_has_cont_val = enc_has_cont_val, decoder_type = decoder_type)
+        self.joint = JointNet(
+            input_size=2*output_dim,
+            hidden_size=hidden_dim,
+            vocab_size=output_dim
+        )
+        if share_embedding and not enc_has_cont_val:
+            assert self.decoder.embedding.weight.size() == self.joint.project_layer.weight.size(), '%d != %d' % (self.decoder.embedding.weight.size(1),  self.joint.project_layer.weight.size(1))
+            self.joint.project_layer.weight = self.decoder.embedding.weight
+
+    def forward(self, inputs, targets, inputs_length = None, targets_length = None):
+        enc_state = self.encoder(inputs, inputs_length)
+        dec_state, _ = self.decoder(targets, targets_length)
+        output = self.joint(enc_state, dec_state)
+        return output
+
+    def _decoder_input(self, tokens):
+        # Emitted symbols are fed back as one-hot vectors when the decoder consumes continuous values
+        if self.decoder.enc_has_cont_val:
+            return F.one_hot(tokens, self.output_dim).float()
+        return tokens
+
+    @torch.no_grad()
+    def recognize(self, inputs, inputs_length = None, return_timestamps = False, max_symbols_per_frame = 1):
+        """
+        Greedy decoding of a batch with 0 as the blank symbol. At every frame symbols are emitted until the joint
+        network predicts blank, ``max_symbols_per_frame`` at most (events sharing a frame, e.g. the notes of a chord).
+        Returns a list of token lists, and a list of frame indices per token when ``return_timestamps`` is set.
+        """
+        batch_size, max_len = inputs.size(0), inputs.size(1)
+        enc_states = self.encoder(inputs, inputs_length)
+        if inputs_length is None:
+            inputs_length = torch.full((batch_size,), max_len, dtype=torch.long, device=inputs.device)
+        inputs_length = inputs_length.to(inputs.device)
+
+        if self.decoder.supports_step:
+            tokens, frames = self._greedy_step(enc_states, inputs_length, max_symbols_per_frame)
+        else:
+            tokens, frames = self._greedy_prefix(enc_states, inputs_length, max_symbols_per_frame)
+        if return_timestamps:
+            return tokens, frames
+        return tokens
+
+    def _greedy_step(self, enc_states, inputs_length, max_symbols_per_frame = 1):
+        # All utterances advance together, the decoder is only stepped once per emitted symbol
+        batch_size = enc_states.size(0)
+        batch_dim = 0 if self.decoder.decoder_type == "stateless" else 1
+        blank = torch.zeros(batch_size, dtype=torch.long, device=enc_states.device)
+        dec_state, hidden = self.decoder.step(self._decoder_input(blank))
+        emitted, emitted_frames = [], []
+        for t in range(enc_states.size(1)):
+            # Utterances stay at frame t until they predict blank or reach max_symbols_per_frame
+            active = t < inputs_length
+            for _ in range(max_symbols_per_frame):
+                logits = self.joint(enc_states[:, t], dec_state)
+                pred = logits.argmax(dim=-1)
+                emit = (pred != 0) & active
+                if not emit.any():
+                    break
+                emitted.append(torch.where(emit, pred, blank))
+                emitted_frames.append(t)
+                new_dec_state, new_hidden = self.decoder.step(self._decoder_input(pred), hidden)
+                dec_state = torch.where(emit.unsqueeze(-1), new_dec_state, dec_state)
+                hidden = _where_state(emit, new_hidden, hidden, batch_dim)
+                active = emit
+        if not emitted:
+            return [[] for _ in range(batch_size)], [[] for _ in range(batch_size)]
+        emitted = torch.stack(emitted, dim=1).cpu()
+        emitted_frames = torch.tensor(emitted_frames)
+        tokens, frames = [], []
+        for row in emitted:
+            idx = row.nonzero().flatten()
+            tokens.append(row[idx].tolist())
+            frames.append(emitted_frames[idx].tolist())
+        return tokens, frames
+
+    def _greedy_prefix(self, enc_states, inputs_length, max_symbols_per_frame = 1):
+        # The bidirectional decoder has no incremental state, every emitted symbol re-runs the prefix
+        tokens, frames = [], []
+        for enc_state, length in zip(enc_states, inputs_length.tolist()):
+            prefix = torch.zeros(1, 1, dtype=torch.long, device=enc_states.device)
+            dec_state = self.decoder(self._decoder_input(prefix))[0][0, -1]
+            token_list, frame_list = [], []
+            for t in range(length):
+                for _ in range(max_symbols_per_frame):
+                    logits = self.joint(enc_state[t], dec_state)
+                    pred = int(logits.argmax(dim=-1).item())
+                    if pred == 0:
+                        break
+                    token_list.append(pred)
+                    frame_list.append(t)
+                    prefix = torch.cat([prefix, prefix.new_tensor([[pred]])], dim=1)
+                    dec_state = self.decoder(self._decoder_input(prefix))[0][0, -1]
+            tokens.append(token_list)
+            frames.append(frame_list)
+        return tokens, frames
@@ -12,6 +12,58 @@ from torch import Tensor
 from typing import Tuple
 import torch
 import torch.nn.functional as F
+
+class StatelessPredictor(nn.Module):
+    """
+    Stateless prediction network: the prediction only depends on the last ``context_size`` symbols,
+    computed by a small causal Conv1d over the embedded symbols (https://arxiv.org/abs/2109.07513).
+    Args:
+        input_dim (int): size of the embedded symbols
+        hidden_dim (int): output dimension of the predictor
+        context_size (int, optional): number of previous symbols seen by the predictor (default: 2)
+        dropout_p (float, optional): dropout probability of predictor
+    Inputs: inputs, state
+        inputs (torch.FloatTensor): embedded symbols of size ``(batch, seq_length, input_dim)``
+        state (torch.FloatTensor, optional): the last ``context_size - 1`` embedded symbols of size
+            ``(batch, input_dim, context_size - 1)``, zeros when not given
+    Returns:
+        (Tensor, Tensor):
+        * outputs (torch.FloatTensor): ``(batch, seq_length, hidden_dim)``
+        * state (torch.FloatTensor): ``(batch, input_dim, context_size - 1)``
+    """
+
+    def __init__(self, input_dim, hidden_dim, context_size = 2, dropout_p = 0.1):
+        super(StatelessPredictor, self).__init__()
+        if context_size < 1:
+            raise ValueError("Invalid context_size [{}]. Choose a context_size >= 1".format(context_size))
+        self.context_size = context_size
+        self.conv = nn.Conv1d(input_dim, hidden_dim, kernel_size = context_size, bias = True)
+        self.dropout = nn.Dropout(dropout_p)
+
+    def init_state(self, inputs):
+        return inputs.new_zeros(inputs.size(0), self.conv.in_channels, self.context_size - 1)
+
+    def forward(self, inputs, state = None):
+        inputs = inputs.transpose(1, 2)
+        if state is None:
+            state = self.init_state(inputs)
+        # Left context replaces the padding so the convolution stays causal
+        window = torch.cat([state, inputs], dim = -1)
+        outputs = self.dropout(F.relu(self.conv(window)))
+        state = window[:, :, window.size(-1) - (self.context_size - 1):]
+        return outputs.transpose(1, 2), state
+
+    def step(self, inputs, state = None):
+        # inputs: (batch, input_dim) - a single embedded symbol
+        if state is None:
+            state = self.init_state(inputs)
+        window = torch.cat([state, inputs.unsqueeze(-1)], dim = -1)
+        # Only the last window is needed, so the convolution reduces to a single matrix product
+        outputs = F.linear(window.flatten(1), self.conv.weight.flatten(1), self.conv.bias)
+        outputs = self.dropout(F.relu(outputs))
+        return outputs, window[:, :, 1:]
+
+
 #Imporved upon the code in https://github.com/sooftware/RNN-Transducer/blob/main/rnnt/decoder.py
 class DecoderRNNT(nn.Module):
     """
@@ -23,6 +75,10 @@ class DecoderRNNT(nn.Module):
         num_layers (int, optional): number of decoder layers (default: 1)
         rnn_type (str, optional): type of rnn cell (default: lstm)
         dropout_p (float, optional): dropout probability of decoder
+        decoder_type (str, optional): prediction network, one of ``bidirectional`` (full-sequence rnn),
+            ``unidirectional`` (causal rnn) or ``stateless`` (embedding + causal Conv1d) (default: bidirectional).
+            Only the causal variants support incremental decoding through `step`.
+        context_size (int, optional): number of previous symbols seen by the stateless predictor (default: 2)
     Inputs: inputs, input_lengths
         inputs (torch.LongTensor): A target sequence passed to decoder. `IntTensor` of size ``(batch, seq_length)``
         input_lengths (torch.LongTensor): The length of input tensor. ``(batch)``
@@ -42,23 +98,44 @@ class DecoderRNNT(nn.Module):
         "rnn": nn.RNN,
     }
 
-    def __init__(self, input_dim, hidden_dim, output_dim, num_layers = 4, rnn_type = "lstm", dropout_p = 0.1, enc_has_cont_val = True):
+    supported_decoders = ("bidirectional", "unidirectional", "stateless")
+
+    def __init__(self, input_dim, hidden_dim, output_dim, num_layers = 4, rnn_type = "lstm", dropout_p = 0.1, enc_has_cont_val = True, decoder_type = "bidirectional", context_size = 2):
         super(DecoderRNNT, self).__init__()
         self.hidden_size = hidden_dim
         self.enc_has_cont_val = enc_has_cont_val
+        self.decoder_type = decoder_type.lower()
+        if self.decoder_type not in self.supported_decoders:
+            raise ValueError("Unsupported decoder_type [{}]. Choose one of {}".format(decoder_type, self.supported_decoders))
         if not self.enc_has_cont_val:
           self.embedding = nn.Embedding(input_dim, hidden_dim)
-        rnn_cell = self.supported_rnns[rnn_type.lower()]
-        self.rnn = rnn_cell(
-            input_size=input_dim,
-            hidden_size=hidden_dim,
-            num_layers=num_layers,
-            bias=True,
-            batch_first=True,
-            dropout=dropout_p,
-            bidirectional=True
-        )
-        self.out_proj = nn.Linear(2 * hidden_dim, output_dim, bias = True)
+        # Symbols are embedded to hidden_dim before reaching the prediction network
+        predictor_input_dim = input_dim if self.enc_has_cont_val else hidden_dim
+        if self.decoder_type == "stateless":
+            self.predictor = StatelessPredictor(predictor_input_dim, hidden_dim, context_size = context_size, dropout_p = dropout_p)
+            self.out_proj = nn.Linear(hidden_dim, output_dim, bias = True)
+        else:
+            bidirectional = self.decoder_type == "bidirectional"
+            rnn_cell = self.supported_rnns[rnn_type.lower()]
+            self.rnn = rnn_cell(
+                input_size=predictor_input_dim,
+                hidden_size=hidden_dim,
+                num_layers=num_layers,
+                bias=True,
+                batch_first=True,
+                dropout=dropout_p,
+                bidirectional=bidirectional
+            )
+            self.out_proj = nn.Linear((2 if bidirectional else 1) * hidden_dim, output_dim, bias = True)
+
+    @property
+    def supports_step(self):
+        return self.decoder_type != "bidirectional"
+
+    def embed(self, inputs):
+        if self.enc_has_cont_val:
+            return inputs
+        return self.embedding(inputs)
 
     def forward(self, inputs, input_lengths = None, hidden_states = None):
         """
@@ -75,25 +152,49 @@ class DecoderRNNT(nn.Module):
             * hidden_states (torch.FloatTensor): A hidden state of decoder. `FloatTensor` of size
                 ``(batch, seq_length, dimension)``
         """
-        if self.enc_has_cont_val:
-            embedded = inputs
-        else:
-            embedded = self.embedding(inputs)
+        embedded = self.embed(inputs)
+
+        if self.decoder_type == "stateless":
+            # The causal convolution never looks past a position, so padded targets need no packing
+            outputs, hidden_states = self.predictor(embedded, hidden_states)
+            outputs = self.out_proj(outputs)
 
-        if input_lengths is not None:
-            sorted_seq_lengths, indices = torch.sort(input_lengths, descending=True)
-            embedded = embedded[indices]
+        elif input_lengths is not None:
+            # pack_padded_sequence sorts the batch itself (enforce_sorted=False) and restores the order
             embedded = nn.utils.rnn.pack_padded_sequence(
-                embedded.transpose(0, 1), input_lengths, enforce_sorted=False
+                embedded, input_lengths.cpu(), batch_first=True, enforce_sorted=False
             )
             self.rnn.flatten_parameters()
             outputs, hidden_states = self.rnn(embedded, hidden_states)
-            outputs, _ = nn.utils.rnn.pad_packed_sequence(outputs)
-            outputs = self.out_proj(outputs.transpose(0, 1))
+            outputs, _ = nn.utils.rnn.pad_packed_sequence(outputs, batch_first=True)
+            outputs = self.out_proj(outputs)
 
         else:
             self.rnn.flatten_parameters()
             outputs, hidden_states = self.rnn(embedded, hidden_states)
             outputs = self.out_proj(outputs)
 
-        return outputs, hidden_states
\ No newline at end of file
+        return outputs, hidden_states
+
+    def step(self, token, state = None):
+        """
+        Advance the prediction network by one emitted symbol, in constant time per symbol.
+        Args:
+            token (torch.Tensor): the last emitted symbol, `LongTensor` of size ``(batch)``, or a `FloatTensor`
+                of size ``(batch, input_dim)`` when ``enc_has_cont_val`` is set
+            state: the state returned by the previous call, ``None`` at the start of decoding
+        Returns:
+            (Tensor, state):
+            * decoder_output (torch.FloatTensor): ``(batch, output_dim)``
+            * state: rnn hidden state, or the symbol context of the stateless predictor
+        """
+        if not self.supports_step:
+            raise ValueError("step() needs a causal prediction network, build DecoderRNNT with "
+                             "decoder_type='unidirectional' or 'stateless'")
+        embedded = self.embed(token)
+        if self.decoder_type == "stateless":
+            outputs, state = self.predictor.step(embedded, state)
+        else:
+            outputs, state = self.rnn(embedded.unsqueeze(1), state)
+            outputs = outputs.squeeze(1)
+        return self.out_proj(outputs), state
@@ -5,42 +5,64 @@ Automatically generated by Colab.
 
 Original file is located at
     https://colab.research.google.com/drive/13aY9mGlYfGeRV8-Ptqd14qmmX1Ub9LcY
-"""
 
-!pip install librosa
-!pip install python_auditory_toolbox
-!pip install brian2hears
+librosa (audio loading, spectrograms) and matplotlib (plot) are optional and
+imported on first use: pip install "conformer-rnnt[frontends,plots]".
+"""
 
-import librosa
-import librosa.display
-import matplotlib.pyplot as plt
 import numpy as np
-import brian2hears
+import torch
+
+from .cochleogram import Cochleogram
+
+
+def _require(module, extra):
+  try:
+        return __import__(module, fromlist = ["_"])
+  except ImportError as e:
+        raise ImportError("{} is needed here, install it with pip install \"conformer-rnnt[{}]\"".format(module, extra)) from e
+
 
 class input_conversion:
+  supported_types = ('spectrogram', 'mel_spectrogram', 'cochleogram')
+
   def __init__(self, x, num_filters = 40, low_freq = 50, high_freq = 20000, convert_type = 'spectrogram'):
+        if convert_type not in self.supported_types:
+          raise ValueError("Unsupported convert_type [{}]. Choose one of {}".format(convert_type, self.supported_types))
         self.x = x
         self.num_filters = num_filters
         self.low_freq = low_freq
         self.high_freq = high_freq
         self.convert_type = convert_type
 
+  def convert(self):
+        librosa = _require('librosa', 'frontends')
         y, sr = librosa.load(self.x)
-        if convert_type == 'spectrogram':
+        if self.convert_type == 'spectrogram':
           D = librosa.stft(y)
           spectrogram_output = librosa.amplitude_to_db(np.abs(D), ref=np.max)
           return spectrogram_output
 
-        elif convert_type == 'mel_spectrogram':
+        elif self.convert_type == 'mel_spectrogram':
           melspectrogram_output = librosa.feature.melspectrogram(y=y, sr=sr)
           # Optionally, convert to decibel scale for better visualization
           melspectrogram_db = librosa.amplitude_to_db(melspectrogram_output, ref=np.max)
           return melspectrogram_db
-        elif convert_type == 'cochleogram':
-          sound = Sound(y, samplerate=sr*Hz)
-          cf = erbspace(low_freq*Hz, high_freq*Hz, num_filters)
-          gammatone = Gammatone(sound, cf)
-          cochlea = FunctionFilterbank(gammatone, lambda x: clip(x, 0, np.inf)**(1.0/3.0))
-          lowpass = LowPass(cochlea, 10*Hz)
-          cochleogram_output = lowpass.process().T
-          return cochleogram_output
\ No newline at end of file
+        elif self.convert_type == 'cochleogram':
+          # Gammatone filterbank, half-wave rectification, ^(1/3) compression and 10 Hz low-pass, see cochleogram.py
+          cochleogram = Cochleogram(sample_rate = sr, num_filters = self.num_filters, low_freq = self.low_freq, high_freq = self.high_freq)
+          cochleogram_output = cochleogram(torch.from_numpy(y)).numpy()
+          return cochleogram_output
+
+  def plot(self, output = None, ax = None):
+        # Display the converted features, computing them first when not given
+        plt = _require('matplotlib.pyplot', 'plots')
+        librosa_display = _require('librosa.display', 'frontends')
+        output = self.convert() if output is None else output
+        if ax is None:
+          _, ax = plt.subplots()
+        y_axis = {'spectrogram': 'log', 'mel_spectrogram': 'mel', 'cochleogram': None}[self.convert_type]
+        image = librosa_display.specshow(output, y_axis = y_axis, x_axis = 'time', ax = ax)
+        ax.set_title(self.convert_type)
+        plt.colorbar(image, ax = ax)
+        return ax
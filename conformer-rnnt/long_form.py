@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""long_form.py
+
+Offline transcription of recordings longer than one encoder window (full
+concerts, albums). The feature sequence is cut into overlapping windows of the
+model's ``seq_len`` frames, the windows are encoded and decoded either batched
+as one tensor in this process or spread over a pool of worker processes, and
+the per-window token streams are stitched back together:
+
+    window k      |------------|
+    window k+1            |------------|
+                          ^  cut  ^
+                        overlap
+
+Tokens of window k are kept before the middle of the overlap and tokens of
+window k+1 from there on, so every frame is taken from the window where it has
+the most context on both sides. A token emitted by both windows right at the
+cut (the same symbol within ``dedup_frames``) is kept once.
+
+    transcriber = LongFormTranscriber(model, overlap=8, processes=4)
+    tokens, frames = transcriber.transcribe(features)      # features: (T, input_dim), any T
+"""
+
+import concurrent.futures
+import os
+
+import torch
+import torch.multiprocessing as mp
+
+
+# librosa defaults used by input_conversion: 22050 Hz audio, hop length 512
+DEFAULT_FRAME_RATE = 22050 / 512
+
+
+def window_starts(num_frames, window, hop):
+    """Start frames of windows of ``window`` frames every ``hop`` frames, the last one reaching the end."""
+    if num_frames <= window:
+        return [0]
+    starts = list(range(0, num_frames - window, hop))
+    starts.append(num_frames - window)
+    return starts
+
+
+def stitch(starts, window, num_frames, window_tokens, window_frames, dedup_frames = 1):
+    """
+    Merge per-window decoding results into one stream of (token, global frame).
+
+    Args:
+        starts (list of int): start frame of every window
+        window (int): frames per window
+        num_frames (int): length of the recording
+        window_tokens, window_frames: tokens and window-local frame indices per window
+        dedup_frames (int): a token repeated across a cut within this many frames is kept once
+    """
+    tokens, frames = [], []
+    for k, start in enumerate(starts):
+        # Each window owns the frames between the midpoints of its overlaps with its neighbours
+        begin = 0 if k == 0 else (min(starts[k - 1] + window, num_frames) + start) // 2
+        end = num_frames if k == len(starts) - 1 else (min(start + window, num_frames) + starts[k + 1]) // 2
+        first = True
+        for token, frame in zip(window_tokens[k], window_frames[k]):
+            frame = start + frame
+            if not begin <= frame < end:
+                continue
+            if first and tokens and tokens[-1] == token and frame - frames[-1] <= dedup_frames:
+                first = False
+                continue
+            first = False
+            tokens.append(token)
+            frames.append(frame)
+    return tokens, frames
+
+
+def _decode_windows(model, windows, lengths, batch_size, max_symbols_per_frame = 1):
+    tokens, frames = [], []
+    for i in range(0, windows.size(0), batch_size):
+        batch_tokens, batch_frames = model.recognize(windows[i:i + batch_size], lengths[i:i + batch_size],
+                                                     return_timestamps=True,
+                                                     max_symbols_per_frame=max_symbols_per_frame)
+        tokens.extend(batch_tokens)
+        frames.extend(batch_frames)
+    return tokens, frames
+
+
+# Worker processes receive the model once, its tensors travel through shared memory
+_worker_model = None
+
+
+def _init_worker(model, threads):
+    global _worker_model
+    torch.set_num_threads(threads)
+    _worker_model = model.eval()
+
+
+def _worker_decode(windows, lengths, batch_size, max_symbols_per_frame):
+    return _decode_windows(_worker_model, windows, lengths, batch_size, max_symbols_per_frame)
+
+
+class LongFormTranscriber:
+    """
+    Args:
+        model (ConformerRNNT): the windows are ``model.encoder.seq_length`` frames, shorter ones are zero padded
+        window (int): frames taken from the recording per window, at most the model's ``seq_len``
+        overlap (int): frames shared by neighbouring windows
+        batch_size (int): windows decoded per call to ``recognize``
+        processes (int): worker processes, 0 decodes all windows in this process
+        threads_per_process (int): torch threads of every worker, default cores / processes
+        dedup_frames (int): see ``stitch``
+        max_symbols_per_frame (int): passed to ``recognize``
+    """
+
+    def __init__(self, model, window = None, overlap = None, batch_size = 16, processes = 0, threads_per_process = None,
+                 dedup_frames = 1, max_symbols_per_frame = 1):
+        self.model = model.eval()
+        self.seq_len = model.encoder.seq_length
+        self.window = window or self.seq_len
+        self.overlap = self.window // 4 if overlap is None else overlap
+        if not 0 < self.window <= self.seq_len:
+            raise ValueError("Invalid window [{}]. The model takes at most {} frames".format(self.window, self.seq_len))
+        if not 0 <= self.overlap < self.window:
+            raise ValueError("Invalid overlap [{}]. Must be smaller than the window".format(self.overlap))
+        self.batch_size = batch_size
+        self.processes = processes
+        self.dedup_frames = dedup_frames
+        self.max_symbols_per_frame = max_symbols_per_frame
+        self._pool = None
+        if processes > 0:
+            threads = threads_per_process or max(1, (os.cpu_count() or 1) // processes)
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=processes, mp_context=mp.get_context("spawn"), initializer=_init_worker,
+                initargs=(self.model, threads))
+
+    @property
+    def hop(self):
+        return self.window - self.overlap
+
+    def windows(self, features):
+        """(num_windows, seq_len, input_dim) windows, their valid lengths and start frames."""
+        num_frames = features.size(0)
+        starts = window_starts(num_frames, self.window, self.hop)
+        windows = features.new_zeros(len(starts), self.seq_len, features.size(1))
+        lengths = torch.empty(len(starts), dtype=torch.long)
+        for k, start in enumerate(starts):
+            chunk = features[start:start + self.window]
+            windows[k, :chunk.size(0)] = chunk
+            lengths[k] = chunk.size(0)
+        return windows, lengths, starts
+
+    @torch.no_grad()
+    def transcribe(self, features):
+        """Tokens and global frame indices for a (T, input_dim) feature sequence."""
+        windows, lengths, starts = self.windows(features)
+        if self._pool is None:
+            window_tokens, window_frames = _decode_windows(self.model, windows, lengths, self.batch_size,
+                                                           self.max_symbols_per_frame)
+        else:
+            # Contiguous groups of windows, as many as there are workers (or more for long recordings)
+            group = max(1, min(self.batch_size, -(-windows.size(0) // self.processes)))
+            jobs = [self._pool.submit(_worker_decode, windows[i:i + group], lengths[i:i + group], self.batch_size,
+                                      self.max_symbols_per_frame)
+                    for i in range(0, windows.size(0), group)]
+            window_tokens, window_frames = [], []
+            for job in jobs:
+                tokens, frames = job.result()
+                window_tokens.extend(tokens)
+                window_frames.extend(frames)
+        return stitch(starts, self.window, features.size(0), window_tokens, window_frames, self.dedup_frames)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def edit_distance(reference, hypothesis):
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref in enumerate(reference, 1):
+        current = [i]
+        for j, hyp in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref != hyp)))
+        previous = current
+    return previous[-1]
+
+
+def event_f1(reference, hypothesis, tolerance = 1):
+    """
+    F1 of (token, frame) events, a hypothesis event matches an unmatched reference event with the same token
+    within ``tolerance`` frames.
+    """
+    (ref_tokens, ref_frames), (hyp_tokens, hyp_frames) = reference, hypothesis
+    if not ref_tokens and not hyp_tokens:
+        return 1.
+    unmatched = list(zip(ref_tokens, ref_frames))
+    hits = 0
+    for token, frame in zip(hyp_tokens, hyp_frames):
+        for i, (ref_token, ref_frame) in enumerate(unmatched):
+            if ref_token == token and abs(ref_frame - frame) <= tolerance:
+                hits += 1
+                del unmatched[i]
+                break
+    return 2 * hits / (len(ref_tokens) + len(hyp_tokens))
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""model_config.py
+
+Command-line model arguments shared by the trainer and the inference entry
+points, and the ConformerRNNT they describe. Training stores these arguments
+in every checkpoint under ``"config"``, so inference rebuilds the architecture
+from the checkpoint instead of repeating the training flags. Only the model
+and checkpoint modules are imported, the training stack is not needed to
+serve a model.
+"""
+
+import argparse
+
+from .attention_mechanisms import MultiHeadSelfAttention
+from .checkpoint import load_checkpoint
+from .conformer_model import ConformerRNNT
+from .pruning import apply_plan
+
+
+# Arguments that define the architecture, stored in every checkpoint as part of its config. pruning_plans has no
+# flag, it is written by pruning.save_pruned
+MODEL_ARGS = ("input_dim", "seq_len", "num_enc_layers", "conv_kernel_size", "hidden_dim", "output_dim", "num_dec_layers",
+              "conv_dropout", "decoder_type", "vertical_attention", "horizontal_attention", "attention_window",
+              "pack_padded", "pruning_plans")
+
+
+def add_model_arguments(parser):
+    model = parser.add_argument_group("model")
+    model.add_argument("--input-dim", type=int, default=128)
+    model.add_argument("--seq-len", type=int, default=20)
+    model.add_argument("--num-enc-layers", type=int, default=16)
+    model.add_argument("--conv-kernel-size", type=int, default=8)
+    model.add_argument("--hidden-dim", type=int, default=512)
+    model.add_argument("--output-dim", type=int, default=256)
+    model.add_argument("--num-dec-layers", type=int, default=16)
+    model.add_argument("--conv-dropout", type=float, default=0.1)
+    model.add_argument("--decoder-type", default="bidirectional", choices=["bidirectional", "unidirectional", "stateless"])
+    model.add_argument("--vertical-attention", default="dense", choices=MultiHeadSelfAttention.supported_attention)
+    model.add_argument("--horizontal-attention", default="dense", choices=MultiHeadSelfAttention.supported_attention)
+    model.add_argument("--attention-window", type=int, default=16, help="with sliding_window attention")
+    model.add_argument("--pack-padded", action="store_true",
+                       help="run the position-wise encoder layers on the valid frames only")
+    return model
+
+
+def build_model(args):
+    """The ConformerRNNT described by ``args``, pruned by the plans of a pruned checkpoint's config, if any."""
+    model = ConformerRNNT(args.input_dim, args.seq_len, args.num_enc_layers, args.conv_kernel_size, args.hidden_dim,
+                          args.output_dim, args.num_dec_layers, conv_dropout=args.conv_dropout,
+                          decoder_type=args.decoder_type, vertical_attention=args.vertical_attention,
+                          horizontal_attention=args.horizontal_attention, attention_window=args.attention_window,
+                          pack_padded=args.pack_padded)
+    for plan in getattr(args, "pruning_plans", None) or []:
+        apply_plan(model, plan)
+    return model
+
+
+def with_checkpoint_config(args, path):
+    """
+    ``args`` with the model arguments of the training run that wrote the checkpoint at ``path``; the given values
+    are only kept for arguments the checkpoint does not store (checkpoints saved without a config).
+    """
+    config = load_checkpoint(path).get("config", {})
+    return argparse.Namespace(**{**vars(args), **{key: config[key] for key in MODEL_ARGS if key in config}})
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+"""note_events.py
+
+Turns transducer outputs into note events and Standard MIDI Files. The output
+vocabulary of the model is read as (0 is the RNN-T blank):
+
+    1 .. P                  onset of pitch p
+    P+1 .. 2P               offset of pitch p
+    2P+1 .. 2P+V            velocity bin, applies to the onsets that follow
+    2P+V+1 .. 3P+V          tie: pitch p is still sounding from before the window / chunk
+
+Decoded tokens are handled as flat arrays of (sequence, frame, token), in the
+order they were emitted, and paired into notes with sorts and cumulative scans
+instead of per-token loops: an onset starts a note, which ends at the next
+offset or re-struck onset of the same pitch; a tie starts a note only when none
+is sounding, otherwise it continues it; offsets without a sounding note are
+dropped. ``NoteStreamer`` applies the same pairing chunk by chunk, keeping the
+notes still sounding at the end of a chunk open until a later chunk ends them.
+
+Several events share a frame (a velocity token and its onset, the notes of a
+chord), so decoding has to emit more than one symbol per frame:
+``max_symbols_per_frame(*vocab.encode(notes)[:2])`` gives the number the
+training targets need, to be passed to ``recognize``.
+
+    vocab = NoteVocabulary()
+    tokens, frames = model.recognize(features, lengths, return_timestamps=True, max_symbols_per_frame=16)
+    notes = events_to_notes(vocab, *flatten(tokens, frames), end_frames=lengths.numpy())
+    files = notes_to_midi(notes)                      # {sequence: bytes of a type 0 MIDI file}
+"""
+
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from .long_form import DEFAULT_FRAME_RATE
+
+
+# Kinds of tokens
+OTHER, ONSET, OFFSET, VELOCITY, TIE = -1, 0, 1, 2, 3
+
+# Notes of a batch as parallel arrays, onset and offset in frames (offset excluded)
+Notes = namedtuple("Notes", ["sequence", "pitch", "onset", "offset", "velocity"])
+
+
+def empty_notes():
+    return Notes(*(np.zeros(0, dtype=np.int64) for _ in Notes._fields))
+
+
+def concat_notes(*notes):
+    return Notes(*(np.concatenate(arrays) for arrays in zip(*notes)))
+
+
+def _take(notes, index):
+    return Notes(*(array[index] for array in notes))
+
+
+def _note_order(notes):
+    # Order by sequence, onset and pitch
+    return np.argsort((notes.sequence * (notes.onset.max(initial=0) + 1) + notes.onset) * 128 + notes.pitch)
+
+
+class NoteVocabulary:
+    """
+    Args:
+        num_pitches (int): P, consecutive MIDI pitches starting at lowest_pitch (88 piano keys by default)
+        lowest_pitch (int): MIDI pitch of the first onset / offset / tie token
+        velocity_bins (int): V, velocities 1..127 quantised into this many bins
+    """
+
+    def __init__(self, num_pitches = 88, lowest_pitch = 21, velocity_bins = 32):
+        if lowest_pitch < 0 or lowest_pitch + num_pitches > 128:
+            raise ValueError("Invalid pitch range [{}, {}). MIDI pitches are 0..127".format(
+                lowest_pitch, lowest_pitch + num_pitches))
+        self.num_pitches = num_pitches
+        self.lowest_pitch = lowest_pitch
+        self.velocity_bins = velocity_bins
+        # First token of every kind, in the order of the kind codes
+        self.starts = np.array([1, 1 + num_pitches, 1 + 2 * num_pitches, 1 + 2 * num_pitches + velocity_bins])
+        self.sizes = np.array([num_pitches, num_pitches, velocity_bins, num_pitches])
+        self.size = 1 + 3 * num_pitches + velocity_bins
+        self.velocities = np.linspace(1, 127, velocity_bins).round().astype(np.int64)
+        # Kind and value of every token, plus a last entry for out of range tokens
+        kind = np.full(self.size + 1, OTHER)
+        value = np.zeros(self.size + 1, dtype=np.int64)
+        for code, (start, size) in enumerate(zip(self.starts, self.sizes)):
+            kind[start:start + size] = code
+            value[start:start + size] = self.velocities if code == VELOCITY else np.arange(size) + lowest_pitch
+        self._kinds, self._values = kind, value
+
+    def __len__(self):
+        return self.size
+
+    def classify(self, tokens):
+        """Kind codes (OTHER for blank and out of range tokens) and the MIDI pitch or velocity of every token."""
+        tokens = np.asarray(tokens, dtype=np.int64)
+        tokens = np.where((tokens >= 0) & (tokens < self.size), tokens, self.size)
+        return self._kinds[tokens], self._values[tokens]
+
+    def token(self, kind, value):
+        """Token of a kind for MIDI pitches (onset, offset, tie) or velocities (nearest bin)."""
+        kind, value = np.asarray(kind), np.asarray(value, dtype=np.int64)
+        index = np.where(kind == VELOCITY, self.velocity_bin(value), value - self.lowest_pitch)
+        return self.starts[kind] + index
+
+    def velocity_bin(self, velocity):
+        return np.abs(np.asarray(velocity)[..., None] - self.velocities).argmin(-1)
+
+    def encode(self, notes):
+        """
+        Flat (sequence, frame, token) arrays for notes: at every onset a velocity token followed by the onset,
+        at every offset the offset token, offsets first within a frame. A frame holds two tokens per onset plus
+        one per offset, see ``max_symbols_per_frame``.
+        """
+        count = len(notes.pitch)
+        note = np.tile(np.arange(count), 3)
+        kind = np.repeat([VELOCITY, ONSET, OFFSET], count)
+        value = np.concatenate([notes.velocity, notes.pitch, notes.pitch])
+        frame = np.concatenate([notes.onset, notes.onset, notes.offset])
+        sequence = np.tile(notes.sequence, 3)
+        # Within a frame: offsets, then velocity / onset pairs note by note
+        rank = np.where(kind == OFFSET, 0, 1)
+        order = np.lexsort((kind == ONSET, note, rank, frame, sequence))
+        return sequence[order], frame[order], self.token(kind[order], value[order])
+
+
+def max_symbols_per_frame(sequence, frame):
+    """Largest number of events in one frame of one sequence, what ``recognize`` must be allowed to emit per frame."""
+    if len(frame) == 0:
+        return 0
+    keys = np.asarray(sequence, dtype=np.int64) * (int(np.max(frame)) + 1) + np.asarray(frame, dtype=np.int64)
+    return int(np.unique(keys, return_counts=True)[1].max())
+
+
+def flatten(tokens, frames):
+    """Flat (sequence, frame, token) arrays from the token and frame lists of ``recognize(return_timestamps=True)``."""
+    counts = np.fromiter((len(t) for t in tokens), dtype=np.int64, count=len(tokens))
+    sequence = np.repeat(np.arange(len(tokens)), counts)
+    total = int(counts.sum())
+    token = np.fromiter((t for row in tokens for t in row), dtype=np.int64, count=total)
+    frame = np.fromiter((f for row in frames for f in row), dtype=np.int64, count=total)
+    return sequence, frame, token
+
+
+def from_frame_predictions(predictions, lengths = None):
+    """
+    Flat (sequence, frame, token) arrays from frame-level predictions (batch, T), e.g. the argmax of the
+    JointNet output at every frame, 0 being blank. Frames at or beyond ``lengths`` are ignored.
+    """
+    predictions = np.asarray(predictions)
+    emitted = predictions != 0
+    if lengths is not None:
+        emitted &= np.arange(predictions.shape[1]) < np.asarray(lengths)[:, None]
+    sequence, frame = np.nonzero(emitted)
+    return sequence.astype(np.int64), frame.astype(np.int64), predictions[sequence, frame].astype(np.int64)
+
+
+def _pair(vocab, sequence, frame, token, initial_velocity = 64, forced_velocity = None):
+    """
+    Pair note events of flat, emission ordered arrays. ``forced_velocity`` (-1 where unset) overrides the velocity
+    of individual onsets. Returns the notes and a boolean array of those not ended (their offset is -1),
+    and the last velocity of every sequence as a dict.
+    """
+    sequence, frame, token = (np.asarray(a, dtype=np.int64) for a in (sequence, frame, token))
+    order = None
+    if len(sequence) and (np.diff(sequence) < 0).any():
+        order = np.argsort(sequence * len(sequence) + np.arange(len(sequence)))
+        sequence, frame, token = sequence[order], frame[order], token[order]
+    kind, value = vocab.classify(token)
+    n = len(sequence)
+    index = np.arange(n)
+
+    # Velocity of every event: the last velocity token before it in its sequence, else the initial velocity
+    first = np.ones(n, dtype=bool)
+    first[1:] = sequence[1:] != sequence[:-1]
+    is_velocity = kind == VELOCITY
+    last = np.maximum.accumulate(np.where(is_velocity | first, index, 0)) if n else index
+    initial = np.asarray(initial_velocity)
+    initial = initial[sequence] if initial.ndim else np.full(n, initial)
+    velocity = np.where(is_velocity[last], value[last], initial)
+    last_velocity = {}
+    if n:
+        ends = np.flatnonzero(np.append(first[1:], True))
+        last_velocity = dict(zip(sequence[ends].tolist(), velocity[ends].tolist()))
+    if forced_velocity is not None:
+        forced = np.asarray(forced_velocity) if order is None else np.asarray(forced_velocity)[order]
+        velocity = np.where(forced >= 0, forced, velocity)
+
+    # Note events grouped by (sequence, pitch), emission order kept within a group
+    note = np.flatnonzero((kind >= ONSET) & (kind != VELOCITY))
+    # Pitches are below 128, the position in the key keeps the emission order within a group
+    note = note[np.argsort((sequence[note] * 128 + value[note]) * n + note)]
+    seq, pitch, kind, frame, velocity = sequence[note], value[note], kind[note], frame[note], velocity[note]
+    m = len(note)
+    same = np.zeros(m, dtype=bool)
+    same[1:] = (seq[1:] == seq[:-1]) & (pitch[1:] == pitch[:-1])
+    previous = np.full(m, OTHER)
+    previous[1:] = kind[:-1]
+    sounding = same & ((previous == ONSET) | (previous == TIE))
+    starts = (kind == ONSET) | ((kind == TIE) & ~sounding)
+
+    # A note ends at the next offset or onset of its group, ties continue it
+    breaks = (kind == ONSET) | (kind == OFFSET)
+    after = np.minimum.accumulate(np.where(breaks, np.arange(m), m)[::-1])[::-1]
+    after = np.append(after[1:], m)
+    start = np.flatnonzero(starts)
+    stop = after[start]
+    ended = stop < m
+    stop_safe = np.where(ended, stop, 0)
+    ended &= (seq[stop_safe] == seq[start]) & (pitch[stop_safe] == pitch[start])
+    offset = np.where(ended, frame[stop_safe], -1)
+    # An offset in the onset frame keeps the note for one frame, a re-strike in the same frame drops it
+    offset = np.where(ended & (kind[stop_safe] == OFFSET), np.maximum(offset, frame[start] + 1), offset)
+    keep = ~ended | (offset > frame[start])
+    start, offset, ended = start[keep], offset[keep], ended[keep]
+    notes = Notes(seq[start], pitch[start], frame[start], offset, velocity[start])
+    order = _note_order(notes)
+    return _take(notes, order), ~ended[order], last_velocity
+
+
+def events_to_notes(vocab, sequence, frame, token, end_frames = None, initial_velocity = 64):
+    """
+    Notes of flat (sequence, frame, token) arrays. Notes still sounding at the end are ended at ``end_frames``
+    (per sequence, e.g. the input lengths), or one frame after their sequence's last event.
+    """
+    notes, open_, _ = _pair(vocab, sequence, frame, token, initial_velocity)
+    if open_.any():
+        if end_frames is None:
+            sequence, frame = np.asarray(sequence), np.asarray(frame)
+            end_frames = np.zeros(int(sequence.max()) + 1, dtype=np.int64)
+            np.maximum.at(end_frames, sequence, frame + 1)
+        end = np.asarray(end_frames)[notes.sequence]
+        offset = np.where(open_, np.maximum(end, notes.onset + 1), notes.offset)
+        notes = notes._replace(offset=offset)
+    return notes
+
+
+class NoteStreamer:
+    """
+    Incremental note emission for one or more streams decoded chunk by chunk (e.g. windows of a
+    LongFormTranscriber or a live stream): ``push`` returns the notes that ended within the chunk and keeps the
+    sounding ones open, ``flush`` ends those.
+
+    Args:
+        vocab (NoteVocabulary)
+        initial_velocity (int): velocity of onsets before the first velocity token of a stream
+        require_ties (bool): a note open from an earlier chunk ends at the start of the next one unless that chunk
+            continues it with a tie token before any other event of its pitch (for models emitting ties for the
+            notes held into every window)
+    """
+
+    def __init__(self, vocab, initial_velocity = 64, require_ties = False):
+        self.vocab = vocab
+        self.initial_velocity = initial_velocity
+        self.require_ties = require_ties
+        self.open = empty_notes()
+        self.velocity = {}
+        self.emitted = 0
+
+    def _velocities(self, size):
+        velocity = np.full(size, self.initial_velocity, dtype=np.int64)
+        for stream, value in self.velocity.items():
+            if stream < size:
+                velocity[stream] = value
+        return velocity
+
+    def push(self, sequence, frame, token, start_frame = None):
+        """
+        Events of the next chunk as flat arrays of stream ids, absolute frames and tokens, emission ordered within
+        every stream. ``start_frame`` (scalar or per stream) is the first frame of the chunk, used by require_ties.
+        Returns the notes that ended, ordered by stream and onset.
+        """
+        sequence, frame, token = (np.asarray(a, dtype=np.int64) for a in (sequence, frame, token))
+        done = empty_notes()
+        held = self.open
+        if self.require_ties and len(held.pitch):
+            kind, pitch = self.vocab.classify(token)
+            pitched = np.flatnonzero((kind >= ONSET) & (kind != VELOCITY))
+            pitched = pitched[np.lexsort((pitched, pitch[pitched], sequence[pitched]))]
+            # First pitched event of every (stream, pitch) of the chunk
+            keys = sequence[pitched] * 256 + pitch[pitched]
+            unique, first = np.unique(keys, return_index=True)
+            tied = unique[kind[pitched[first]] == TIE]
+            continued = np.isin(held.sequence * 256 + held.pitch, tied)
+            if start_frame is None:
+                start_frame = frame.min() if len(frame) else 0
+            start = np.asarray(start_frame)
+            start = start[held.sequence] if start.ndim else np.full(len(held.pitch), start)
+            ended = _take(held, ~continued)
+            done = ended._replace(offset=np.maximum(start[~continued], ended.onset + 1))
+            held = _take(held, continued)
+
+        # Open notes re-enter as onsets ahead of the chunk, with their own velocity
+        size = int(max(sequence.max(initial=-1), held.sequence.max(initial=-1))) + 1
+        notes, open_, last_velocity = _pair(
+            self.vocab,
+            np.concatenate([held.sequence, sequence]),
+            np.concatenate([held.onset, frame]),
+            np.concatenate([self.vocab.token(np.full(len(held.pitch), ONSET), held.pitch), token]),
+            self._velocities(size),
+            np.concatenate([held.velocity, np.full(len(token), -1)]))
+        self.velocity.update(last_velocity)
+        self.open = _take(notes, open_)
+        done = concat_notes(done, _take(notes, ~open_))
+        done = _take(done, _note_order(done))
+        self.emitted += len(done.pitch)
+        return done
+
+    def flush(self, end_frames):
+        """End all open notes at ``end_frames`` (scalar or per stream) and return them."""
+        end = np.asarray(end_frames)
+        end = end[self.open.sequence] if end.ndim else np.full(len(self.open.pitch), end)
+        done = self.open._replace(offset=np.maximum(end, self.open.onset + 1))
+        self.open = empty_notes()
+        self.emitted += len(done.pitch)
+        return done
+
+
+# Standard MIDI Files
+
+def _variable_length(values):
+    """MIDI variable-length quantities of values below 2^28: a (n, 4) byte matrix and the valid bytes of every row."""
+    values = np.asarray(values, dtype=np.int64)
+    septets = (values[:, None] >> np.array([21, 14, 7, 0])) & 0x7f
+    lengths = 1 + (values >= 1 << 7).astype(np.int64) + (values >= 1 << 14) + (values >= 1 << 21)
+    valid = np.arange(4) >= 4 - lengths[:, None]
+    # Continuation bit on all bytes but the last
+    septets[:, :3] |= 0x80
+    return septets, valid
+
+
+def notes_to_midi(notes, frame_rate = DEFAULT_FRAME_RATE, ticks_per_beat = 480, tempo = 500000, program = 0,
+                  channel = 0):
+    """
+    Type 0 Standard MIDI Files for all sequences of ``notes`` at once. Returns {sequence: bytes}.
+
+    Args:
+        frame_rate (float): frames per second of the onset / offset frames
+        ticks_per_beat (int): MIDI time division
+        tempo (int): microseconds per beat
+        program (int): General MIDI program of the channel
+
+    Pitches outside 0..127 raise a ValueError, velocities are clamped to 1..127 (a note-on of velocity 0 is a
+    note-off).
+    """
+    if not 0 <= channel < 16 or not 0 <= program < 128:
+        raise ValueError("Invalid channel [{}] or program [{}]. Channels are 0..15, programs 0..127".format(
+            channel, program))
+    if len(notes.pitch) and (np.min(notes.pitch) < 0 or np.max(notes.pitch) > 127):
+        raise ValueError("Invalid pitches [{}, {}]. MIDI pitches are 0..127".format(
+            np.min(notes.pitch), np.max(notes.pitch)))
+    ticks_per_frame = ticks_per_beat * 1e6 / tempo / frame_rate
+    count = len(notes.pitch)
+    sequence = np.tile(notes.sequence, 2)
+    tick = np.round(np.concatenate([notes.onset, notes.offset]) * ticks_per_frame).astype(np.int64)
+    is_on = np.repeat([True, False], count)
+    # Note-offs before note-ons at the same tick, so a re-struck pitch is not cut by its previous note's end
+    order = np.argsort((sequence * (tick.max(initial=0) + 1) + tick) * 2 + is_on)
+    sequence, tick, is_on = sequence[order], tick[order], is_on[order]
+    pitch = np.tile(notes.pitch, 2)[order]
+    velocity = np.where(is_on, np.clip(np.tile(notes.velocity, 2)[order], 1, 127), 0)
+
+    first = np.ones(len(tick), dtype=bool)
+    first[1:] = sequence[1:] != sequence[:-1]
+    delta = np.where(first, tick, tick - np.roll(tick, 1))
+    septets, valid = _variable_length(delta)
+    status = np.where(is_on, 0x90, 0x80) | channel
+    rows = np.concatenate([septets, np.stack([status, pitch, velocity], axis=1)], axis=1)
+    mask = np.concatenate([valid, np.ones((len(tick), 3), dtype=bool)], axis=1)
+    data = rows[mask].astype(np.uint8)
+    # Byte ranges of every sequence in data
+    sizes = mask.sum(1)
+    bounds = np.concatenate([[0], np.cumsum(sizes)])
+    firsts = np.flatnonzero(first)
+    lasts = np.append(firsts[1:], len(tick))
+
+    header = b"MThd" + (6).to_bytes(4, "big") + (0).to_bytes(2, "big") + (1).to_bytes(2, "big") \
+        + ticks_per_beat.to_bytes(2, "big")
+    setup = b"\x00\xff\x51\x03" + tempo.to_bytes(3, "big") + bytes([0x00, 0xc0 | channel, program])
+    end = b"\x00\xff\x2f\x00"
+    files = {}
+    for seq, begin, stop in zip(sequence[firsts].tolist(), bounds[firsts].tolist(), bounds[lasts].tolist()):
+        track = setup + data[begin:stop].tobytes() + end
+        files[seq] = header + b"MTrk" + len(track).to_bytes(4, "big") + track
+    return files
+
+
+def write_midi(notes, directory, prefix = "transcription", **kwargs):
+    """Write one ``{prefix}_{sequence}.mid`` per sequence of ``notes`` into ``directory``. Returns the paths."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for sequence, data in notes_to_midi(notes, **kwargs).items():
+        path = os.path.join(directory, "{}_{}.mid".format(prefix, sequence))
+        with open(path, "wb") as f:
+            f.write(data)
+        paths.append(path)
+    return paths
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+"""profiling.py
+
+Opt-in per-layer instrumentation for ConformerRNNT. Forward and backward hooks
+are registered on the sub-modules of every ConformerBlock_*, on DecoderRNNT and
+on JointNet (and optionally on the optimizer step), and record wall time,
+activation memory and estimated FLOPs. Greedy decoding advances the decoder
+with ``DecoderRNNT.step`` rather than its forward, so ``step`` is wrapped too
+and recorded as the decoder's ``step`` phase. Nothing is registered until the
+profiler is attached, so a model that is not being profiled pays nothing.
+"""
+
+import contextlib
+import time
+from collections import defaultdict
+
+import torch
+import torch.nn as nn
+from torch.autograd.graph import register_multi_grad_hook
+from torch.autograd.profiler import record_function
+
+from .attention_mechanisms import DotProductAttention, LinearAttention, SlidingWindowAttention
+
+
+def _tensors(values):
+    if isinstance(values, torch.Tensor):
+        yield values
+    elif isinstance(values, (tuple, list)):
+        for value in values:
+            yield from _tensors(value)
+
+
+def _nbytes(values):
+    return sum(t.numel() * t.element_size() for t in _tensors(values))
+
+
+# FLOP estimates of the leaf modules, multiply-adds count as 2 FLOPs
+
+def _linear_flops(module, args, output):
+    return 2 * module.in_features * output.numel()
+
+
+def _conv1d_flops(module, args, output):
+    return 2 * (module.in_channels // module.groups) * module.kernel_size[0] * output.numel()
+
+
+def _rnn_flops(module, args, output):
+    inputs = args[0]
+    if isinstance(inputs, nn.utils.rnn.PackedSequence):
+        frames = inputs.data.size(0)
+    else:
+        frames = inputs.numel() // inputs.size(-1)
+    gates = {"LSTM": 4, "GRU": 3}.get(module.mode, 1)
+    directions = 2 if module.bidirectional else 1
+    flops = 0
+    for layer in range(module.num_layers):
+        input_size = module.input_size if layer == 0 else module.hidden_size * directions
+        flops += 2 * gates * module.hidden_size * (input_size + module.hidden_size) * frames * directions
+    return flops
+
+
+def _attention_flops(module, args, output):
+    queries, keys = args[0], args[1]
+    # scores = Q K^T and output = weights V
+    return 4 * queries.numel() * keys.size(-2)
+
+
+def _sliding_window_flops(module, args, output):
+    queries, keys = args[0], args[1]
+    seq_len = keys.size(-2)
+    glob = min(module.global_tokens, seq_len)
+    # Every query scores its band and the global keys, the global queries score the whole sequence
+    keys_per_query = min(2 * module.window + 1, seq_len) + glob
+    return 4 * queries.numel() * keys_per_query + 4 * queries.numel() // queries.size(-2) * glob * seq_len
+
+
+def _linear_attention_flops(module, args, output):
+    queries, values = args[0], args[2]
+    rows, dim_head = queries.numel() // queries.size(-1), queries.size(-1)
+    features = module.projection.size(0) if module.feature_map == "random" else dim_head
+    # phi(k)^T v and phi(q) (phi(k)^T v)
+    flops = 4 * rows * features * values.size(-1)
+    if module.feature_map == "random":
+        flops += 4 * rows * dim_head * features
+    if module.causal:
+        # Masked scores and their product with v inside a chunk, prefix sums of the chunk states across chunks
+        chunk = min(module.chunk_size, queries.size(-2))
+        flops += 2 * rows * chunk * (features + values.size(-1)) + rows // chunk * features * values.size(-1)
+    return flops
+
+
+FLOP_COUNTERS = (
+    (nn.Linear, _linear_flops),
+    (nn.Conv1d, _conv1d_flops),
+    (nn.RNNBase, _rnn_flops),
+    (DotProductAttention, _attention_flops),
+    (SlidingWindowAttention, _sliding_window_flops),
+    (LinearAttention, _linear_attention_flops),
+)
+
+
+class _StepWrapper:
+    """Instance attribute shadowing a module's ``step`` method, removed like a hook handle."""
+
+    def __init__(self, module, wrapper):
+        self.module = module
+        module.step = wrapper
+
+    def remove(self):
+        self.module.__dict__.pop("step", None)
+
+
+class LayerStats:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.
+        self.max_seconds = 0.
+        self.bytes = 0
+        self.flops = 0
+
+    def add(self, seconds, nbytes, flops = 0):
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.bytes += nbytes
+        self.flops += flops
+
+
+class LayerProfiler:
+    """
+    Per-layer wall time, activation memory and FLOPs of a ConformerRNNT.
+
+    Args:
+        model (nn.Module): the ConformerRNNT (or any module containing ConformerBlock_*, DecoderRNNT, JointNet)
+        optimizer (Optimizer, optional): its step is recorded as the ``optimizer`` layer
+        enabled (bool): when False attaching is a no-op and the model runs without any hooks
+        backward (bool): also record the backward pass of every layer
+        flops (bool): estimate FLOPs from the Linear, Conv1d, RNN and attention modules of every layer
+
+    Usage::
+
+        profiler = LayerProfiler(model, optimizer)
+        with profiler:
+            for batch in batches:
+                train_step(batch)
+        print(profiler.table())
+        with profiler.trace("trace.json"):
+            train_step(batch)
+
+    Memory is the size of the tensors produced by a layer (outputs in forward,
+    input or parameter gradients in backward). On CUDA the growth of the allocator is
+    recorded instead. Backward FLOPs are estimated as twice the forward FLOPs.
+    """
+
+    def __init__(self, model, optimizer = None, enabled = True, backward = True, flops = True):
+        self.model = model
+        self.optimizer = optimizer
+        self.enabled = enabled
+        self.record_backward = backward
+        self.record_flops = flops
+        self.stats = defaultdict(LayerStats)
+        self.kinds = {}
+        self._handles = []
+        self._starts = {}
+        self._active = []
+        self._ranges = {}
+        self._backward_handles = set()
+        self._tracing = False
+
+    # registration
+
+    def layers(self):
+        """(name, kind, module) of every instrumented layer."""
+        for name, module in self.model.named_modules():
+            cls_name = type(module).__name__
+            if cls_name.startswith("ConformerBlock_"):
+                block_kind = cls_name[len("ConformerBlock_"):].lower()
+                for child_name, child in module.named_children():
+                    yield f"{name}.{child_name}", f"{block_kind}.{child_name}", child
+            elif cls_name == "DecoderRNNT":
+                yield name, "decoder", module
+            elif cls_name == "JointNet":
+                yield name, "joint", module
+
+    def attach(self):
+        if not self.enabled or self._handles:
+            return self
+        for name, kind, module in self.layers():
+            self.kinds[name] = kind
+            self._handles.append(module.register_forward_pre_hook(self._forward_pre_hook(name)))
+            self._handles.append(module.register_forward_hook(self._forward_hook(name, module)))
+            if kind == "decoder":
+                self._handles.append(_StepWrapper(module, self._step_wrapper(name, module.step)))
+            if self.record_flops:
+                for leaf in module.modules():
+                    for cls, counter in FLOP_COUNTERS:
+                        if isinstance(leaf, cls):
+                            self._handles.append(leaf.register_forward_hook(self._flop_hook(counter)))
+                            break
+        if self.optimizer is not None:
+            self.kinds["optimizer"] = "optimizer"
+            self._handles.append(self.optimizer.register_step_pre_hook(lambda *_: self._start("optimizer", "step")))
+            self._handles.append(self.optimizer.register_step_post_hook(lambda *_: self._stop("optimizer", "step", 0)))
+        return self
+
+    def detach(self):
+        for handle in self._handles + list(self._backward_handles):
+            handle.remove()
+        self._handles = []
+        self._backward_handles.clear()
+        self._starts.clear()
+        self._active.clear()
+        return self
+
+    def __enter__(self):
+        return self.attach()
+
+    def __exit__(self, *exc):
+        self.detach()
+        return False
+
+    def reset(self):
+        self.stats.clear()
+
+    # hooks
+
+    def _memory(self):
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            return torch.cuda.memory_allocated()
+        return None
+
+    def _start(self, name, phase):
+        if self._tracing:
+            self._ranges[name, phase] = record_function(f"{name} ({phase})").__enter__()
+        self._starts[name, phase] = (time.perf_counter(), self._memory())
+
+    def _stop(self, name, phase, produced, flops = 0):
+        start, memory = self._starts.pop((name, phase), (None, None))
+        if start is None:
+            return
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            torch.cuda.synchronize()
+            produced = torch.cuda.memory_allocated() - memory
+        self.stats[name, phase].add(time.perf_counter() - start, produced, flops)
+        rf = self._ranges.pop((name, phase), None)
+        if rf is not None:
+            rf.__exit__(None, None, None)
+
+    def _forward_pre_hook(self, name):
+        def hook(module, args):
+            self._active.append([name, 0])
+            self._start(name, "forward")
+        return hook
+
+    def _forward_hook(self, name, module):
+        def hook(module_, args, output):
+            _, flops = self._active.pop()
+            self._stop(name, "forward", _nbytes(output), flops)
+            if self.record_backward and torch.is_grad_enabled():
+                self._watch_backward(name, module, args, output, 2 * flops)
+        return hook
+
+    def _step_wrapper(self, name, step):
+        def wrapper(*args, **kwargs):
+            self._active.append([name, 0])
+            self._start(name, "step")
+            output = step(*args, **kwargs)
+            _, flops = self._active.pop()
+            self._stop(name, "step", _nbytes(output), flops)
+            return output
+        return wrapper
+
+    def _watch_backward(self, name, module, args, output, flops):
+        # The backward of a layer starts with the first gradient of its outputs and ends with the first
+        # gradient of its inputs (the engine may run other layers before the remaining ones are consumed),
+        # or with the last gradient of its parameters when no input requires grad (first encoder block,
+        # decoder fed with the targets)
+        outputs = [t for t in _tensors(output) if t.requires_grad]
+        inputs = [t for t in _tensors(args) if t.requires_grad]
+        end_mode = "any"
+        if not inputs:
+            inputs = [p for p in module.parameters() if p.requires_grad]
+            end_mode = "all"
+        if not outputs or not inputs:
+            return
+        handles = []
+
+        def start(grad):
+            self._start(name, "backward")
+
+        def stop(grads):
+            grads = [grads] if end_mode == "any" else [g for g in grads if g is not None]
+            self._stop(name, "backward", _nbytes(grads), flops)
+            for handle in handles:
+                handle.remove()
+                self._backward_handles.discard(handle)
+
+        handles.append(register_multi_grad_hook(outputs, start, mode="any"))
+        handles.append(register_multi_grad_hook(inputs, stop, mode=end_mode))
+        self._backward_handles.update(handles)
+
+    def _flop_hook(self, counter):
+        def hook(module, args, output):
+            if self._active:
+                self._active[-1][1] += counter(module, args, output)
+        return hook
+
+    # reporting
+
+    @contextlib.contextmanager
+    def region(self, name):
+        """Record an arbitrary block of code (e.g. data loading) as its own layer."""
+        self.kinds.setdefault(name, name)
+        self._start(name, "region")
+        try:
+            yield
+        finally:
+            self._stop(name, "region", 0)
+
+    @contextlib.contextmanager
+    def trace(self, path, **profile_kwargs):
+        """Export a Chrome trace of the enclosed code to ``path``, with one range per instrumented layer."""
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        attached = bool(self._handles)
+        self.attach()
+        self._tracing = True
+        try:
+            with torch.profiler.profile(activities=activities, **profile_kwargs) as prof:
+                yield prof
+        finally:
+            self._tracing = False
+            if not attached:
+                self.detach()
+        prof.export_chrome_trace(path)
+
+    def summary(self, group_by = "layer"):
+        """Rows of per-layer (``group_by="layer"``) or per-kind (``group_by="kind"``, e.g. all vertical attention) stats."""
+        grouped = defaultdict(LayerStats)
+        for (name, phase), stats in self.stats.items():
+            key = (name if group_by == "layer" else self.kinds.get(name, name), phase)
+            total = grouped[key]
+            total.calls += stats.calls
+            total.seconds += stats.seconds
+            total.max_seconds = max(total.max_seconds, stats.max_seconds)
+            total.bytes += stats.bytes
+            total.flops += stats.flops
+        overall = sum(s.seconds for s in grouped.values()) or 1.
+        rows = []
+        for (name, phase), stats in sorted(grouped.items(), key=lambda item: -item[1].seconds):
+            rows.append({
+                "layer": name,
+                "phase": phase,
+                "calls": stats.calls,
+                "total_ms": 1e3 * stats.seconds,
+                "mean_ms": 1e3 * stats.seconds / stats.calls,
+                "max_ms": 1e3 * stats.max_seconds,
+                "percent": 100 * stats.seconds / overall,
+                "mem_mb": stats.bytes / stats.calls / 2 ** 20,
+                "gflops": stats.flops / stats.calls / 1e9,
+                "gflops_per_s": stats.flops / stats.seconds / 1e9 if stats.seconds else 0.,
+            })
+        return rows
+
+    def table(self, group_by = "layer", limit = None):
+        rows = self.summary(group_by)[:limit]
+        width = max([len(row["layer"]) for row in rows] + [5])
+        lines = [f"{'layer':<{width}}  {'phase':<8} {'calls':>6} {'total ms':>10} {'mean ms':>9} {'max ms':>9} "
+                 f"{'%':>6} {'mem MB':>8} {'GFLOP':>8} {'GFLOP/s':>8}"]
+        for row in rows:
+            lines.append(f"{row['layer']:<{width}}  {row['phase']:<8} {row['calls']:>6} {row['total_ms']:>10.2f} "
+                         f"{row['mean_ms']:>9.3f} {row['max_ms']:>9.3f} {row['percent']:>6.1f} {row['mem_mb']:>8.2f} "
+                         f"{row['gflops']:>8.3f} {row['gflops_per_s']:>8.2f}")
+        return "\n".join(lines)
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""pruning.py
+
+Structured pruning of the Conformer encoder into a smaller dense model. Whole
+units are removed and the layers holding them are rebuilt with fewer rows or
+columns, so the pruned model runs the same dense kernels, only smaller:
+
+    attention heads         MultiHeadSelfAttention.to_qvk rows, W_0 columns
+    FFN hidden channels     FeedForward_* first Linear rows, second Linear columns
+    conv-module channels    ConformerConvModule_* pointwise convs, depthwise conv and BatchNorm
+    blocks                  entries of Conformer.layers_vertical / layers_horizontal
+
+Units are ranked by first-order Taylor importance, (sum of weight * gradient
+over the unit)^2 accumulated over calibration batches, or by weight magnitude
+when no data is given. Blocks are ranked by how much the loss grows when the
+block is skipped. The result is a plan, the indices kept per module, that only
+holds plain lists, so it is stored in the checkpoint config next to the pruned
+weights and re-applied to a freshly built model before they are loaded:
+
+    scores = importance(model, loss_fn, batches)
+    plan = plan_pruning(model, scores, heads=0.25, ffn=0.5, conv=0.25, vertical_blocks=2)
+    apply_plan(model, plan)
+    fine_tune(model, loss_fn, batches, steps=200)
+    save_pruned("pruned.pt", model, plan, config)     # config: the model arguments of the unpruned model
+
+    model = build_model(with_checkpoint_config(args, "pruned.pt"))   # later, see model_config
+    load_for_inference("pruned.pt", model)
+"""
+
+import itertools
+
+import torch
+from torch import nn
+
+from .attention_mechanisms import MultiHeadSelfAttention
+from .checkpoint import atomic_save, snapshot
+from .conformer_model import (Conformer, ConformerConvModule_Horizontal, ConformerConvModule_Vertical,
+                              FeedForward_Horizontal, FeedForward_Vertical)
+
+
+_FEED_FORWARD = (FeedForward_Horizontal, FeedForward_Vertical)
+_CONV_MODULE = (ConformerConvModule_Horizontal, ConformerConvModule_Vertical)
+_BRANCHES = ("layers_vertical", "layers_horizontal")
+
+
+def _kind(module):
+    if isinstance(module, MultiHeadSelfAttention):
+        return "heads"
+    if isinstance(module, _FEED_FORWARD):
+        return "ffn"
+    if isinstance(module, _CONV_MODULE):
+        return "conv"
+    return None
+
+
+def _find_encoder(model):
+    return model if isinstance(model, Conformer) else model.encoder
+
+
+# Rebuilding layers with a subset of their rows / columns
+
+def _index(keep, device):
+    return torch.as_tensor(keep, dtype=torch.long, device=device)
+
+
+def prune_linear(linear, keep, dim):
+    """New nn.Linear keeping the output features (dim=0) or input features (dim=1) in ``keep``."""
+    index = _index(keep, linear.weight.device)
+    weight = linear.weight.index_select(dim, index)
+    new = nn.Linear(weight.size(1), weight.size(0), bias=linear.bias is not None,
+                    device=weight.device, dtype=weight.dtype)
+    new.weight.data.copy_(weight)
+    if linear.bias is not None:
+        new.bias.data.copy_(linear.bias if dim == 1 else linear.bias.index_select(0, index))
+    return new
+
+
+def prune_conv1d(conv, keep, dim):
+    """New nn.Conv1d keeping the output (dim=0) or input (dim=1) channels in ``keep``, depthwise convs keep both."""
+    index = _index(keep, conv.weight.device)
+    depthwise = conv.groups == conv.in_channels and conv.groups > 1
+    weight = conv.weight.index_select(0 if depthwise else dim, index)
+    in_channels = len(keep) if depthwise or dim == 1 else conv.in_channels
+    out_channels = len(keep) if depthwise or dim == 0 else conv.out_channels
+    new = nn.Conv1d(in_channels, out_channels, conv.kernel_size, stride=conv.stride, padding=conv.padding,
+                    dilation=conv.dilation, groups=len(keep) if depthwise else conv.groups,
+                    bias=conv.bias is not None, device=weight.device, dtype=weight.dtype)
+    new.weight.data.copy_(weight)
+    if conv.bias is not None:
+        new.bias.data.copy_(conv.bias if dim == 1 and not depthwise else conv.bias.index_select(0, index))
+    return new
+
+
+def prune_batch_norm(norm, keep):
+    """BatchNorm of the same class over the channels in ``keep``, running statistics included."""
+    if not isinstance(norm, nn.modules.batchnorm._BatchNorm):
+        return norm
+    device = next(itertools.chain(norm.parameters(), norm.buffers())).device
+    index = _index(keep, device)
+    new = type(norm)(len(keep), eps=norm.eps, momentum=norm.momentum, affine=norm.affine,
+                     track_running_stats=norm.track_running_stats, device=device)
+    new.load_state_dict({name: value.index_select(0, index) if value.dim() else value
+                         for name, value in norm.state_dict().items()})
+    return new.train(norm.training)
+
+
+def _head_index(keep, heads, dim_head, chunks):
+    # Features of the kept heads in the (dim_head, chunks, heads) layout of to_qvk, or (heads, dim_head) with chunks=0
+    if chunks == 0:
+        return [h * dim_head + d for h in keep for d in range(dim_head)]
+    return [d * chunks * heads + k * heads + h for d in range(dim_head) for k in range(chunks) for h in keep]
+
+
+def prune_heads(attention, keep):
+    """Keep the heads in ``keep`` of a MultiHeadSelfAttention, in place."""
+    attention.to_qvk = prune_linear(attention.to_qvk, _head_index(keep, attention.heads, attention.dim_head, 3), 0)
+    attention.W_0 = prune_linear(attention.W_0, _head_index(keep, attention.heads, attention.dim_head, 0), 1)
+    attention.heads = len(keep)
+    attention.inner_dim = attention.heads * attention.dim_head
+    return attention
+
+
+def prune_feed_forward(feed_forward, keep):
+    """Keep the hidden channels in ``keep`` of a FeedForward_*, in place."""
+    net = feed_forward.net
+    net[0] = prune_linear(net[0], keep, 0)
+    net[3] = prune_linear(net[3], keep, 1)
+    return feed_forward
+
+
+def prune_conv_module(conv_module, keep):
+    """Keep the inner channels in ``keep`` of a ConformerConvModule_*, in place."""
+    net = conv_module.net
+    inner = net[4].conv.in_channels
+    # The vertical module doubles the first pointwise conv for the GLU, which gates channel c with channel c + inner
+    gated = net[2].out_channels == 2 * inner
+    net[2] = prune_conv1d(net[2], list(keep) + [c + inner for c in keep] if gated else keep, 0)
+    net[4].conv = prune_conv1d(net[4].conv, keep, 0)
+    net[5] = prune_batch_norm(net[5], keep)
+    net[7] = prune_conv1d(net[7], keep, 1)
+    return conv_module
+
+
+_PRUNE = {"heads": prune_heads, "ffn": prune_feed_forward, "conv": prune_conv_module}
+
+
+# Importance
+
+def _group_saliency(module, values):
+    """Per-unit sums of ``values(parameter)`` over the parameters of a prunable module, shape (units,)."""
+    kind = _kind(module)
+    if kind == "heads":
+        heads, dim_head = module.heads, module.dim_head
+        score = values(module.to_qvk.weight).view(dim_head, 3, heads, -1).sum(dim=(0, 1, 3))
+        if module.to_qvk.bias is not None:
+            score = score + values(module.to_qvk.bias).view(dim_head, 3, heads).sum(dim=(0, 1))
+        return score + values(module.W_0.weight).view(-1, heads, dim_head).sum(dim=(0, 2))
+    if kind == "ffn":
+        first, second = module.net[0], module.net[3]
+        return values(first.weight).sum(1) + values(first.bias) + values(second.weight).sum(0)
+    net = module.net
+    inner = net[4].conv.in_channels
+    score = values(net[2].weight).view(-1, inner, net[2].in_channels).sum(dim=(0, 2))
+    score = score + values(net[2].bias).view(-1, inner).sum(0) + values(net[4].conv.weight).sum(dim=(1, 2))
+    score = score + values(net[4].conv.bias)
+    if isinstance(net[5], nn.modules.batchnorm._BatchNorm) and net[5].affine:
+        score = score + values(net[5].weight) + values(net[5].bias)
+    return score + values(net[7].weight).sum(dim=(0, 2))
+
+
+class _Skip(nn.Module):
+    # Stands in for a block while measuring the loss without it
+    def forward(self, x, **kwargs):
+        return x
+
+
+def _prunable(encoder):
+    return [(name, module) for name, module in encoder.named_modules() if _kind(module)]
+
+
+def importance(model, loss_fn = None, batches = (), max_batches = None):
+    """
+    Scores of every prunable unit of the encoder of ``model`` (a Conformer or ConformerRNNT), higher is more important.
+
+    Args:
+        loss_fn: callable (model, batch) -> scalar loss, None ranks by weight magnitude
+        batches: iterable of calibration batches for loss_fn
+        max_batches (int): calibration batches used at most
+    Returns:
+        dict of module name (relative to the encoder) -> (units,) scores, and "layers_vertical" /
+        "layers_horizontal" -> (blocks,) loss increase when the block is skipped (only with loss_fn)
+    """
+    encoder = _find_encoder(model)
+    modules = _prunable(encoder)
+    if loss_fn is None:
+        with torch.no_grad():
+            return {name: _group_saliency(module, lambda p: p.abs()) for name, module in modules}
+
+    batches = list(itertools.islice(batches, max_batches))
+    if not batches:
+        raise ValueError("importance needs at least one calibration batch with a loss_fn")
+    was_training = model.training
+    # Eval mode: dropout off and BatchNorm running statistics untouched by the calibration data
+    model.eval()
+    scores = {name: 0. for name, _ in modules}
+    for batch in batches:
+        model.zero_grad(set_to_none=True)
+        loss_fn(model, batch).backward()
+        with torch.no_grad():
+            for name, module in modules:
+                taylor = _group_saliency(module, lambda p: p * p.grad if p.grad is not None else torch.zeros_like(p))
+                scores[name] = scores[name] + taylor.pow(2)
+    model.zero_grad(set_to_none=True)
+
+    with torch.no_grad():
+        base = sum(loss_fn(model, batch).item() for batch in batches)
+        for branch in _BRANCHES:
+            blocks = getattr(encoder, branch)
+            increase = []
+            for i, block in enumerate(blocks):
+                blocks[i] = _Skip()
+                increase.append(sum(loss_fn(model, batch).item() for batch in batches) - base)
+                blocks[i] = block
+            scores[branch] = torch.tensor(increase)
+    model.train(was_training)
+    return scores
+
+
+# Plans
+
+def select(scores, amount, round_to = 1, minimum = 1):
+    """
+    Sorted indices of the units to keep after removing ``amount`` of them (a fraction below 1, else a count),
+    the lowest scoring first. The kept count is rounded up to a multiple of ``round_to``.
+    """
+    units = len(scores)
+    remove = int(amount * units) if amount < 1 else int(amount)
+    keep = max(minimum, units - remove)
+    keep = min(units, -(-keep // round_to) * round_to)
+    order = torch.as_tensor(scores).argsort(descending=True)
+    return sorted(order[:keep].tolist())
+
+
+def plan_pruning(model, scores, heads = 0., ffn = 0., conv = 0., vertical_blocks = 0, horizontal_blocks = 0,
+                 round_to = 1):
+    """
+    Indices to keep in every prunable module of the encoder.
+
+    Args:
+        scores: from ``importance``
+        heads, ffn, conv: share (below 1) or number of the units to remove in every module of that kind
+        vertical_blocks, horizontal_blocks: number of blocks to remove from each branch, the lowest scoring ones
+            (or the last ones when ``scores`` has no block scores)
+        round_to (int): FFN and conv channel counts are kept at multiples of this, for CPU friendly shapes
+    """
+    encoder = _find_encoder(model)
+    amounts = {"heads": heads, "ffn": ffn, "conv": conv}
+    plan = {}
+    for name, module in _prunable(encoder):
+        kind = _kind(module)
+        if amounts[kind]:
+            plan[name] = select(scores[name], amounts[kind], round_to if kind != "heads" else 1)
+    for branch, amount in zip(_BRANCHES, (vertical_blocks, horizontal_blocks)):
+        if amount:
+            depth = len(getattr(encoder, branch))
+            block_scores = scores.get(branch, torch.arange(depth, 0, -1, dtype=torch.float))
+            plan[branch] = select(block_scores, int(amount))
+    return plan
+
+
+def apply_plan(model, plan):
+    """Prune the encoder of ``model`` as described by ``plan``, in place. Returns ``model``."""
+    encoder = _find_encoder(model)
+    modules = dict(encoder.named_modules())
+    for name, keep in plan.items():
+        if name in _BRANCHES:
+            continue
+        module = modules.get(name)
+        if _kind(module) is None:
+            raise ValueError("Invalid plan entry [{}]. Not a prunable module of the encoder".format(name))
+        _PRUNE[_kind(module)](module, keep)
+    # Blocks last, removing them renames the modules the entries above refer to
+    for branch in _BRANCHES:
+        if branch in plan:
+            blocks = getattr(encoder, branch)
+            setattr(encoder, branch, nn.ModuleList([blocks[i] for i in plan[branch]]))
+    return model
+
+
+def save_pruned(path, model, plan, config):
+    """
+    Write the weights of the pruned ``model`` as a checkpoint whose config is ``config`` (the model arguments it was
+    built from, e.g. the config of the checkpoint it was loaded from) with ``plan`` appended to its
+    ``pruning_plans``. ``model_config.build_model`` applies those plans in order, so the server and
+    ``load_for_inference`` get a model of the pruned shape.
+    """
+    config = {**config, "pruning_plans": list(config.get("pruning_plans") or []) + [plan]}
+    atomic_save({"step": 0, "model": snapshot(model.state_dict()), "config": config}, path)
+
+
+# Fine-tuning and size
+
+def fine_tune(model, loss_fn, batches, steps, lr = 1e-4, optimizer = None, callback = None):
+    """
+    Short recovery training after pruning: ``steps`` optimizer steps of ``loss_fn(model, batch)`` over ``batches``
+    (cycled). ``callback(step, loss)`` is called after every step. Returns the losses.
+    """
+    optimizer = optimizer or torch.optim.Adam(model.parameters(), lr=lr)
+    model.train()
+    losses = []
+    for step, batch in zip(range(1, steps + 1), itertools.cycle(batches)):
+        optimizer.zero_grad(set_to_none=True)
+        loss = loss_fn(model, batch)
+        loss.backward()
+        optimizer.step()
+        losses.append(loss.item())
+        if callback is not None:
+            callback(step, loss.item())
+    model.eval()
+    return losses
+
+
+def model_size(model):
+    """Number of parameters and bytes of the parameters and buffers."""
+    parameters = sum(p.numel() for p in model.parameters())
+    size = sum(t.numel() * t.element_size() for t in itertools.chain(model.parameters(), model.buffers()))
+    return parameters, size
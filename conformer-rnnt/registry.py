@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""registry.py
+
+Name-based lookup of the interchangeable building blocks. Entries are
+"module:attribute" strings, the module is only imported when a name is first
+resolved, so listing or configuring blocks by name costs nothing at import time.
+
+    act = get_activation("aptx")
+    attention = get_attention("sliding_window", window = 32)
+    position = get_positional_embedding("rotary", d_model = 256)
+    register(ACTIVATIONS, "my_act", MyActivation)        # classes can be added directly
+"""
+
+import importlib
+
+
+ACTIVATIONS = {name: "activation_functions:" + name for name in (
+    "softmax", "logsoftmax", "glu", "celu", "selu", "softmax2d", "sigmoid", "relu", "leakyrelu", "gatedglu", "gelu",
+    "swish", "geglu", "swiglu", "swiglu_variant", "mish", "swishl", "swishr", "aptx", "sigmaptx",
+)}
+
+ATTENTIONS = {
+    "dot_product": "attention_mechanisms:DotProductAttention",
+    "sliding_window": "attention_mechanisms:SlidingWindowAttention",
+    "linear": "attention_mechanisms:LinearAttention",
+    "multi_head": "attention_mechanisms:MultiHeadAttention",
+    "multi_head_self": "attention_mechanisms:MultiHeadSelfAttention",
+}
+
+POSITIONAL_EMBEDDINGS = {
+    "absolute": "positional_embedding:absolutepositionalembedding",
+    "rotary": "positional_embedding:rotarypositionalembedding",
+    "relative": "positional_embedding:relativeembedding",
+    "t5_relative": "positional_embedding:t5relativeembedding",
+}
+
+
+def register(registry, name, target):
+    """Add ``target`` (a class or a "module:attribute" string relative to this package) under ``name``."""
+    registry[name] = target
+
+
+def resolve(registry, name):
+    """The class registered under ``name``, importing its module on first use."""
+    try:
+        target = registry[name]
+    except KeyError:
+        raise ValueError("Unknown name [{}]. Choose one of {}".format(name, sorted(registry))) from None
+    if isinstance(target, str):
+        module, _, attribute = target.partition(":")
+        target = getattr(importlib.import_module("." + module, __package__), attribute)
+        registry[name] = target
+    return target
+
+
+def get_activation(name, *args, **kwargs):
+    return resolve(ACTIVATIONS, name)(*args, **kwargs)
+
+
+def get_attention(name, *args, **kwargs):
+    return resolve(ATTENTIONS, name)(*args, **kwargs)
+
+
+def get_positional_embedding(name, *args, **kwargs):
+    return resolve(POSITIONAL_EMBEDDINGS, name)(*args, **kwargs)
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""train.py
+
+Data-parallel trainer for ConformerRNNT, replacing the single-process loop of
+custom_architecture_with_conformer_rnnt_model_1.ipynb. Runs
+DistributedDataParallel over gloo across CPU processes on one machine
+(``--nprocs``) or across nodes when launched by torchrun, with gradient
+accumulation and bucketed all-reduce overlapping the backward pass.
+
+    python -m conformer_rnnt.train --nprocs 4 --steps 200 --accumulation-steps 2
+    torchrun --nnodes 2 --nproc-per-node 8 ... -m conformer_rnnt.train --steps 200
+    python -m conformer_rnnt.train --scaling-study 1 2 4 8 --steps 30
+"""
+
+import argparse
+import contextlib
+import glob
+import json
+import os
+import socket
+import tempfile
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn.functional as F
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Dataset
+from torch.utils.data.distributed import DistributedSampler
+
+from .adam_variant import ScaledAdam
+from .checkpoint import CheckpointManager
+from .conformer_model import lengths_to_padding_mask
+from .model_config import add_model_arguments, build_model
+
+
+class SyntheticDataset(Dataset):
+    """Random (features, targets) pairs, reproducible per index so every step sees a different batch."""
+
+    def __init__(self, num_samples, seq_len, input_dim, output_dim, seed = 0):
+        self.num_samples = num_samples
+        self.seq_len = seq_len
+        self.input_dim = input_dim
+        self.output_dim = output_dim
+        self.seed = seed
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getitem__(self, idx):
+        generator = torch.Generator().manual_seed(self.seed + idx)
+        features = torch.randn(self.seq_len, self.input_dim, generator=generator)
+        targets = torch.randn(self.seq_len, self.output_dim, generator=generator)
+        return features, targets, self.seq_len
+
+
+class FeatureDataset(Dataset):
+    """
+    Directory of ``*.pt`` files holding ``{"features": (T, input_dim), "targets": (T, output_dim)}``.
+    Sequences are cropped or zero padded to ``seq_len``, the length the horizontal branch is built for, and
+    returned with their number of valid frames.
+    """
+
+    def __init__(self, directory, seq_len):
+        self.files = sorted(glob.glob(os.path.join(directory, "*.pt")))
+        if not self.files:
+            raise ValueError("No .pt files found in [{}]".format(directory))
+        self.seq_len = seq_len
+
+    def __len__(self):
+        return len(self.files)
+
+    def _fit(self, x):
+        x = x[:self.seq_len]
+        return F.pad(x, (0, 0, 0, self.seq_len - x.size(0)))
+
+    def __getitem__(self, idx):
+        sample = torch.load(self.files[idx])
+        length = min(self.seq_len, sample["features"].size(0))
+        return self._fit(sample["features"].float()), self._fit(sample["targets"].float()), length
+
+
+def build_optimizer(args, model):
+    if args.optimizer == "scaled_adam":
+        return ScaledAdam(model.parameters(), lr=args.lr)
+    return torch.optim.Adam(model.parameters(), lr=args.lr)
+
+
+def build_dataset(args):
+    if args.data_dir:
+        return FeatureDataset(args.data_dir, args.seq_len)
+    return SyntheticDataset(args.num_samples, args.seq_len, args.input_dim, args.output_dim, seed=args.seed)
+
+
+def _batches(loader, sampler):
+    epoch = 0
+    while True:
+        sampler.set_epoch(epoch)
+        yield from loader
+        epoch += 1
+
+
+def train_worker(rank, world_size, args):
+    distributed = world_size > 1
+    if distributed:
+        dist.init_process_group(args.backend, rank=rank, world_size=world_size)
+    # Workers share the cores of their own node, torchrun gives their number as LOCAL_WORLD_SIZE
+    local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", world_size))
+    torch.set_num_threads(args.threads_per_worker or max(1, (os.cpu_count() or 1) // local_world_size))
+    torch.autograd.set_detect_anomaly(args.detect_anomaly)
+    torch.manual_seed(args.seed)
+
+    model = build_model(args)
+    optimizer = build_optimizer(args, model)
+    checkpoints = CheckpointManager(args.checkpoint_dir, keep_last=args.keep_last) if args.checkpoint_dir else None
+    start_step = 1
+    if checkpoints is not None and args.resume:
+        state = checkpoints.restore(model, optimizer)
+        if state is not None:
+            start_step = state["step"] + 1
+            if rank == 0:
+                print(f"resumed from step {state['step']}", flush=True)
+    if distributed:
+        # Gradients are all-reduced bucket by bucket while the rest of the backward pass is still running
+        model = DistributedDataParallel(model, bucket_cap_mb=args.bucket_cap_mb, gradient_as_bucket_view=True)
+
+    dataset = build_dataset(args)
+    sampler = DistributedSampler(dataset, num_replicas=world_size, rank=rank, shuffle=True, seed=args.seed)
+    loader = DataLoader(dataset, batch_size=args.batch_size, sampler=sampler, num_workers=args.num_workers,
+                        drop_last=True)
+    batches = _batches(loader, sampler)
+
+    frames_per_step = args.batch_size * args.seq_len * args.accumulation_steps
+    timed_steps, timed_seconds = 0, 0.
+    interval_steps, interval_seconds, interval_loss = 0, 0., 0.
+    model.train()
+    for step in range(start_step, args.steps + 1):
+        start = time.perf_counter()
+        optimizer.zero_grad(set_to_none=True)
+        step_loss = 0.
+        for micro_step in range(args.accumulation_steps):
+            features, targets, lengths = next(batches)
+            # Only the last micro-batch all-reduces, the others accumulate locally
+            sync = not distributed or micro_step == args.accumulation_steps - 1
+            with model.no_sync() if not sync else contextlib.nullcontext():
+                # The loss only covers the valid frames, padding contributes neither to it nor to the encoder
+                valid = ~lengths_to_padding_mask(lengths, features.size(1))
+                output = model(features, targets, lengths)
+                loss = F.mse_loss(output[valid], targets[valid]) / args.accumulation_steps
+                loss.backward()
+            step_loss += loss.item()
+        optimizer.step()
+        seconds = time.perf_counter() - start
+
+        if step > args.warmup_steps:
+            timed_steps += 1
+            timed_seconds += seconds
+        interval_steps += 1
+        interval_seconds += seconds
+        interval_loss += step_loss
+        if step % args.log_interval == 0 or step == args.steps:
+            stats = torch.tensor([interval_loss / interval_steps, frames_per_step * interval_steps / interval_seconds])
+            if distributed:
+                dist.all_reduce(stats)
+                stats[0] /= world_size
+            if rank == 0:
+                print(f"step {step:>6}  loss {stats[0].item():.5f}  "
+                      f"{stats[1].item() / world_size:,.0f} frames/s/worker  {stats[1].item():,.0f} frames/s total",
+                      flush=True)
+            interval_steps, interval_seconds, interval_loss = 0, 0., 0.
+        if checkpoints is not None and rank == 0 and (step % args.checkpoint_interval == 0 or step == args.steps):
+            # Returns once the state is copied to CPU, the file is written in the background
+            checkpoints.save(step, model, optimizer, config=vars(args))
+
+    if checkpoints is not None:
+        checkpoints.close()
+
+    per_worker = torch.tensor([frames_per_step * timed_steps / timed_seconds if timed_seconds else 0.])
+    if distributed:
+        dist.all_reduce(per_worker)
+        per_worker /= world_size
+    if rank == 0 and args.metrics_file:
+        with open(args.metrics_file, "w") as f:
+            json.dump({"world_size": world_size, "frames_per_s_per_worker": per_worker.item(),
+                       "frames_per_s": per_worker.item() * world_size, "steps": args.steps}, f)
+    if distributed:
+        dist.destroy_process_group()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def launch(args, nprocs):
+    if "WORLD_SIZE" in os.environ and "RANK" in os.environ:
+        # Started by torchrun (possibly on several nodes): one process per rank already exists
+        train_worker(int(os.environ["RANK"]), int(os.environ["WORLD_SIZE"]), args)
+    elif nprocs == 1:
+        train_worker(0, 1, args)
+    else:
+        os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+        os.environ["MASTER_PORT"] = str(args.master_port or _free_port())
+        mp.spawn(train_worker, args=(nprocs, args), nprocs=nprocs, join=True)
+
+
+def scaling_study(args):
+    """Train with every process count of ``args.scaling_study`` and report throughput and scaling efficiency."""
+    results = []
+    for nprocs in args.scaling_study:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+            args.metrics_file = f.name
+        launch(args, nprocs)
+        with open(args.metrics_file) as f:
+            results.append(json.load(f))
+        os.remove(args.metrics_file)
+    base = results[0]["frames_per_s"] / results[0]["world_size"]
+    print(f"{'procs':>5} {'frames/s':>12} {'frames/s/worker':>16} {'speed-up':>9} {'efficiency':>11}")
+    for result in results:
+        speedup = result["frames_per_s"] / base
+        print(f"{result['world_size']:>5} {result['frames_per_s']:>12,.0f} {result['frames_per_s_per_worker']:>16,.0f} "
+              f"{speedup:>9.2f} {100 * speedup / result['world_size']:>10.1f}%")
+    return results
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_model_arguments(parser)
+
+    train = parser.add_argument_group("training")
+    train.add_argument("--steps", type=int, default=100, help="optimizer steps")
+    train.add_argument("--batch-size", type=int, default=10, help="per worker and micro-batch")
+    train.add_argument("--accumulation-steps", type=int, default=1)
+    train.add_argument("--optimizer", default="scaled_adam", choices=["scaled_adam", "adam"])
+    train.add_argument("--lr", type=float, default=1e-5)
+    train.add_argument("--seed", type=int, default=0)
+    train.add_argument("--detect-anomaly", action="store_true", help="autograd anomaly detection (slow, debugging only)")
+    train.add_argument("--log-interval", type=int, default=10)
+    train.add_argument("--warmup-steps", type=int, default=1, help="steps left out of the throughput summary")
+    train.add_argument("--metrics-file", default=None, help="write the throughput summary of rank 0 as JSON")
+
+    ckpt = parser.add_argument_group("checkpoints")
+    ckpt.add_argument("--checkpoint-dir", default=None)
+    ckpt.add_argument("--checkpoint-interval", type=int, default=1000, help="optimizer steps between checkpoints")
+    ckpt.add_argument("--keep-last", type=int, default=3)
+    ckpt.add_argument("--resume", action="store_true", help="continue from the latest checkpoint in --checkpoint-dir")
+
+    data = parser.add_argument_group("data")
+    data.add_argument("--data-dir", default=None, help="directory of .pt samples, synthetic data when not given")
+    data.add_argument("--num-samples", type=int, default=10000, help="size of the synthetic dataset")
+    data.add_argument("--num-workers", type=int, default=0, help="DataLoader workers per process")
+
+    parallel = parser.add_argument_group("parallelism")
+    parallel.add_argument("--nprocs", type=int, default=1, help="local worker processes")
+    parallel.add_argument("--backend", default="gloo")
+    parallel.add_argument("--master-port", type=int, default=None)
+    parallel.add_argument("--bucket-cap-mb", type=float, default=25.)
+    parallel.add_argument("--threads-per-worker", type=int, default=None, help="default: cores / processes")
+    parallel.add_argument("--scaling-study", type=int, nargs="+", default=None, metavar="NPROCS",
+                          help="train once per process count and report scaling efficiency")
+    args = parser.parse_args(argv)
+    if args.accumulation_steps < 1:
+        parser.error("--accumulation-steps must be >= 1")
+    return args
+
+
+def main(argv = None):
+    args = parse_args(argv)
+    if args.scaling_study:
+        scaling_study(args)
+    else:
+        launch(args, args.nprocs)
+
+
+if __name__ == "__main__":
+    main()
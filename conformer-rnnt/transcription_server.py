@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""transcription_server.py
+
+Local asyncio transcription service for ConformerRNNT (no network access or
+extra packages needed). Incoming requests are queued and grouped into
+micro-batches: a batch is dispatched when ``max_batch`` requests are waiting or
+the oldest one has waited ``max_wait_ms``. Every batch runs the feature
+frontend, the encoder and batched greedy decoding on a worker thread, and the
+results are handed back to the individual requests. Decoding is only batched
+for causal prediction networks (``decoder_type`` unidirectional or stateless);
+the bidirectional decoder, the training default, decodes one request at a time
+and the server warns about it at startup.
+
+HTTP/1.1 over TCP or a Unix socket, JSON bodies:
+
+    POST /transcribe  {"features": [[...], ...]}                 (T, input_dim) feature frames
+                      {"audio": [...], "sample_rate": 16000}     raw waveform, through the frontend
+                  ->  {"tokens": [...], "frames": [...], "latency_ms": ..., "batch_size": ...}
+    GET  /metrics     queue depth, batch sizes and latency percentiles
+    GET  /health
+
+    python -m conformer_rnnt.transcription_server --port 8000 --max-batch 16 --max-wait-ms 10
+    python -m conformer_rnnt.transcription_server --unix-socket /tmp/amt.sock --checkpoint ckpt/checkpoint-00001000.pt
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from .checkpoint import load_for_inference
+from .model_config import add_model_arguments, build_model, with_checkpoint_config
+
+
+class RequestError(ValueError):
+    """A request that cannot be served, reported to the client with ``status``."""
+
+    def __init__(self, message, status = 400):
+        super().__init__(message)
+        self.status = status
+
+
+class LogMelFrontend:
+    """Log-mel spectrogram frontend for raw audio requests, torchaudio is imported on first use."""
+
+    def __init__(self, n_mels, n_fft = 1024, hop_length = 512):
+        self.n_mels = n_mels
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self._transforms = {}
+
+    def __call__(self, waveform, sample_rate):
+        transform = self._transforms.get(sample_rate)
+        if transform is None:
+            try:
+                import torchaudio
+            except ImportError:
+                raise RequestError("raw audio requests need torchaudio, send features instead", status=501)
+            transform = torchaudio.transforms.MelSpectrogram(sample_rate=sample_rate, n_fft=self.n_fft,
+                                                             hop_length=self.hop_length, n_mels=self.n_mels)
+            self._transforms[sample_rate] = transform
+        # (n_mels, T) -> (T, n_mels)
+        return torch.log(transform(waveform) + 1e-6).transpose(0, 1)
+
+
+class Transcriber:
+    """Runs a micro-batch of requests through the frontend, the encoder and batched greedy decoding."""
+
+    def __init__(self, model, seq_len, input_dim, frontend = None):
+        self.model = model.eval()
+        self.seq_len = seq_len
+        self.input_dim = input_dim
+        self.frontend = frontend or LogMelFrontend(input_dim)
+
+    def features(self, request):
+        if "features" in request:
+            features = torch.as_tensor(request["features"], dtype=torch.float32)
+        elif "audio" in request:
+            waveform = torch.as_tensor(request["audio"], dtype=torch.float32)
+            features = self.frontend(waveform, int(request.get("sample_rate", 16000)))
+        else:
+            raise RequestError("request needs 'features' or 'audio'")
+        if features.dim() != 2 or features.size(1) != self.input_dim:
+            raise RequestError(f"features must be (T, {self.input_dim}), got {tuple(features.shape)}")
+        if not 0 < features.size(0) <= self.seq_len:
+            raise RequestError(f"between 1 and {self.seq_len} frames per request, got {features.size(0)}", status=413)
+        return features
+
+    @torch.inference_mode()
+    def __call__(self, requests):
+        """Returns one result (or RequestError) per request."""
+        results = [None] * len(requests)
+        batch, index = [], []
+        for i, request in enumerate(requests):
+            try:
+                batch.append(self.features(request))
+                index.append(i)
+            except RequestError as e:
+                results[i] = e
+            except (TypeError, ValueError, RuntimeError) as e:
+                results[i] = RequestError(f"invalid request: {e}")
+        if batch:
+            lengths = torch.tensor([f.size(0) for f in batch])
+            # The horizontal branch is built for exactly seq_len frames, shorter requests are zero padded
+            inputs = batch[0].new_zeros(len(batch), self.seq_len, self.input_dim)
+            for row, features in enumerate(batch):
+                inputs[row, :features.size(0)] = features
+            tokens, frames = self.model.recognize(inputs, lengths, return_timestamps=True)
+            for row, i in enumerate(index):
+                results[i] = {"tokens": tokens[row], "frames": frames[row]}
+        return results
+
+
+class LatencyWindow:
+    def __init__(self, size = 10000):
+        self.values = collections.deque(maxlen=size)
+
+    def add(self, value):
+        self.values.append(value)
+
+    def percentiles(self, *qs):
+        if not self.values:
+            return {f"p{q}": None for q in qs}
+        ordered = sorted(self.values)
+        return {f"p{q}": ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))] for q in qs}
+
+
+class MicroBatcher:
+    """
+    Groups requests submitted from the event loop into micro-batches for ``transcriber``.
+
+    Args:
+        transcriber: callable taking a list of requests and returning one result per request
+        max_batch (int): largest micro-batch
+        max_wait_ms (float): longest time the first request of a batch waits for more to arrive
+        workers (int): micro-batches processed concurrently on the thread pool
+    """
+
+    def __init__(self, transcriber, max_batch = 16, max_wait_ms = 10., workers = 1):
+        self.transcriber = transcriber
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1e3
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="transcriber")
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(workers)
+        self.latency = LatencyWindow()
+        self.queue_wait = LatencyWindow()
+        self.batch_sizes = LatencyWindow()
+        self.completed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self._collector = None
+
+    def start(self):
+        self._collector = asyncio.get_running_loop().create_task(self._collect())
+
+    async def stop(self):
+        if self._collector is not None:
+            self._collector.cancel()
+            try:
+                await self._collector
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, request):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((time.perf_counter(), request, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Wait for a free worker first, requests keep queueing (and batches keep growing) meanwhile
+            await self.slots.acquire()
+            batch = [await self.queue.get()]
+            deadline = batch[0][0] + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    # Past the deadline, still take whatever is already queued
+                    while len(batch) < self.max_batch and not self.queue.empty():
+                        batch.append(self.queue.get_nowait())
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            loop.create_task(self._run(batch))
+
+    async def _run(self, batch):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        self.in_flight += len(batch)
+        try:
+            results = await loop.run_in_executor(self.executor, self.transcriber, [request for _, request, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        finally:
+            self.in_flight -= len(batch)
+            self.slots.release()
+        done = time.perf_counter()
+        self.batch_sizes.add(len(batch))
+        for (submitted, _, future), result in zip(batch, results):
+            self.queue_wait.add(started - submitted)
+            if future.cancelled():
+                continue
+            if isinstance(result, Exception):
+                self.failed += 1
+                future.set_exception(result)
+            else:
+                self.completed += 1
+                latency = done - submitted
+                self.latency.add(latency)
+                future.set_result(dict(result, latency_ms=1e3 * latency, batch_size=len(batch)))
+
+    def metrics(self):
+        to_ms = lambda d: {k: (None if v is None else 1e3 * v) for k, v in d.items()}
+        sizes = self.batch_sizes.values
+        return {
+            "queue_depth": self.queue.qsize(),
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "mean_batch_size": sum(sizes) / len(sizes) if sizes else None,
+            "latency_ms": to_ms(self.latency.percentiles(50, 90, 99)),
+            "queue_wait_ms": to_ms(self.queue_wait.percentiles(50, 90, 99)),
+            "max_batch": self.max_batch,
+            "max_wait_ms": 1e3 * self.max_wait,
+            "workers": self.workers,
+        }
+
+
+# HTTP
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           500: "Internal Server Error", 501: "Not Implemented"}
+
+
+async def _write_response(writer, status, payload, keep_alive):
+    body = json.dumps(payload).encode()
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode() + body)
+    await writer.drain()
+
+
+class TranscriptionServer:
+    def __init__(self, batcher, max_body_bytes = 64 * 2 ** 20):
+        self.batcher = batcher
+        self.max_body_bytes = max_body_bytes
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                keep_alive = headers.get("connection", "").lower() != "close"
+                length = int(headers.get("content-length", 0))
+                if length > self.max_body_bytes:
+                    await _write_response(writer, 413, {"error": "request body too large"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                status, payload = await self.route(method, path, body)
+                await _write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        if path == "/transcribe":
+            if method != "POST":
+                return 405, {"error": "use POST"}
+            try:
+                request = json.loads(body)
+            except ValueError as e:
+                return 400, {"error": f"invalid JSON: {e}"}
+            try:
+                return 200, await self.batcher.submit(request)
+            except RequestError as e:
+                return e.status, {"error": str(e)}
+            except Exception as e:
+                return 500, {"error": f"{type(e).__name__}: {e}"}
+        if path == "/metrics":
+            return 200, self.batcher.metrics()
+        if path == "/health":
+            return 200, {"status": "ok"}
+        return 404, {"error": f"unknown path {path}"}
+
+
+def build_transcriber(args):
+    if args.checkpoint:
+        # The architecture is the one of the training run that wrote the checkpoint, the flags are only used for
+        # checkpoints saved without a config
+        args = with_checkpoint_config(args, args.checkpoint)
+    model = build_model(args)
+    if args.checkpoint:
+        load_for_inference(args.checkpoint, model)
+    return Transcriber(model, args.seq_len, args.input_dim)
+
+
+async def serve(args):
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    transcriber = build_transcriber(args)
+    if not transcriber.model.decoder.supports_step:
+        warnings.warn("the bidirectional decoder has no step(), micro-batches are decoded one request at a time; "
+                      "train with --decoder-type unidirectional or stateless for batched decoding")
+    batcher = MicroBatcher(transcriber, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms, workers=args.workers)
+    batcher.start()
+    server = TranscriptionServer(batcher)
+    if args.unix_socket:
+        if os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+        listener = await asyncio.start_unix_server(server.handle, path=args.unix_socket)
+        where = args.unix_socket
+    else:
+        listener = await asyncio.start_server(server.handle, host=args.host, port=args.port)
+        where = f"http://{args.host}:{args.port}"
+    print(f"serving on {where} (max_batch={args.max_batch}, max_wait_ms={args.max_wait_ms}, workers={args.workers})",
+          flush=True)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await batcher.stop()
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix-socket", default=None, help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--max-batch", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, default=10.)
+    parser.add_argument("--workers", type=int, default=1, help="micro-batches run concurrently")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--checkpoint", default=None, help="mapped with load_for_inference, random weights otherwise")
+    # Same model flags as training, a checkpoint's own config takes precedence over them
+    add_model_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv = None):
+    try:
+        asyncio.run(serve(parse_args(argv)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
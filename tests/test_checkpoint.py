@@ -0,0 +1,85 @@
+"""Checkpoints written in the background restore the exact model and optimizer state."""
+
+import os
+
+import pytest
+import torch
+
+from conformer_rnnt.checkpoint import CheckpointManager, load_checkpoint, load_for_inference
+
+
+def build():
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Linear(8, 16), torch.nn.BatchNorm1d(16), torch.nn.Linear(16, 4))
+    return model, torch.optim.Adam(model.parameters(), lr=1e-2)
+
+
+def train(model, optimizer, steps):
+    generator = torch.Generator().manual_seed(1)
+    for _ in range(steps):
+        optimizer.zero_grad()
+        model(torch.randn(5, 8, generator=generator)).pow(2).mean().backward()
+        optimizer.step()
+
+
+def assert_same_state(a, b):
+    assert a.keys() == b.keys()
+    for key in a:
+        if isinstance(a[key], torch.Tensor):
+            torch.testing.assert_close(a[key], b[key], rtol=0, atol=0)
+        elif isinstance(a[key], dict):
+            assert_same_state(a[key], b[key])
+        else:
+            assert a[key] == b[key]
+
+
+def test_round_trip(tmp_path):
+    model, optimizer = build()
+    train(model, optimizer, 3)
+    with CheckpointManager(str(tmp_path)) as manager:
+        path = manager.save(3, model, optimizer, config={"hidden": 16})
+        # Training goes on while the snapshot is written, the file holds the state at save time
+        expected_model = {key: value.clone() for key, value in model.state_dict().items()}
+        expected_steps = [state["step"].clone() for state in optimizer.state_dict()["state"].values()]
+        train(model, optimizer, 2)
+
+        restored, restored_optimizer = build()
+        state = manager.restore(restored, restored_optimizer)
+    assert state["step"] == 3 and state["config"] == {"hidden": 16}
+    assert manager.latest() == path
+    assert_same_state(restored.state_dict(), expected_model)
+    assert [s["step"] for s in restored_optimizer.state_dict()["state"].values()] == expected_steps
+
+
+def test_resumed_training_matches(tmp_path):
+    model, optimizer = build()
+    train(model, optimizer, 2)
+    with CheckpointManager(str(tmp_path)) as manager:
+        manager.save(2, model, optimizer)
+    train(model, optimizer, 2)
+
+    resumed, resumed_optimizer = build()
+    CheckpointManager(str(tmp_path)).restore(resumed, resumed_optimizer)
+    train(resumed, resumed_optimizer, 2)
+    assert_same_state(resumed.state_dict(), model.state_dict())
+    assert_same_state(resumed_optimizer.state_dict(), optimizer.state_dict())
+
+
+def test_keep_last_and_inference_load(tmp_path):
+    model, optimizer = build()
+    with CheckpointManager(str(tmp_path), keep_last=2) as manager:
+        for step in range(1, 5):
+            train(model, optimizer, 1)
+            manager.save(step, model, optimizer)
+        manager.wait()
+        assert [os.path.basename(p) for p in manager.checkpoints()] == ["checkpoint-00000003.pt",
+                                                                         "checkpoint-00000004.pt"]
+    mapped = load_for_inference(manager.latest(), build()[0])
+    assert not mapped.training
+    assert_same_state(mapped.state_dict(), model.state_dict())
+    assert_same_state(load_checkpoint(manager.latest(), mmap=False)["model"], model.state_dict())
+
+
+def test_keep_last_must_be_positive(tmp_path):
+    with pytest.raises(ValueError):
+        CheckpointManager(str(tmp_path), keep_last=0)
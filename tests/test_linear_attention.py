@@ -0,0 +1,59 @@
+"""LinearAttention: the chunked causal form, the step() recurrence and the naive masked form agree."""
+
+import pytest
+import torch
+
+from conformer_rnnt.attention_mechanisms import LinearAttention
+
+
+def qkv(seq_len, seed = 0):
+    generator = torch.Generator().manual_seed(seed)
+    return [torch.randn(2, 3, seq_len, 8, generator=generator, dtype=torch.float64) for _ in range(3)]
+
+
+def naive(attention, queries, keys, values, causal):
+    """phi(q) phi(k)^T as an explicit (T, T) matrix, lower triangular when causal, normalised per row."""
+    scores = torch.matmul(attention.features(queries, True), attention.features(keys, False).transpose(-2, -1))
+    if causal:
+        scores = scores.tril()
+    return torch.matmul(scores, values) / scores.sum(-1, keepdim=True)
+
+
+def build(feature_map, causal, chunk_size = 64):
+    torch.manual_seed(0)
+    return LinearAttention(8, feature_map=feature_map, num_features=12, causal=causal, chunk_size=chunk_size).double()
+
+
+@pytest.mark.parametrize("feature_map", LinearAttention.supported_feature_maps)
+@pytest.mark.parametrize("chunk_size", [1, 4, 64])
+@pytest.mark.parametrize("seq_len", [1, 13, 40])
+def test_causal_chunks_match_naive(feature_map, chunk_size, seq_len):
+    attention = build(feature_map, True, chunk_size)
+    queries, keys, values = qkv(seq_len)
+    torch.testing.assert_close(attention(queries, keys, values), naive(attention, queries, keys, values, True))
+
+
+@pytest.mark.parametrize("feature_map", LinearAttention.supported_feature_maps)
+def test_causal_matches_step_loop(feature_map):
+    attention = build(feature_map, True, chunk_size=4)
+    queries, keys, values = qkv(19, seed=1)
+    state, outputs = None, []
+    for t in range(queries.size(-2)):
+        output, state = attention.step(queries[..., t, :], keys[..., t, :], values[..., t, :], state)
+        outputs.append(output)
+    torch.testing.assert_close(torch.stack(outputs, dim=-2), attention(queries, keys, values))
+
+
+@pytest.mark.parametrize("feature_map", LinearAttention.supported_feature_maps)
+def test_non_causal_matches_naive(feature_map):
+    attention = build(feature_map, False)
+    queries, keys, values = qkv(21, seed=2)
+    torch.testing.assert_close(attention(queries, keys, values), naive(attention, queries, keys, values, False))
+
+
+def test_key_padding_mask():
+    attention = build("elu", False)
+    queries, keys, values = qkv(21, seed=3)
+    output = attention(queries, keys, values, mask=torch.arange(21)[None, :] >= torch.tensor([[21], [9]]))
+    torch.testing.assert_close(output[0], attention(queries, keys, values)[0])
+    torch.testing.assert_close(output[1], attention(queries[1:], keys[1:, :, :9], values[1:, :, :9])[0])
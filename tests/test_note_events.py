@@ -0,0 +1,29 @@
+"""notes_to_midi only writes valid MIDI data bytes."""
+
+import numpy as np
+import pytest
+
+from conformer_rnnt.note_events import NoteVocabulary, Notes, notes_to_midi
+
+
+def test_vocabulary_pitch_range():
+    NoteVocabulary(num_pitches=128, lowest_pitch=0)
+    with pytest.raises(ValueError):
+        NoteVocabulary(num_pitches=88, lowest_pitch=41)
+    with pytest.raises(ValueError):
+        NoteVocabulary(lowest_pitch=-1)
+
+
+def test_velocities_are_clamped():
+    notes = Notes(np.array([0, 0]), np.array([60, 64]), np.array([0, 2]), np.array([3, 5]), np.array([300, 0]))
+    # Header and track chunk header (22 bytes), tempo and program change (10 bytes), end of track (4 bytes)
+    events = notes_to_midi(notes)[0][32:-4]
+    # Delta time, status, pitch, velocity: the two note-ons come first
+    assert events[1:4] == bytes([0x90, 60, 127])
+    assert events[5:8] == bytes([0x90, 64, 1])
+
+
+def test_pitches_out_of_range_raise():
+    notes = Notes(np.array([0]), np.array([128]), np.array([0]), np.array([3]), np.array([64]))
+    with pytest.raises(ValueError):
+        notes_to_midi(notes)
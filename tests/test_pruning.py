@@ -0,0 +1,57 @@
+"""A keep-all plan leaves the model unchanged, and pruned checkpoints rebuild into the same model."""
+
+import argparse
+import copy
+
+import torch
+
+from conformer_rnnt.checkpoint import load_for_inference
+from conformer_rnnt.model_config import add_model_arguments, build_model, with_checkpoint_config
+from conformer_rnnt.pruning import apply_plan, importance, model_size, plan_pruning, save_pruned
+
+
+def model_args(*argv):
+    parser = argparse.ArgumentParser()
+    add_model_arguments(parser)
+    return parser.parse_args(["--input-dim", "16", "--seq-len", "24", "--num-enc-layers", "4", "--hidden-dim", "32",
+                              "--output-dim", "10", "--num-dec-layers", "1", "--decoder-type", "stateless", *argv])
+
+
+def inputs():
+    generator = torch.Generator().manual_seed(0)
+    return torch.randn(3, 24, 16, generator=generator), torch.tensor([24, 17, 9])
+
+
+def test_keep_all_plan_is_identity():
+    torch.manual_seed(0)
+    model = build_model(model_args()).eval()
+    # A share too small to remove a unit still yields an entry, with every index, for every prunable module
+    plan = plan_pruning(model, importance(model), heads=1e-6, ffn=1e-6, conv=1e-6)
+    assert plan
+    for branch in ("layers_vertical", "layers_horizontal"):
+        plan[branch] = list(range(len(getattr(model.encoder, branch))))
+    pruned = apply_plan(copy.deepcopy(model), plan)
+    assert model_size(pruned) == model_size(model)
+    with torch.no_grad():
+        torch.testing.assert_close(pruned.encoder(*inputs()), model.encoder(*inputs()))
+        assert pruned.recognize(*inputs()) == model.recognize(*inputs())
+
+
+def test_pruned_checkpoint_rebuilds(tmp_path):
+    torch.manual_seed(0)
+    args = model_args("--vertical-attention", "sliding_window", "--attention-window", "4")
+    model = build_model(args).eval()
+    config = vars(args)
+    for step in range(2):
+        # Prune twice, the second plan refers to the modules of the once pruned model
+        plan = plan_pruning(model, importance(model), heads=0.5, ffn=0.5, conv=0.5, vertical_blocks=1)
+        apply_plan(model, plan)
+        path = str(tmp_path / f"pruned-{step}.pt")
+        save_pruned(path, model, plan, config)
+        config = vars(with_checkpoint_config(model_args(), path))
+    assert len(config["pruning_plans"]) == 2
+
+    rebuilt = load_for_inference(path, build_model(with_checkpoint_config(model_args(), path)))
+    assert model_size(rebuilt) == model_size(model)
+    with torch.no_grad():
+        torch.testing.assert_close(rebuilt.encoder(*inputs()), model.encoder(*inputs()))
@@ -0,0 +1,62 @@
+"""SlidingWindowAttention is dense attention with a band mask, global rows and columns excepted."""
+
+import pytest
+import torch
+
+from conformer_rnnt.attention_mechanisms import DotProductAttention, MultiHeadSelfAttention, SlidingWindowAttention
+
+
+def band_mask(seq_len, window, global_tokens):
+    positions = torch.arange(seq_len)
+    outside = (positions[:, None] - positions[None, :]).abs() > window
+    outside[:global_tokens, :] = False
+    outside[:, :global_tokens] = False
+    return outside
+
+
+def qkv(seq_len, seed = 0):
+    generator = torch.Generator().manual_seed(seed)
+    return [torch.randn(2, 3, seq_len, 8, generator=generator, dtype=torch.float64) for _ in range(3)]
+
+
+@pytest.mark.parametrize("global_tokens", [0, 3])
+@pytest.mark.parametrize("window", [1, 4, 16])
+@pytest.mark.parametrize("seq_len", [5, 37, 64])
+def test_matches_band_masked_dense(seq_len, window, global_tokens):
+    queries, keys, values = qkv(seq_len)
+    expected = DotProductAttention()(queries, keys, values, mask=band_mask(seq_len, window, global_tokens))
+    output = SlidingWindowAttention(window, global_tokens)(queries, keys, values)
+    torch.testing.assert_close(output, expected)
+
+
+@pytest.mark.parametrize("global_tokens", [0, 2])
+def test_key_padding_mask(global_tokens):
+    seq_len, window = 29, 4
+    queries, keys, values = qkv(seq_len, seed=1)
+    lengths = torch.tensor([seq_len, 17])
+    padding = torch.arange(seq_len)[None, :] >= lengths[:, None]
+    mask = band_mask(seq_len, window, global_tokens) | padding[:, None, None, :]
+    expected = DotProductAttention()(queries, keys, values, mask=mask)
+    output = SlidingWindowAttention(window, global_tokens)(queries, keys, values, mask=padding)
+    # Padded queries only see padded keys, their output is not defined
+    for b, length in enumerate(lengths.tolist()):
+        torch.testing.assert_close(output[b, :, :length], expected[b, :, :length])
+
+
+def test_full_mask():
+    seq_len, window = 23, 3
+    queries, keys, values = qkv(seq_len, seed=2)
+    # A 2-D mask is a (batch, T) key padding mask, full masks carry the batch and head dimensions
+    causal = torch.ones(1, 1, seq_len, seq_len, dtype=torch.bool).triu(1)
+    expected = DotProductAttention()(queries, keys, values, mask=band_mask(seq_len, window, 0) | causal)
+    torch.testing.assert_close(SlidingWindowAttention(window)(queries, keys, values, mask=causal), expected)
+
+
+def test_window_covering_sequence_is_dense():
+    torch.manual_seed(0)
+    dense = MultiHeadSelfAttention(32, dim_head=8, heads=4).double().eval()
+    banded = MultiHeadSelfAttention(32, dim_head=8, heads=4, attention_type="sliding_window",
+                                    attention_window=40).double().eval()
+    banded.load_state_dict(dense.state_dict())
+    x = torch.randn(2, 40, 32, dtype=torch.float64)
+    torch.testing.assert_close(banded(x), dense(x))